@@ -0,0 +1,58 @@
+"""
+Measures --search-chats and --list-chats latency over many stored chats.
+
+Usage: python scripts/bench_chat_search.py [chats]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sgpt.handlers.chat_handler import ChatSession
+
+TOPICS = "docker kubernetes python rust shell bash git merge timeout disk".split()
+# Synthetic vocabulary with Zipf-like word frequencies, like natural text.
+VOCABULARY = [f"word{rank}" for rank in range(20_000)] + TOPICS
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def sentence(words: int) -> str:
+    return " ".join(random.choices(VOCABULARY, WEIGHTS, k=words))
+
+
+def main() -> None:
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    random.seed(0)
+    with TemporaryDirectory() as folder:
+        session = ChatSession(100, Path(folder) / "chats")
+        started = time.perf_counter()
+        for index in range(chats):
+            messages = [
+                {"role": role, "content": sentence(30)}
+                for role in ("system", "user", "assistant", "user", "assistant")
+            ]
+            session._write(messages, f"chat_{index}")
+        elapsed = time.perf_counter() - started
+        print(f"indexed {chats} chats: {elapsed / chats * 1000:.2f} ms/chat")
+
+        queries = ("word1", "word10 word20", "docker", "git merge", "missing")
+        for query in queries:
+            started = time.perf_counter()
+            rounds = 20
+            for _ in range(rounds):
+                results = session.search(query, 20)
+            elapsed = (time.perf_counter() - started) / rounds
+            print(f"{query!r:>22}: {elapsed * 1000:7.2f} ms, {len(results)} results")
+
+        for sort in ("used", "size", "name"):
+            started = time.perf_counter()
+            chats_page = session.list(sort, limit=20)
+            elapsed = time.perf_counter() - started
+            print(
+                f"list by {sort:>14}: {elapsed * 1000:7.2f} ms, {len(chats_page)} chats"
+            )
+
+
+if __name__ == "__main__":
+    main()
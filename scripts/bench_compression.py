@@ -0,0 +1,91 @@
+"""
+Measures read/write latency and disk usage of request cache and chats
+with each STORAGE_COMPRESSION method. README is used as completion text.
+
+Usage: python scripts/bench_compression.py [entries]
+"""
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sgpt.cache import Cache, SqliteCache
+from sgpt.handlers.chat_handler import ChatSession
+
+README = (Path(__file__).parent.parent / "README.md").read_text(encoding="utf-8")
+
+
+def methods() -> list[str]:
+    try:
+        from sgpt.compress import _zstd
+
+        _zstd()
+        return ["none", "zlib", "zstd"]
+    except ImportError:
+        return ["none", "zlib"]
+
+
+def folder_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def bench_cache(cache_class: type, method: str, entries: int, size: int) -> None:
+    texts = [README[index * 7 % len(README) :][:size] for index in range(entries)]
+    keys = [f"{index:032x}" for index in range(entries)]
+    with TemporaryDirectory() as folder:
+        cache = cache_class(entries, Path(folder), compression=method)
+        started = time.perf_counter()
+        for key, text in zip(keys, texts, strict=True):
+            cache._set(key, cache._encode([text]))
+        write = (time.perf_counter() - started) / entries
+        started = time.perf_counter()
+        for key in keys:
+            cache._get(key)
+        read = (time.perf_counter() - started) / entries
+        if isinstance(cache, SqliteCache):
+            cache.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        stored = folder_size(Path(folder))
+    print(
+        f"{cache_class.__name__:>11} {method:>4} {size:>6} B: "
+        f"write {write * 1e6:7.1f} us, read {read * 1e6:7.1f} us, "
+        f"{stored / (entries * size):6.1%} of text size"
+    )
+
+
+def bench_chat(method: str, turns: int) -> None:
+    with TemporaryDirectory() as folder:
+        session = ChatSession(turns, Path(folder) / "chats", method)
+        started = time.perf_counter()
+        for index in range(turns):
+            answer = README[index * 1000 % len(README) :][:1000]
+            messages = [
+                {"role": "user", "content": f"question {index}"},
+                {"role": "assistant", "content": answer},
+            ]
+            session._write(messages, "chat")
+        write = (time.perf_counter() - started) / turns
+        session._cache.clear()
+        started = time.perf_counter()
+        messages = session._load("chat")
+        read = time.perf_counter() - started
+        text_size = sum(len(message["content"]) for message in messages)
+        stored = folder_size(Path(folder) / "chats")
+    print(
+        f"{'ChatSession':>11} {method:>4} {turns:>4} turns: "
+        f"write {write * 1e6:7.1f} us/turn, read {read * 1e3:6.2f} ms, "
+        f"{stored / text_size:6.1%} of text size"
+    )
+
+
+def main() -> None:
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for cache_class in (Cache, SqliteCache):
+        for size in (200, 2_000, 20_000):
+            for method in methods():
+                bench_cache(cache_class, method, entries, size)
+    for method in methods():
+        bench_chat(method, 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Compares streaming throughput (chunks/sec) of TextPrinter and PlainPrinter
+when stdout is not a TTY. Printers write to /dev/null, results go to stderr.
+
+Usage: python scripts/bench_printer.py [chunks] [chunk_size]
+"""
+import os
+import sys
+import time
+from typing import Generator
+
+from sgpt.printer import PlainPrinter, Printer, TextPrinter
+
+
+def chunks(count: int, size: int) -> Generator[str, None, None]:
+    chunk = "x" * (size - 1)
+    for index in range(count):
+        # Roughly one new line per 80 characters, like regular completions.
+        yield chunk + ("\n" if index % max(1, 80 // size) == 0 else " ")
+
+
+def bench(printer: Printer, count: int, size: int) -> float:
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            start = time.perf_counter()
+            printer.live_print(chunks(count, size))
+            elapsed = time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+    return count / elapsed
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    printers = {"TextPrinter": TextPrinter("magenta"), "PlainPrinter": PlainPrinter()}
+    results = {name: bench(printer, count, size) for name, printer in printers.items()}
+    for name, rate in results.items():
+        print(f"{name:>12}: {rate:>12,.0f} chunks/sec", file=sys.stderr)
+    ratio = results["PlainPrinter"] / results["TextPrinter"]
+    print(f"{'speedup':>12}: {ratio:>12.1f}x", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures lookup latency of similar prompts index (CACHE_SIMILAR_ROLES)
+with many indexed prompts, for reworded prompts (hits) and new ones.
+
+Usage: python scripts/bench_similar_cache.py [prompts]
+"""
+import random
+import sys
+import time
+from itertools import accumulate
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sgpt.similar import SimilarIndex
+
+# Synthetic vocabulary with Zipf-like word frequencies, like natural text.
+VOCABULARY = [f"word{rank}" for rank in range(20_000)]
+WEIGHTS = list(accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def prompt() -> str:
+    return " ".join(
+        random.choices(VOCABULARY, cum_weights=WEIGHTS, k=random.randint(4, 16))
+    )
+
+
+def reword(text: str) -> str:
+    # Word order matters, only case, punctuation and filler words differ.
+    return f"Please, {text.upper()}?"
+
+
+def main() -> None:
+    prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    random.seed(0)
+    with TemporaryDirectory() as folder:
+        index = SimilarIndex(Path(folder) / "similar.sqlite3", prompts, 0.8)
+        texts = [prompt() for _ in range(prompts)]
+        started = time.perf_counter()
+        for number, text in enumerate(texts):
+            index.add(f"{number:032x}", "context", text)
+        elapsed = time.perf_counter() - started
+        size = sum(path.stat().st_size for path in Path(folder).iterdir())
+        print(
+            f"indexed {prompts} prompts: {elapsed / prompts * 1e6:.1f} us/prompt, "
+            f"{size / prompts:.0f} B/prompt"
+        )
+
+        rounds = 1_000
+        cases = {
+            "reworded": [reword(random.choice(texts)) for _ in range(rounds)],
+            "new": [prompt() for _ in range(rounds)],
+        }
+        for name, queries in cases.items():
+            found = 0
+            started = time.perf_counter()
+            for query in queries:
+                found += bool(index.lookup("context", query))
+            elapsed = (time.perf_counter() - started) / rounds
+            print(
+                f"{name:>9}: {elapsed * 1e6:7.1f} us/lookup, {found / rounds:.1%} hits"
+            )
+
+
+if __name__ == "__main__":
+    main()
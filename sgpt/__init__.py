@@ -1,2 +1,12 @@
-from .app import main as main
-from .app import entry_point as cli  # noqa: F401
+from typing import Any
+
+from .client import entry_point as cli  # noqa: F401
+
+
+def __getattr__(name: str) -> Any:
+    # Importing app is expensive, the "sgpt" executable (cli) might not need it.
+    if name == "main":
+        from .app import main
+
+        return main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,16 +3,21 @@ import os
 # To allow users to use arrow keys in the REPL.
 import readline  # noqa: F401
 import sys
+from pathlib import Path
 
 import typer
 from click import UsageError
 from click.types import Choice
 from prompt_toolkit import PromptSession
 
+from sgpt.chat_index import SORT_COLUMNS
 from sgpt.config import cfg
+from sgpt.daemon import run_daemon
 from sgpt.function import get_openai_schemas
+from sgpt.handlers.batch_handler import BatchHandler
 from sgpt.handlers.chat_handler import ChatHandler
 from sgpt.handlers.default_handler import DefaultHandler
+from sgpt.handlers.handler import Handler
 from sgpt.handlers.repl_handler import ReplHandler
 from sgpt.llm_functions.init_functions import install_functions as inst_funcs
 from sgpt.role import DefaultRoles, SystemRole
@@ -89,6 +94,54 @@ def main(
         True,
         help="Cache completion results.",
     ),
+    cache_stats: bool = typer.Option(
+        False,
+        "--cache-stats",
+        help="Show cache size, hit rate and saved request time.",
+        callback=Handler.cache_stats,
+        rich_help_panel="Cache Options",
+    ),
+    cache_ls: bool = typer.Option(
+        False,
+        "--cache-ls",
+        help="List cache entries.",
+        callback=Handler.cache_ls,
+        rich_help_panel="Cache Options",
+    ),
+    cache_purge: bool = typer.Option(
+        False,
+        "--cache-purge",
+        help="Remove cache entries.",
+        callback=Handler.cache_purge,
+        rich_help_panel="Cache Options",
+    ),
+    older_than: str = typer.Option(
+        None,
+        help="Remove only entries older than this, e.g. 7d, 12h or 30m.",
+        is_eager=True,
+        rich_help_panel="Cache Options",
+    ),
+    cache_export: str = typer.Option(
+        None,
+        help='Export cache entries to JSON Lines file, "-" for stdout.',
+        callback=Handler.cache_export,
+        rich_help_panel="Cache Options",
+    ),
+    cache_import: str = typer.Option(
+        None,
+        help='Import cache entries from --cache-export file, "-" for stdin.',
+        callback=Handler.cache_import,
+        rich_help_panel="Cache Options",
+    ),
+    replay_speed: float = typer.Option(
+        0.0,
+        min=0.0,
+        help="Pace of cached completions relative to original, 0 for no delays.",
+    ),
+    stats: bool = typer.Option(
+        cfg.get("SHOW_STATS") == "true",
+        help="Print request timings to stderr.",
+    ),
     version: bool = typer.Option(
         False,
         "--version",
@@ -118,6 +171,59 @@ def main(
         callback=ChatHandler.list_ids,
         rich_help_panel="Chat Options",
     ),
+    chats_sort: str = typer.Option(
+        None,
+        help=f"Sort --list-chats by {', '.join(SORT_COLUMNS)}, "
+        "least recently used first by default.",
+        is_eager=True,
+        rich_help_panel="Chat Options",
+    ),
+    chats_filter: str = typer.Option(
+        None,
+        help="List chats with id or role containing text.",
+        is_eager=True,
+        rich_help_panel="Chat Options",
+    ),
+    chats_limit: int = typer.Option(
+        None,
+        min=1,
+        help="List at most this many chats.",
+        is_eager=True,
+        rich_help_panel="Chat Options",
+    ),
+    chats_offset: int = typer.Option(
+        0,
+        min=0,
+        help="Skip this many chats when listing.",
+        is_eager=True,
+        rich_help_panel="Chat Options",
+    ),
+    chats_gc: bool = typer.Option(
+        False,
+        "--chats-gc",
+        help="Remove chats by age and total size.",
+        callback=ChatHandler.gc,
+        rich_help_panel="Chat Options",
+    ),
+    search_chats: str = typer.Option(
+        None,
+        help="Search messages of all chats.",
+        callback=ChatHandler.search,
+        rich_help_panel="Chat Options",
+    ),
+    batch: Path = typer.Option(
+        None,
+        exists=True,
+        dir_okay=False,
+        help="Run prompts from JSON Lines file, print results as JSON Lines.",
+        rich_help_panel="Batch Options",
+    ),
+    concurrency: int = typer.Option(
+        4,
+        min=1,
+        help="Number of --batch prompts to run at once.",
+        rich_help_panel="Batch Options",
+    ),
     role: str = typer.Option(
         None,
         help="System role for GPT model.",
@@ -143,6 +249,12 @@ def main(
         callback=SystemRole.list,
         rich_help_panel="Role Options",
     ),
+    daemon: bool = typer.Option(
+        False,
+        "--daemon",
+        help="Run daemon which keeps ShellGPT loaded to speed up next calls.",
+        callback=run_daemon,
+    ),
     install_integration: bool = typer.Option(
         False,
         help="Install shell integration (ZSH and Bash only)",
@@ -155,6 +267,18 @@ def main(
         callback=inst_funcs,
         hidden=True,  # Hiding since should be used only once.
     ),
+    compact_chat: str = typer.Option(
+        None,
+        help="Summarize older messages of the chat.",
+        callback=ChatHandler.compact_chat,
+        hidden=True,  # Hiding since it is run by --chat in background.
+    ),
+    refresh_cache: str = typer.Option(
+        None,
+        help="Request the completion of a stale cache entry again.",
+        callback=Handler.refresh_cache,
+        hidden=True,  # Hiding since it is run by stale cache hits in background.
+    ),
 ) -> None:
     stdin_passed = not sys.stdin.isatty()
 
@@ -194,6 +318,9 @@ def main(
     if chat and repl:
         raise UsageError("--chat and --repl options cannot be used together.")
 
+    if batch and (chat or repl):
+        raise UsageError("--batch option cannot be used with --chat or --repl.")
+
     if editor and stdin_passed:
         raise UsageError("--editor option cannot be used with stdin input.")
 
@@ -208,6 +335,17 @@ def main(
 
     function_schemas = (get_openai_schemas() or None) if functions else None
 
+    if batch:
+        # Exits when all prompts are completed.
+        BatchHandler(role_class, concurrency).handle(
+            batch,
+            model=model,
+            temperature=temperature,
+            top_p=top_p,
+            caching=cache,
+            functions=function_schemas,
+        )
+
     if repl:
         # Will be in infinite loop here until user exits with Ctrl+C.
         ReplHandler(repl, role_class, md).handle(
@@ -217,6 +355,8 @@ def main(
             top_p=top_p,
             caching=cache,
             functions=function_schemas,
+            stats=stats,
+            replay_speed=replay_speed,
         )
 
     if chat:
@@ -227,6 +367,8 @@ def main(
             top_p=top_p,
             caching=cache,
             functions=function_schemas,
+            stats=stats,
+            replay_speed=replay_speed,
         )
     else:
         full_completion = DefaultHandler(role_class, md).handle(
@@ -236,6 +378,8 @@ def main(
             top_p=top_p,
             caching=cache,
             functions=function_schemas,
+            stats=stats,
+            replay_speed=replay_speed,
         )
 
     session: PromptSession[str] = PromptSession()
@@ -263,6 +407,8 @@ def main(
                 top_p=top_p,
                 caching=cache,
                 functions=function_schemas,
+                stats=stats,
+                replay_speed=replay_speed,
             )
             continue
         break
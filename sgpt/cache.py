@@ -1,7 +1,92 @@
+import base64
 import json
+import mmap
+import os
+import sqlite3
+import struct
+import time
+import zlib
 from hashlib import md5
 from pathlib import Path
-from typing import Any, Callable, Generator, no_type_check
+from threading import RLock, get_ident
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+    no_type_check,
+)
+
+from click import UsageError
+
+try:
+    import fcntl
+except ImportError:  # Windows, requests are not coalesced.
+    fcntl = None  # type: ignore
+
+from .cache_policy import CachePolicy
+from .cache_stats import CacheCounters
+from .compress import (
+    Buffer,
+    check_method,
+    compress,
+    decompress,
+    iter_decompressed,
+    pack_ints,
+    unpack_ints,
+)
+from .remote_cache import RemoteCache
+from .similar import SimilarIndex
+from .tokens import estimate_tokens, messages_tokens
+
+# Entries with chunks start with this byte (never starts UTF-8 text or
+# compressed data), followed by 4 bytes length of chunks metadata,
+# metadata (zlib compressed varints: amount of chunks, their UTF-8 lengths
+# and milliseconds since previous chunk) and text (maybe compressed).
+# Entries written before chunks support are text, replayed as one chunk.
+CHUNKS_HEADER = b"\xfc"
+# Larger entry files are memory mapped instead of read, file backend only,
+# SqliteCache reads whole values.
+MMAP_SIZE = 256 * 1024
+# In-progress file of a request has chunks as they are streamed, each
+# is UTF-8 length and milliseconds since previous chunk, and UTF-8 text.
+FLIGHT_RECORD = struct.Struct(">II")
+FLIGHT_END = 0xFFFFFFFF
+FLIGHT_POLL = 0.02
+READ_SIZE = 64 * 1024
+# Characters of completions shown by --cache-ls.
+PREVIEW_LENGTH = 60
+
+
+def replay(data: Buffer) -> Iterator[Tuple[str, int]]:
+    """
+    :param data: Cache entry, see CHUNKS_HEADER.
+    :return: Chunks of the entry and milliseconds since previous chunk.
+    """
+    if bytes(data[:1]) != CHUNKS_HEADER:
+        yield decompress(bytes(data)), 0
+        return
+    meta_end = 5 + int.from_bytes(data[1:5], "big")
+    meta = unpack_ints(zlib.decompress(data[5:meta_end]))
+    count = meta[0]
+    lengths, gaps = meta[1 : count + 1], meta[count + 1 :]
+    pieces = iter_decompressed(data[meta_end:])
+    buffer = bytearray()
+    for length, gap in zip(lengths, gaps, strict=True):
+        while len(buffer) < length:
+            buffer += next(pieces)
+        # Chunks are whole strings, so they never split UTF-8 characters.
+        chunk = buffer[:length].decode("utf-8")
+        del buffer[:length]
+        yield chunk, gap
 
 
 class Cache:
@@ -9,15 +94,36 @@ class Cache:
     Decorator class that adds caching functionality to a function.
     """
 
-    def __init__(self, length: int, cache_path: Path) -> None:
+    def __init__(
+        self,
+        length: int,
+        cache_path: Path,
+        max_bytes: int = 0,
+        compression: str = "none",
+        similar_threshold: float = 0.8,
+        remote: Optional[RemoteCache] = None,
+    ) -> None:
         """
         Initialize the Cache decorator.
 
         :param length: Integer, maximum number of cache files to keep.
+        :param max_bytes: Maximum total size of cache entries, 0 for no limit.
+        :param compression: Compression of new entries, "zlib", "zstd" or "none".
+        :param similar_threshold: Min similarity of prompts of requests with
+            similar=True to reuse the entry of another request, from 0 to 1.
+        :param remote: Shared cache, looked up when there is no local entry
+            and written along with local entries.
         """
         self.length = length
         self.cache_path = cache_path
         self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.compression = check_method(compression)
+        self.similar = SimilarIndex(
+            cache_path / "similar.sqlite3", length, similar_threshold
+        )
+        self.counters = CacheCounters(cache_path / "counters.sqlite3")
+        self.remote = remote
 
     def __call__(self, func: Callable[..., Any]) -> Callable[..., Any]:
         """
@@ -28,34 +134,765 @@ class Cache:
         """
 
         def wrapper(*args: Any, **kwargs: Any) -> Generator[str, None, None]:
-            key = md5(json.dumps((args[1:], kwargs)).encode("utf-8")).hexdigest()
-            file = self.cache_path / key
-            if kwargs.pop("caching") and file.exists():
-                yield file.read_text()
+            # Replay speed: 1 is original pace of chunks, 0 is no delays.
+            replay_speed = kwargs.pop("replay_speed", 0)
+            # Entries of requests with similar prompts are reused.
+            similar = kwargs.pop("similar", False)
+            policy = kwargs.pop("policy", None) or CachePolicy()
+            # Stale entry is requested again, see Handler.refresh_cache.
+            refresh = kwargs.pop("refresh", False)
+            request = json.dumps((args[1:], kwargs))
+            key = md5(request.encode("utf-8")).hexdigest()
+            caching = kwargs.pop("caching")
+            if refresh:
+                prompt = self._split_prompt(args, kwargs) if similar else None
+                self._refresh(key, func(*args, **kwargs), prompt)
                 return
-            result = ""
-            for i in func(*args, **kwargs):
-                result += i
-                yield i
-            if "@FunctionCall" not in result:
-                file.write_text(result, encoding="utf-8")
-            self._delete_oldest_files(self.length)  # type: ignore
+            bypass = policy.bypass(kwargs.get("temperature"))
+            if bypass:
+                policy.record("bypass", bypass)
+                self.counters.add(bypasses=1)
+                yield from func(*args, **kwargs)
+                return
+            if not caching:
+                policy.record("bypass", "--no-cache")
+                self.counters.add(bypasses=1)
+                yield from self._store(key, func(*args, **kwargs))
+                return
+            prompt = self._split_prompt(args, kwargs) if similar else None
+            cached, state = self._replay_fresh(key, policy)
+            found_remote = found_similar = False
+            if cached is None and self._fetch(key):
+                cached, state = self._replay_fresh(key, policy)
+                found_remote = cached is not None
+            if cached is None and prompt:
+                cached, similar_state = self._replay_similar(*prompt, policy)
+                if cached is not None:
+                    state, found_similar = similar_state, True
+            policy.record_lookup(state, found_similar, found_remote)
+            # Function calls are executed by the caller, so completions
+            # which can request them are not refreshed in background.
+            if state == "stale" and not kwargs.get("functions"):
+                policy.refresh = request
+            if cached is not None:
+                yield from self._hit(
+                    cached, replay_speed, state, found_similar, found_remote, kwargs
+                )
+                return
+            self.counters.add(misses=1)
+            if fcntl is None:
+                yield from self._store(key, func(*args, **kwargs), prompt=prompt)
+                return
+            joined = yield from self._join_flight(key)
+            if isinstance(joined, str):
+                return  # Completed by another process.
+            flight, shown = joined
+            completed = False
+            try:
+                # Completed by another process before the lock was taken.
+                cached, _ = self._replay_fresh(key, policy)
+                if cached is not None:
+                    completion = self._paced(cached, replay_speed)
+                else:
+                    completion = self._store(key, func(*args, **kwargs), flight, prompt)
+                yield from self._skip_shown(completion, shown)
+                completed = True
+            finally:
+                self._end_flight(flight, key, completed)
 
         return wrapper
 
+    @staticmethod
+    def _split_prompt(args: Any, kwargs: Any) -> Optional[Tuple[str, str]]:
+        """
+        :return: Hash of everything the completion depends on except the
+            prompt (model, role, history, parameters) and the prompt, None
+            if the last message is not a user prompt.
+        """
+        *history, last = kwargs.get("messages") or [{}]
+        if last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        request = (args[1:], {**kwargs, "messages": history})
+        context = md5(json.dumps(request).encode("utf-8")).hexdigest()
+        return context, last["content"]
+
+    def _replay_fresh(
+        self, key: str, policy: CachePolicy
+    ) -> Tuple[Optional[Iterator[Tuple[str, int]]], str]:
+        """
+        :return: Chunks of the entry, None if it is missing or expired,
+            and its state: "fresh", "stale", "expired" or "missing".
+        """
+        if policy.ttl:
+            age = self._age(key)
+            if age is None:
+                return None, "missing"
+            state = policy.freshness(age)
+            if state == "expired":
+                return None, state
+        else:
+            state = "fresh"
+        cached = self._replay(key)
+        return cached, state if cached is not None else "missing"
+
+    def _replay_similar(
+        self, context: str, prompt: str, policy: CachePolicy
+    ) -> Tuple[Optional[Iterator[Tuple[str, int]]], str]:
+        state = "missing"
+        for key in self.similar.lookup(context, prompt):
+            cached, state = self._replay_fresh(key, policy)
+            if cached is not None:
+                return cached, state
+            if state == "missing":
+                self.similar.remove(key)  # Evicted from the cache.
+        return None, state
+
+    def _fetch(self, key: str) -> bool:
+        """
+        Copies the entry from the remote cache, unless local one is as recent.
+
+        :return: True if the entry was copied.
+        """
+        entry = self.remote.get(key) if self.remote else None
+        if entry is None:
+            return False
+        data, created = entry
+        age = self._age(key)
+        if age is not None and time.time() - age >= created:
+            return False
+        try:
+            for _ in replay(data):
+                pass
+        except Exception:
+            return False  # Not a cache entry, e.g. written by another version.
+        self._set(key, data, created)
+        self.counters.add(evictions=self._evict())
+        return True
+
+    def _refresh(
+        self,
+        key: str,
+        completion: Iterator[str],
+        prompt: Optional[Tuple[str, str]],
+    ) -> None:
+        """
+        Requests the completion again to replace stale entry, unless another
+        process already does it.
+        """
+        flight, locked = self._open_flight(key) if fcntl else (None, True)
+        if not locked:
+            os.close(cast(int, flight))
+            return
+        completed = False
+        try:
+            for _ in self._store(key, completion, flight, prompt):
+                pass
+            completed = True
+        except Exception:
+            pass  # Stale entry is kept and refreshed by next request.
+        finally:
+            if flight is not None:
+                self._end_flight(flight, key, completed)
+
+    def _hit(
+        self,
+        cached: Iterator[Tuple[str, int]],
+        replay_speed: float,
+        state: str,
+        similar: bool,
+        remote: bool,
+        kwargs: Dict[str, Any],
+    ) -> Iterator[str]:
+        """
+        Replays the entry, records the hit with latency of the original
+        request and estimated tokens of the request and the completion.
+        """
+        original = 0
+        chunks = []
+        for chunk, gap in cached:
+            original += gap
+            chunks.append(chunk)
+            if replay_speed:
+                time.sleep(gap / 1000 / replay_speed)
+            yield chunk
+        delays = original / replay_speed if replay_speed else 0
+        self.counters.add(
+            hits=1,
+            similar_hits=int(similar),
+            remote_hits=int(remote),
+            stale_hits=int(state == "stale"),
+            saved_seconds=max(0, original - delays) / 1000,
+            saved_tokens=messages_tokens(kwargs.get("messages") or [])
+            + estimate_tokens("".join(chunks)),
+        )
+
+    @staticmethod
+    def _paced(chunks: Iterator[Tuple[str, int]], replay_speed: float) -> Iterator[str]:
+        for chunk, gap in chunks:
+            if replay_speed:
+                time.sleep(gap / 1000 / replay_speed)
+            yield chunk
+
+    @staticmethod
+    def _skip_shown(chunks: Iterator[str], shown: str) -> Iterator[str]:
+        """
+        Skips text which was already shown from a process which failed
+        to complete the request, so it isn't shown twice.
+        """
+        for chunk in chunks:
+            if shown and shown.startswith(chunk):
+                shown = shown[len(chunk) :]
+                continue
+            if shown and chunk.startswith(shown):
+                chunk, shown = chunk[len(shown) :], ""
+            elif shown:
+                # New completion is different, it is shown from a new line.
+                chunk, shown = f"\n{chunk}", ""
+            yield chunk
+
+    def _store(
+        self,
+        key: str,
+        completion: Iterator[str],
+        flight: Optional[int] = None,
+        prompt: Optional[Tuple[str, str]] = None,
+    ) -> Generator[str, None, None]:
+        """
+        Yields chunks of the completion, stores them once it is completed.
+
+        :param flight: File descriptor of in-progress file, see _join_flight.
+        :param prompt: Context and prompt to add to similar prompts index.
+        """
+        chunks: List[str] = []
+        gaps: List[int] = []
+        previous = time.monotonic()
+        for i in completion:
+            if i:
+                now = time.monotonic()
+                chunks.append(i)
+                gaps.append(round((now - previous) * 1000))
+                previous = now
+                if flight is not None:
+                    data = i.encode("utf-8")
+                    os.write(flight, FLIGHT_RECORD.pack(len(data), gaps[-1]) + data)
+            yield i
+        written = 0
+        if not any("@FunctionCall" in chunk for chunk in chunks):
+            data = self._encode(chunks, gaps)
+            self._set(key, data)
+            written = len(data)
+            if self.remote:
+                self.remote.put(key, data)
+            if prompt:
+                self.similar.add(key, *prompt)
+        self.counters.add(bytes_written=written, evictions=self._evict())
+
+    def _open_flight(self, key: str) -> Tuple[int, bool]:
+        """
+        Opens in-progress file of the request, which is locked (flock) by
+        the process which requests the completion. Locks are released by OS
+        when the process exits, so crashed processes never keep them.
+
+        :return: File descriptor and whether the lock was taken.
+        """
+        path = self.cache_path / f".{key}.flight"
+        while True:
+            flight = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                fcntl.flock(flight, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return flight, False
+            try:
+                current = os.fstat(flight).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                current = False
+            if current and not os.fstat(flight).st_size:
+                return flight, True
+            if current:
+                # Chunks of a crashed process, followers get a new file.
+                path.unlink()
+            # Otherwise file was completed and removed after it was opened.
+            os.close(flight)
+
+    def _join_flight(
+        self, key: str
+    ) -> Generator[str, None, Union[str, Tuple[int, str]]]:
+        """
+        Takes the lock of the request, or follows the process which holds it:
+        yields chunks from its in-progress file as they are written. If the
+        process fails, the lock is taken to request the completion.
+
+        :return: Completion if it is completed by another process, otherwise
+            locked file descriptor and text which was already shown.
+        """
+        shown = ""
+        while True:
+            flight, locked = self._open_flight(key)
+            if locked:
+                return flight, shown
+            offset = 0
+            buffer = bytearray()
+            try:
+                while True:
+                    data = os.pread(flight, READ_SIZE, offset)
+                    offset += len(data)
+                    buffer += data
+                    while len(buffer) >= FLIGHT_RECORD.size:
+                        length, _ = FLIGHT_RECORD.unpack_from(buffer)
+                        if length == FLIGHT_END:
+                            return shown
+                        if len(buffer) < FLIGHT_RECORD.size + length:
+                            break
+                        end = FLIGHT_RECORD.size + length
+                        chunk = buffer[FLIGHT_RECORD.size : end].decode("utf-8")
+                        del buffer[:end]
+                        shown += chunk
+                        yield chunk
+                    if data:
+                        continue
+                    try:
+                        fcntl.flock(flight, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        time.sleep(FLIGHT_POLL)
+                        continue
+                    # Lock is released, check the rest before the file is reused.
+                    if os.pread(flight, 1, offset):
+                        continue
+                    break
+            finally:
+                os.close(flight)
+
+    def _end_flight(self, flight: int, key: str, completed: bool) -> None:
+        if completed:
+            os.write(flight, FLIGHT_RECORD.pack(FLIGHT_END, 0))
+        # Removed before the lock is released, see _open_flight.
+        (self.cache_path / f".{key}.flight").unlink(missing_ok=True)
+        os.close(flight)
+
+    @staticmethod
+    def _is_entry(path: Path) -> bool:
+        # Cache entries are named by md5 hex digest of the request.
+        return len(path.name) == 32 and path.is_file()
+
+    def _encode(self, chunks: List[str], gaps: Optional[List[int]] = None) -> bytes:
+        """
+        :param chunks: Streamed chunks of the completion.
+        :param gaps: Milliseconds since previous chunk, no delays by default.
+        :return: Cache entry, see CHUNKS_HEADER.
+        """
+        text = "".join(chunks)
+        data = text.encode("utf-8")
+        compressed = compress(text, self.compression)
+        meta = zlib.compress(
+            pack_ints(
+                [len(chunks)]
+                + [len(chunk.encode("utf-8")) for chunk in chunks]
+                + (gaps or [0] * len(chunks))
+            )
+        )
+        # Short texts don't compress, they are kept plain.
+        body = compressed if len(compressed) < len(data) else data
+        return CHUNKS_HEADER + len(meta).to_bytes(4, "big") + meta + body
+
+    def _get(self, key: str) -> Optional[str]:
+        chunks = self._replay(key)
+        return None if chunks is None else "".join(chunk for chunk, _ in chunks)
+
+    def _age(self, key: str) -> Optional[float]:
+        """
+        :return: Seconds since the entry was written, None if there is no entry.
+        """
+        try:
+            return time.time() - (self.cache_path / key).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _replay(self, key: str) -> Optional[Iterator[Tuple[str, int]]]:
+        """
+        :return: Chunks of the entry and milliseconds since previous chunk,
+            None if there is no entry.
+        """
+        try:
+            file = (self.cache_path / key).open("rb")
+        except FileNotFoundError:
+            return None
+        return self._replay_file(file)
+
+    @staticmethod
+    def _replay_file(file: IO[bytes]) -> Iterator[Tuple[str, int]]:
+        with file:
+            if os.fstat(file.fileno()).st_size < MMAP_SIZE:
+                yield from replay(file.read())
+                return
+            # Entries are replaced by rename, so mapped file never changes.
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    yield from replay(view)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        """
+        :return: Entry as it is stored, None if there is no entry.
+        """
+        try:
+            return (self.cache_path / key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _set(self, key: str, data: bytes, created: Optional[float] = None) -> None:
+        """
+        :param created: Write time of the entry, now by default.
+        """
+        path = self.cache_path / key
+        temp_path = path.with_name(f".{key}.{os.getpid()}.{get_ident()}.tmp")
+        temp_path.write_bytes(data)
+        if created is not None:
+            os.utime(temp_path, (created, created))
+        os.replace(temp_path, path)
+
+    def _remove(self, keys: List[str]) -> None:
+        for key in keys:
+            (self.cache_path / key).unlink(missing_ok=True)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        :return: Key, size and write time of entries, most recent first.
+        """
+        entries = []
+        for path in filter(self._is_entry, self.cache_path.glob("*")):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process.
+            entries.append(
+                {"key": path.name, "size": stat.st_size, "created": stat.st_mtime}
+            )
+        return sorted(entries, key=lambda entry: float(entry["created"]), reverse=True)
+
+    def preview(self, key: str) -> Optional[str]:
+        """
+        :return: Beginning of the completion, None if there is no entry.
+        """
+        # Read without _replay, so listing doesn't count as use of entries.
+        data = self._read(key)
+        if data is None:
+            return None
+        text = ""
+        for chunk, _ in replay(data):
+            text += chunk
+            if len(text) >= PREVIEW_LENGTH:
+                break
+        return " ".join(text.split())[:PREVIEW_LENGTH]
+
+    def purge(self, older_than: float = 0) -> List[Dict[str, Any]]:
+        """
+        :param older_than: Seconds since entries were written, 0 for all entries.
+        :return: Removed entries.
+        """
+        before = time.time() - older_than
+        removed = [
+            entry
+            for entry in self.entries()
+            if not older_than or entry["created"] < before
+        ]
+        self._remove([entry["key"] for entry in removed])
+        self.counters.add(purged=len(removed))
+        return removed
+
+    def export_entries(self, file: IO[str]) -> int:
+        """
+        Writes entries as JSON lines with key, write time and base64 encoded
+        entry, which are read by import_entries.
+
+        :return: Amount of exported entries.
+        """
+        exported = 0
+        for entry in reversed(self.entries()):
+            data = self._read(entry["key"])
+            if data is None:
+                continue
+            record = {
+                "key": entry["key"],
+                "created": entry["created"],
+                "value": base64.b64encode(data).decode("ascii"),
+            }
+            file.write(json.dumps(record) + "\n")
+            exported += 1
+        return exported
+
+    def import_entries(self, file: IO[str]) -> int:
+        """
+        Adds entries written by export_entries, entries which are already
+        in the cache are replaced only by more recent ones.
+
+        :return: Amount of imported entries.
+        :raises ValueError: If a line is not an exported entry.
+        """
+        imported = 0
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                key, created = record["key"], float(record["created"])
+                data = base64.b64decode(record["value"], validate=True)
+                int(key, 16)
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError(f"Line {number} is not a cache entry.") from error
+            if len(key) != 32:
+                raise ValueError(f"Line {number} is not a cache entry.")
+            age = self._age(key)
+            if age is not None and time.time() - age >= created:
+                continue
+            self._set(key, data, created)
+            imported += 1
+        self.counters.add(evictions=self._evict())
+        return imported
+
+    def _evict(self) -> int:
+        """
+        :return: Amount of evicted entries.
+        """
+        return self._delete_oldest_files(self.length, self.max_bytes)  # type: ignore
+
     @no_type_check
-    def _delete_oldest_files(self, max_files: int) -> None:
+    def _delete_oldest_files(self, max_files: int, max_bytes: int = 0) -> int:
         """
         Class method to delete the oldest cached files in the CACHE_DIR folder.
 
         :param max_files: Integer, the maximum number of files to keep in the CACHE_DIR folder.
+        :param max_bytes: Integer, the maximum total size of the files, 0 for no limit.
+        :return: Amount of deleted files.
         """
         # Get all files in the folder.
-        files = self.cache_path.glob("*")
+        files = filter(self._is_entry, self.cache_path.glob("*"))
         # Sort files by last modification time in ascending order.
-        files = sorted(files, key=lambda f: f.stat().st_mtime)
-        # Delete the oldest files if the number of files exceeds the limit.
-        if len(files) > max_files:
-            num_files_to_delete = len(files) - max_files
-            for i in range(num_files_to_delete):
-                files[i].unlink()
+        files = sorted(((f.stat(), f) for f in files), key=lambda f: f[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in files)
+        # Delete the oldest files while the number or size of files exceeds the limit.
+        for index, (stat, file) in enumerate(files):
+            if len(files) - index <= max_files and (
+                not max_bytes or total <= max_bytes
+            ):
+                return index
+            file.unlink(missing_ok=True)
+            total -= stat.st_size
+        return len(files)
+
+
+class SqliteCache(Cache):
+    """
+    Cache which keeps all entries in a single SQLite database (WAL mode).
+    Entries are evicted by indexed last access time, amount and size of
+    entries are maintained by triggers, so eviction cost doesn't grow with
+    cache length. Safe to use from several processes at once.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        accessed REAL NOT NULL,
+        created REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+    CREATE TABLE IF NOT EXISTS counters (
+        entries INTEGER NOT NULL,
+        bytes INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO counters (entries) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM counters);
+    CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+        UPDATE counters SET entries = entries + 1, bytes = bytes + length(new.value);
+    END;
+    CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF value ON entries BEGIN
+        UPDATE counters SET bytes = bytes - length(old.value) + length(new.value);
+    END;
+    CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+        UPDATE counters SET entries = entries - 1, bytes = bytes - length(old.value);
+    END;
+    """
+    # Databases created before size counter, triggers are recreated by SCHEMA.
+    MIGRATION = """
+    ALTER TABLE counters ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0;
+    UPDATE counters SET bytes = (SELECT coalesce(sum(length(value)), 0) FROM entries);
+    DROP TRIGGER entries_insert;
+    DROP TRIGGER entries_delete;
+    """
+    # Databases created before cache TTL, write time is unknown.
+    CREATED_MIGRATION = """
+    ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0;
+    UPDATE entries SET created = accessed;
+    """
+
+    def __init__(
+        self,
+        length: int,
+        cache_path: Path,
+        max_bytes: int = 0,
+        compression: str = "none",
+        similar_threshold: float = 0.8,
+        remote: Optional[RemoteCache] = None,
+    ) -> None:
+        super().__init__(
+            length, cache_path, max_bytes, compression, similar_threshold, remote
+        )
+        self.db_path = cache_path / "cache.sqlite3"
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connect lazily, most of sgpt commands never touch the cache.
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                columns = connection.execute("PRAGMA table_info(counters)")
+                if {name for _, name, *_ in columns} == {"entries"}:
+                    self._migrate(connection, self.MIGRATION)
+                columns = connection.execute("PRAGMA table_info(entries)")
+                names = {name for _, name, *_ in columns}
+                if names and "created" not in names:
+                    self._migrate(connection, self.CREATED_MIGRATION)
+                with connection:
+                    connection.executescript(self.SCHEMA)
+                self._connection = connection
+                self._migrate_files()
+            return self._connection
+
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection, script: str) -> None:
+        try:
+            connection.executescript(f"BEGIN IMMEDIATE; {script} COMMIT;")
+        except sqlite3.OperationalError:
+            # Migrated by another process.
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+    def _migrate_files(self) -> None:
+        """
+        Moves entries of file based Cache (md5 named files) into the database.
+        """
+        files = [path for path in self.cache_path.glob("*") if self._is_entry(path)]
+        if not files:
+            return
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for path in files:
+                try:
+                    value, accessed = path.read_bytes(), path.stat().st_mtime
+                except FileNotFoundError:
+                    continue  # Migrated by another process.
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)",
+                    (path.name, value, accessed, accessed),
+                )
+        for path in files:
+            path.unlink(missing_ok=True)
+
+    def _replay(self, key: str) -> Optional[Iterator[Tuple[str, int]]]:
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        value: Union[str, bytes] = row[0]
+        # Entries written before compression support are text.
+        return replay(value if isinstance(value, bytes) else value.encode("utf-8"))
+
+    def _age(self, key: str) -> Optional[float]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else time.time() - row[0]
+
+    def _read(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value: Union[str, bytes] = row[0]
+        return value if isinstance(value, bytes) else value.encode("utf-8")
+
+    def _set(self, key: str, data: bytes, created: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT (key) "
+                "DO UPDATE SET value = excluded.value, accessed = excluded.accessed, "
+                "created = excluded.created",
+                (key, data, now, now if created is None else created),
+            )
+
+    def _remove(self, keys: List[str]) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "DELETE FROM entries WHERE key = ?", ((key,) for key in keys)
+            )
+
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT key, length(value), created FROM entries ORDER BY created DESC"
+            ).fetchall()
+        return [
+            {"key": key, "size": size, "created": created}
+            for key, size, created in rows
+        ]
+
+    def _evict(self) -> int:
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            count, size = self.connection.execute(
+                "SELECT entries, bytes FROM counters"
+            ).fetchone()
+            evicted = 0
+            if count > self.length:
+                evicted += self.connection.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                    (count - self.length,),
+                ).rowcount
+                (size,) = self.connection.execute(
+                    "SELECT bytes FROM counters"
+                ).fetchone()
+            if not self.max_bytes or size <= self.max_bytes:
+                return evicted
+            # Least recently used entries with total size of the excess.
+            return (
+                evicted
+                + self.connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM ("
+                    "SELECT key, sum(length(value)) OVER (ORDER BY accessed, key) "
+                    "- length(value) AS before FROM entries) WHERE before < ?)",
+                    (size - self.max_bytes,),
+                ).rowcount
+            )
+
+
+CACHE_BACKENDS = {"file": Cache, "sqlite": SqliteCache}
+
+
+def cache_backend(name: str) -> Type[Cache]:
+    """
+    :param name: CACHE_BACKEND setting.
+    :return: Cache class of the backend.
+    """
+    if name not in CACHE_BACKENDS:
+        raise UsageError(
+            f'Unknown CACHE_BACKEND "{name}", use {" or ".join(CACHE_BACKENDS)}.'
+        )
+    return CACHE_BACKENDS[name]
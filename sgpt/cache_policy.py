@@ -0,0 +1,131 @@
+from typing import Any, Dict, Optional
+
+from click import UsageError
+
+from .config import cfg
+
+# Settings which can be set in "cache" object of the role JSON.
+SETTINGS = ("enabled", "ttl", "stale_ttl", "max_temperature")
+
+
+class CachePolicy:
+    """
+    Decides whether completion of a request is read from and written to
+    the cache, and for how long cached entries are used. Settings come from
+    .sgptrc and are overridden by "cache" object of the role JSON. Created
+    for each request, Cache records its decision and the setting behind it.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        ttl: float = 0.0,
+        stale_ttl: float = 0.0,
+        max_temperature: Optional[float] = None,
+        sources: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        :param enabled: Cache completions of the request.
+        :param ttl: Seconds entries are used for, 0 for no limit.
+        :param stale_ttl: Seconds after ttl entries are still used while
+            they are refreshed in background.
+        :param max_temperature: Requests with higher temperature are not cached.
+        :param sources: Where each setting comes from, "config" or "role".
+        """
+        self.enabled = enabled
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_temperature = max_temperature
+        self.sources = sources or {}
+        # "hit", "stale hit", "miss" or "bypass", set by Cache, hits can be
+        # "similar" or "remote".
+        self.decision: Optional[str] = None
+        self.reason: Optional[str] = None
+        # Request of stale entry (JSON), set by Cache, it is requested again
+        # in a detached process, see Handler.refresh_detached.
+        self.refresh: Optional[str] = None
+
+    @classmethod
+    def from_config(
+        cls, role_settings: Optional[Dict[str, Any]] = None
+    ) -> "CachePolicy":
+        """
+        :param role_settings: "cache" object of the role JSON.
+        :return: Policy with .sgptrc settings overridden by role settings.
+        """
+        settings: Dict[str, Any] = {
+            "ttl": float(cfg.get("CACHE_TTL")),
+            "stale_ttl": float(cfg.get("CACHE_STALE_TTL")),
+            "max_temperature": None
+            if cfg.get("CACHE_MAX_TEMPERATURE") == "none"
+            else float(cfg.get("CACHE_MAX_TEMPERATURE")),
+        }
+        sources = {name: "config" for name in settings}
+        for name, value in (role_settings or {}).items():
+            if name not in SETTINGS:
+                raise UsageError(f'Unknown role cache setting "{name}".')
+            if name == "enabled":
+                settings[name] = bool(value)
+            else:  # null max_temperature is no limit.
+                settings[name] = None if value is None else float(value)
+            sources[name] = "role"
+        return cls(**settings, sources=sources)
+
+    def describe(self, name: str) -> str:
+        """
+        :return: Setting with its source, e.g. "role ttl=3600".
+        """
+        value = getattr(self, name)
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, float):
+            value = f"{value:g}"
+        return f"{self.sources.get(name, 'default')} {name}={value}"
+
+    def bypass(self, temperature: Optional[float]) -> Optional[str]:
+        """
+        :return: Setting which excludes the request from caching, None if
+            it is cached.
+        """
+        if not self.enabled:
+            return self.describe("enabled")
+        if (
+            self.max_temperature is not None
+            and temperature is not None
+            and temperature > self.max_temperature
+        ):
+            return self.describe("max_temperature")
+        return None
+
+    def freshness(self, age: float) -> str:
+        """
+        :param age: Seconds since the entry was written.
+        :return: "fresh", "stale" (used and refreshed) or "expired".
+        """
+        if not self.ttl or age <= self.ttl:
+            return "fresh"
+        if age <= self.ttl + self.stale_ttl:
+            return "stale"
+        return "expired"
+
+    def record(self, decision: str, reason: str) -> None:
+        self.decision, self.reason = decision, reason
+
+    def record_lookup(
+        self, state: str, similar: bool = False, remote: bool = False
+    ) -> None:
+        """
+        :param state: "fresh", "stale", "expired" or "missing".
+        :param similar: Entry of a similar prompt was found.
+        :param remote: Entry was copied from the remote cache.
+        """
+        found = "similar " if similar else "remote " if remote else ""
+        if state == "fresh":
+            reason = self.describe("ttl") if self.ttl else "no ttl"
+            self.record(f"{found}hit", reason)
+        elif state == "stale":
+            self.record(f"{found}stale hit", self.describe("stale_ttl"))
+        elif state == "expired":
+            self.record("miss", self.describe("ttl"))
+        else:
+            self.record("miss", "not cached")
@@ -0,0 +1,98 @@
+"""
+Reference server of the remote cache (see RemoteCache), shares completions
+of sgpt requests between machines, e.g. in a team. Entries are kept in
+SqliteCache, so its eviction and limits apply.
+
+Usage: python -m sgpt.cache_server /var/cache/sgpt --port 8765
+"""
+import re
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple
+
+import typer
+
+from .cache import Cache, SqliteCache
+
+# Larger entries are rejected, completions are much smaller.
+MAX_ENTRY_BYTES = 16 * 1024 * 1024
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    server: "CacheServer"
+
+    def do_GET(self) -> None:
+        key = self._key()
+        if key is None:
+            return
+        data, age = self.server.cache._read(key), self.server.cache._age(key)
+        if data is None or age is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Last-Modified", formatdate(time.time() - age, usegmt=True))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self) -> None:
+        key = self._key()
+        if key is None:
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if not 0 < length <= MAX_ENTRY_BYTES:
+            self.send_error(413 if length else 411)
+            return
+        self.server.cache._set(key, self.rfile.read(length))
+        self.server.cache._evict()
+        self.send_response(204)
+        self.end_headers()
+
+    def _key(self) -> Optional[str]:
+        """
+        :return: Key of the requested entry, None if the error is sent.
+        """
+        token = self.server.token
+        if token and self.headers.get("Authorization") != f"Bearer {token}":
+            self.send_error(401)
+            return None
+        key = self.path.strip("/")
+        if not re.fullmatch(r"[0-9a-f]{32}", key):
+            self.send_error(404)
+            return None
+        return key
+
+
+class CacheServer(ThreadingHTTPServer):
+    def __init__(
+        self, address: Tuple[str, int], cache: Cache, token: Optional[str] = None
+    ) -> None:
+        """
+        :param address: Host and port to listen on, port 0 for any free port.
+        :param cache: Storage of entries.
+        :param token: Bearer token clients must send, None to allow anyone.
+        """
+        super().__init__(address, CacheRequestHandler)
+        self.cache = cache
+        self.token = token
+
+
+def main(
+    path: Path = typer.Argument(..., help="Folder to keep entries in."),
+    host: str = typer.Option("127.0.0.1", help="Address to listen on."),
+    port: int = typer.Option(8765, help="Port to listen on."),
+    length: int = typer.Option(10000, help="Max amount of entries."),
+    max_bytes: int = typer.Option(0, help="Max size of entries, 0 for no limit."),
+    token: Optional[str] = typer.Option(None, help="Require this bearer token."),
+) -> None:
+    server = CacheServer((host, port), SqliteCache(length, path, max_bytes), token)
+    typer.echo(f"Serving cache {path} on http://{host}:{server.server_port}")
+    with server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    typer.run(main)
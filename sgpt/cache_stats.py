@@ -0,0 +1,86 @@
+import sqlite3
+import time
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, Optional
+
+# Counters recorded by Cache, see CacheCounters.
+COUNTERS = (
+    "hits",
+    "similar_hits",
+    "remote_hits",
+    "stale_hits",
+    "misses",
+    "bypasses",
+    "bytes_written",
+    "evictions",
+    "purged",
+    "saved_seconds",
+    "saved_tokens",
+)
+
+
+class CacheCounters:
+    """
+    Counters of cache requests, writes and evictions, kept in SQLite database
+    next to cache entries, so they are shared by all processes using the
+    cache, and survive eviction of entries they were recorded for.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connect lazily, most of sgpt commands never touch the cache.
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                with connection:
+                    connection.executescript(self.SCHEMA)
+                self._connection = connection
+            return self._connection
+
+    def add(self, **counts: float) -> None:
+        """
+        :param counts: Amounts to add to counters, see COUNTERS.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            # Time of the first record, counters are collected since then.
+            self.connection.execute(
+                "INSERT OR IGNORE INTO counters VALUES ('since', ?)", (time.time(),)
+            )
+            self.connection.executemany(
+                "INSERT INTO counters VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                counts.items(),
+            )
+
+    def get(self) -> Dict[str, Any]:
+        """
+        :return: All counters, 0 if not recorded yet, and "since" time
+            of the first record (None if there are no records).
+        """
+        with self._lock:
+            rows = dict(self.connection.execute("SELECT name, value FROM counters"))
+        return {
+            **{name: rows.get(name, 0) for name in COUNTERS},
+            "since": rows.get("since"),
+        }
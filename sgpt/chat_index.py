@@ -0,0 +1,213 @@
+import sqlite3
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Columns chats can be sorted by, largest (most recent) first except names.
+SORT_COLUMNS = {
+    "used": "used DESC",
+    "created": "created DESC",
+    "size": "size DESC",
+    "messages": "messages DESC",
+    "tokens": "tokens DESC",
+    "name": "chat_id",
+}
+
+
+class ChatIndex:
+    """
+    Full-text index of chat messages and metadata of chats in SQLite FTS5
+    database, which is kept next to chats folder and updated by ChatSession
+    on every write. Messages are stored in entries table (indexed by chat id,
+    so chats are removed without scanning the index), FTS5 table refers to it.
+    """
+
+    # Bumped on incompatible schema changes, index is rebuilt from chat files.
+    VERSION = 1
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chats (
+        chat_id TEXT PRIMARY KEY,
+        role TEXT NOT NULL DEFAULT '',
+        messages INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL DEFAULT 0,
+        used REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS chats_used ON chats (used);
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+    CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_chat_id ON entries (chat_id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+        content, content = 'entries', content_rowid = 'id'
+    );
+    CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+        INSERT INTO messages (rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+        INSERT INTO messages (messages, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END;
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connect lazily, most of sgpt commands never touch chats.
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                (version,) = connection.execute("PRAGMA user_version").fetchone()
+                if version != self.VERSION:
+                    connection.executescript(
+                        "DROP TABLE IF EXISTS messages;"
+                        "DROP TABLE IF EXISTS entries;"
+                        "DROP TABLE IF EXISTS chats;"
+                        "DROP TABLE IF EXISTS meta;"
+                        f"PRAGMA user_version = {self.VERSION};"
+                    )
+                with connection:
+                    connection.executescript(self.SCHEMA)
+                self._connection = connection
+            return self._connection
+
+    def _insert(
+        self,
+        chat_id: str,
+        messages: Iterable[Dict[str, Any]],
+        info: Dict[str, Any],
+    ) -> None:
+        # Creation time of indexed chat is kept.
+        self.connection.execute(
+            "INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET role = excluded.role, "
+            "messages = excluded.messages, size = excluded.size, "
+            "tokens = excluded.tokens, used = excluded.used",
+            (
+                chat_id,
+                info["role"],
+                info["messages"],
+                info["size"],
+                info["tokens"],
+                info["used"],
+                info["used"],
+            ),
+        )
+        self.connection.executemany(
+            "INSERT INTO entries (chat_id, role, content) VALUES (?, ?, ?)",
+            (
+                (chat_id, message["role"], message["content"])
+                for message in messages
+                if isinstance(message.get("content"), str)
+            ),
+        )
+
+    def add(
+        self, chat_id: str, messages: List[Dict[str, Any]], info: Dict[str, Any]
+    ) -> None:
+        """
+        Indexes new messages of the chat.
+
+        :param chat_id: Chat id.
+        :param messages: New messages.
+        :param info: Chat metadata: role, messages, size, tokens and used time.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self._insert(chat_id, messages, info)
+
+    def replace(
+        self, chat_id: str, messages: List[Dict[str, Any]], info: Dict[str, Any]
+    ) -> None:
+        """
+        Indexes all messages of the chat, e.g. when chat file is rewritten.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM entries WHERE chat_id = ?", (chat_id,))
+            self._insert(chat_id, messages, info)
+
+    def remove(self, chat_id: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+            self.connection.execute("DELETE FROM entries WHERE chat_id = ?", (chat_id,))
+
+    def get_meta(self, key: str) -> Any:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def set_meta(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+            )
+
+    def chat_ids(self) -> Set[str]:
+        with self._lock:
+            rows = self.connection.execute("SELECT chat_id FROM chats")
+            return {chat_id for (chat_id,) in rows}
+
+    def chats(
+        self,
+        sort: Optional[str] = "used",
+        match: str = "",
+        limit: int = -1,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        :param sort: One of SORT_COLUMNS, None for least recently used first.
+        :param match: Substring of chat id or role name, case insensitive.
+        :param limit: Max amount of chats, -1 for all.
+        :param offset: Amount of chats to skip.
+        :return: Metadata of chats.
+        """
+        escaped = match.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM chats "
+                "WHERE chat_id LIKE :pattern ESCAPE '!' OR role LIKE :pattern ESCAPE '!' "
+                f"ORDER BY {SORT_COLUMNS[sort] if sort else 'used'}, chat_id "
+                "LIMIT :limit OFFSET :offset",
+                {"pattern": f"%{escaped}%", "limit": limit, "offset": offset},
+            )
+            columns = [column for column, *_ in cursor.description]
+            return [dict(zip(columns, row, strict=True)) for row in cursor]
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, str, str]]:
+        """
+        :param query: Words to search, all of them must be in a message.
+        :param limit: Max amount of results.
+        :return: Chat id, role and snippet of best matching messages.
+        """
+        # Quote words, so characters like "-" or ":" are not FTS5 syntax.
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not match:
+            return []
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT chat_id, role, snippet(messages, 0, '[', ']', '...', 16) "
+                "FROM messages JOIN entries ON entries.id = messages.rowid "
+                "WHERE messages MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit),
+            )
+            return [(chat_id, role, snippet) for chat_id, role, snippet in rows]
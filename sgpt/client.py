@@ -0,0 +1,97 @@
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from .config import cfg
+
+# Message length prefix, sent along with stdin, stdout and stderr descriptors.
+HEADER = struct.Struct("!I")
+
+
+def socket_path() -> Path:
+    return Path(cfg.get("DAEMON_SOCKET_PATH"))
+
+
+def _interactive(argv: List[str]) -> bool:
+    # Commands which interact with the user run in-process, whatever stdin
+    # is: executed commands must be in foreground process group of our
+    # terminal (for Ctrl+C), and sudo or ssh prompt on our /dev/tty.
+    if "--repl" in argv or "--editor" in argv:
+        return True
+    if "--no-interaction" in argv:
+        return False
+    if "--interaction" not in argv and cfg.get("SHELL_INTERACTION") != "true":
+        return False
+    return any(arg in argv for arg in ("--shell", "-s"))
+
+
+def _read_line(conn: socket.socket) -> Optional[int]:
+    line = b""
+    while not line.endswith(b"\n"):
+        data = conn.recv(1)
+        if not data:
+            return None
+        line += data
+    return int(line)
+
+
+def forward(argv: List[str]) -> Optional[int]:
+    """
+    Runs sgpt command in the daemon, the daemon worker writes directly
+    to our stdout and stderr since we pass file descriptors over the socket.
+
+    :param argv: Command line arguments without program name.
+    :return: Exit code, or None if daemon is not available.
+    """
+    if not hasattr(socket, "send_fds") or "--daemon" in argv or _interactive(argv):
+        return None
+    path = socket_path()
+    if not path.exists():
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except OSError:
+        # Stale socket file left by a daemon which is not running anymore.
+        conn.close()
+        return None
+
+    with conn:
+        payload = json.dumps(
+            {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        ).encode("utf-8")
+        socket.send_fds(conn, [HEADER.pack(len(payload))], [0, 1, 2])
+        conn.sendall(payload)
+        worker_pid = _read_line(conn)
+        if worker_pid is None:
+            return None
+        while True:
+            try:
+                exit_code = _read_line(conn)
+                return 1 if exit_code is None else exit_code
+            except KeyboardInterrupt:
+                # Ctrl+C is delivered to our process group, not to the worker.
+                os.kill(worker_pid, signal.SIGINT)
+
+
+def entry_point() -> None:
+    # This is "sgpt" executable, keep imports above cheap (stdlib and config only).
+    exit_code = forward(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+    # No daemon running, handle the command in this process.
+    from click import UsageError
+
+    try:
+        from .app import entry_point as app_entry_point
+    except UsageError as error:
+        # Config is checked when handlers are defined, e.g. STORAGE_COMPRESSION.
+        error.show()
+        sys.exit(error.exit_code)
+
+    app_entry_point()
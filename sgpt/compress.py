@@ -0,0 +1,176 @@
+import zlib
+from typing import Any, Iterable, Iterator, List, Union
+
+from click import UsageError
+
+Buffer = Union[bytes, memoryview]
+
+# Compressed data starts with a byte which never starts UTF-8 text,
+# so plain files written without compression are read as is.
+HEADERS = {"zlib": b"\xfe", "zstd": b"\xfd"}
+METHODS = {header: method for method, header in HEADERS.items()}
+# Compressed data is a sequence of blocks (4 bytes length and compressed
+# text), so new blocks can be appended to the file, e.g. chat messages.
+LENGTH_BYTES = 4
+# Max size of decompressed pieces, see iter_decompressed.
+PIECE_SIZE = 64 * 1024
+
+
+def _zstd() -> Any:
+    # Python 3.14 has zstd in standard library, "zstandard" package otherwise.
+    try:
+        from compression import zstd  # type: ignore
+
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard  # type: ignore
+    except ImportError as error:
+        raise ImportError(
+            'zstd compression requires "zstandard" package, '
+            'install it with "pip install shell-gpt[zstd]"'
+        ) from error
+
+    class Zstd:
+        @staticmethod
+        def compress(data: bytes) -> bytes:
+            return zstandard.ZstdCompressor().compress(data)  # type: ignore
+
+        @staticmethod
+        def decompress(data: bytes) -> bytes:
+            return zstandard.ZstdDecompressor().decompress(data)  # type: ignore
+
+    return Zstd
+
+
+def _codec(method: str) -> Any:
+    if method == "zlib":
+        return zlib
+    if method == "zstd":
+        return _zstd()
+    raise ValueError(f'Unknown compression method "{method}".')
+
+
+def check_method(method: str) -> str:
+    """
+    Checks STORAGE_COMPRESSION once at startup, so unknown methods are not
+    found after the completion is shown, when it is written.
+
+    :param method: "zlib", "zstd" or "none".
+    :return: The method.
+    """
+    if method != "none" and method not in HEADERS:
+        raise UsageError(
+            f'Unknown STORAGE_COMPRESSION "{method}", use zlib, zstd or none.'
+        )
+    if method == "zstd":
+        try:
+            _zstd()
+        except ImportError as error:
+            raise UsageError(str(error)) from error
+    return method
+
+
+def method_of(data: Buffer) -> str:
+    """
+    :param data: Stored data, or at least its first byte.
+    :return: Compression method of the data, "none" for plain text.
+    """
+    return METHODS.get(bytes(data[:1]), "none")
+
+
+def compress_block(text: str, method: str) -> bytes:
+    """
+    Compresses the text into a block, which can be appended
+    to data compressed with the same method.
+
+    :param text: Text to compress.
+    :param method: "zlib", "zstd" or "none" (plain UTF-8 text).
+    :return: Compressed block.
+    """
+    data = text.encode("utf-8")
+    if method == "none":
+        return data
+    compressed: bytes = _codec(method).compress(data)
+    return len(compressed).to_bytes(LENGTH_BYTES, "big") + compressed
+
+
+def compress(text: str, method: str) -> bytes:
+    """
+    :param text: Text to compress.
+    :param method: "zlib", "zstd" or "none" (plain UTF-8 text).
+    :return: Data with compression header, plain text for "none".
+    """
+    return HEADERS.get(method, b"") + compress_block(text, method)
+
+
+def _blocks(data: Buffer) -> Iterator[Buffer]:
+    position = 1
+    while position < len(data):
+        length = int.from_bytes(data[position : position + LENGTH_BYTES], "big")
+        position += LENGTH_BYTES
+        yield data[position : position + length]
+        position += length
+
+
+def decompress(data: bytes) -> str:
+    """
+    :param data: Data written by compress and compress_block, or plain text.
+    :return: Decompressed text.
+    """
+    method = method_of(data)
+    if method == "none":
+        return data.decode("utf-8")
+    codec = _codec(method)
+    return b"".join(codec.decompress(block) for block in _blocks(data)).decode("utf-8")
+
+
+def iter_decompressed(data: Buffer) -> Iterator[bytes]:
+    """
+    Decompresses the data in pieces of at most PIECE_SIZE bytes (zstd blocks
+    are decompressed at once), so large data, e.g. memory mapped file, is
+    never decompressed into memory as a whole.
+
+    :param data: Data written by compress and compress_block, or plain text.
+    :return: Decompressed UTF-8 bytes, pieces can split characters.
+    """
+    method = method_of(data)
+    if method == "none":
+        for position in range(0, len(data), PIECE_SIZE):
+            yield bytes(data[position : position + PIECE_SIZE])
+        return
+    for block in _blocks(data):
+        if method == "zstd":
+            yield _zstd().decompress(block)
+            continue
+        decompressor = zlib.decompressobj()
+        piece = decompressor.decompress(block, PIECE_SIZE)
+        while piece:
+            yield piece
+            piece = decompressor.decompress(decompressor.unconsumed_tail, PIECE_SIZE)
+
+
+def pack_ints(values: Iterable[int]) -> bytes:
+    """
+    Packs non-negative integers as LEB128 varints, small values take one byte.
+    """
+    packed = bytearray()
+    for value in values:
+        while value > 0x7F:
+            packed.append(value & 0x7F | 0x80)
+            value >>= 7
+        packed.append(value)
+    return bytes(packed)
+
+
+def unpack_ints(data: bytes) -> List[int]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append(value)
+            value = shift = 0
+    return values
@@ -13,6 +13,7 @@ ROLE_STORAGE_PATH = SHELL_GPT_CONFIG_FOLDER / "roles"
 FUNCTIONS_PATH = SHELL_GPT_CONFIG_FOLDER / "functions"
 CHAT_CACHE_PATH = Path(gettempdir()) / "chat_cache"
 CACHE_PATH = Path(gettempdir()) / "cache"
+DAEMON_SOCKET_PATH = SHELL_GPT_CONFIG_FOLDER / "daemon.sock"
 
 # TODO: Refactor ENV variables with SGPT_ prefix.
 DEFAULT_CONFIG = {
@@ -20,7 +21,22 @@ DEFAULT_CONFIG = {
     "CHAT_CACHE_PATH": os.getenv("CHAT_CACHE_PATH", str(CHAT_CACHE_PATH)),
     "CACHE_PATH": os.getenv("CACHE_PATH", str(CACHE_PATH)),
     "CHAT_CACHE_LENGTH": int(os.getenv("CHAT_CACHE_LENGTH", "100")),
+    "CHAT_TOKEN_BUDGET": os.getenv("CHAT_TOKEN_BUDGET", "0"),
+    "CHAT_SUMMARY_TOKENS": os.getenv("CHAT_SUMMARY_TOKENS", "0"),
+    "CHAT_GC_MAX_DAYS": int(os.getenv("CHAT_GC_MAX_DAYS", "30")),
+    "CHAT_GC_MAX_BYTES": int(os.getenv("CHAT_GC_MAX_BYTES", "104857600")),
     "CACHE_LENGTH": int(os.getenv("CHAT_CACHE_LENGTH", "100")),
+    "CACHE_BACKEND": os.getenv("CACHE_BACKEND", "sqlite"),
+    "CACHE_MAX_BYTES": os.getenv("CACHE_MAX_BYTES", "0"),
+    "STORAGE_COMPRESSION": os.getenv("STORAGE_COMPRESSION", "none"),
+    "CACHE_TTL": os.getenv("CACHE_TTL", "0"),
+    "CACHE_STALE_TTL": os.getenv("CACHE_STALE_TTL", "0"),
+    "CACHE_MAX_TEMPERATURE": os.getenv("CACHE_MAX_TEMPERATURE", "none"),
+    "CACHE_SIMILAR_ROLES": os.getenv("CACHE_SIMILAR_ROLES", "none"),
+    "CACHE_SIMILAR_THRESHOLD": os.getenv("CACHE_SIMILAR_THRESHOLD", "0.8"),
+    "CACHE_REMOTE_URL": os.getenv("CACHE_REMOTE_URL", "none"),
+    "CACHE_REMOTE_TIMEOUT": os.getenv("CACHE_REMOTE_TIMEOUT", "0.5"),
+    "CACHE_REMOTE_TOKEN": os.getenv("CACHE_REMOTE_TOKEN", "none"),
     "REQUEST_TIMEOUT": int(os.getenv("REQUEST_TIMEOUT", "60")),
     "DEFAULT_MODEL": os.getenv("DEFAULT_MODEL", "gpt-5.4-mini"),
     "DEFAULT_TEMPERATURE": os.getenv("DEFAULT_TEMPERATURE", 0.0),
@@ -32,6 +48,13 @@ DEFAULT_CONFIG = {
     "OPENAI_FUNCTIONS_PATH": os.getenv("OPENAI_FUNCTIONS_PATH", str(FUNCTIONS_PATH)),
     "OPENAI_USE_FUNCTIONS": os.getenv("OPENAI_USE_FUNCTIONS", "true"),
     "SHOW_FUNCTIONS_OUTPUT": os.getenv("SHOW_FUNCTIONS_OUTPUT", "false"),
+    "FUNCTIONS_MAX_WORKERS": int(os.getenv("FUNCTIONS_MAX_WORKERS", "4")),
+    "FUNCTIONS_MAX_STEPS": int(os.getenv("FUNCTIONS_MAX_STEPS", "10")),
+    "FUNCTIONS_TIME_BUDGET": int(os.getenv("FUNCTIONS_TIME_BUDGET", "300")),
+    "FUNCTIONS_CACHE_LENGTH": int(os.getenv("FUNCTIONS_CACHE_LENGTH", "100")),
+    "SHELL_COMMAND_TIMEOUT": int(os.getenv("SHELL_COMMAND_TIMEOUT", "60")),
+    "SHELL_OUTPUT_HEAD_BYTES": int(os.getenv("SHELL_OUTPUT_HEAD_BYTES", "4096")),
+    "SHELL_OUTPUT_TAIL_BYTES": int(os.getenv("SHELL_OUTPUT_TAIL_BYTES", "12288")),
     "API_BASE_URL": os.getenv("API_BASE_URL", "default"),
     "PRETTIFY_MARKDOWN": os.getenv("PRETTIFY_MARKDOWN", "true"),
     "USE_LITELLM": os.getenv("USE_LITELLM", "false"),
@@ -40,8 +63,12 @@ DEFAULT_CONFIG = {
         "MARKDOWN_LIVE_VERTICAL_OVERFLOW", "visible"
     ),
     "MARKDOWN_LIVE_REFRESH_INTERVAL": os.getenv("MARKDOWN_LIVE_REFRESH_INTERVAL", "0"),
+    "PLAIN_OUTPUT": os.getenv("PLAIN_OUTPUT", "auto"),
     "OS_NAME": os.getenv("OS_NAME", "auto"),
     "SHELL_NAME": os.getenv("SHELL_NAME", "auto"),
+    "SHOW_STATS": os.getenv("SHOW_STATS", "false"),
+    "STATS_PATH": os.getenv("STATS_PATH", "none"),
+    "DAEMON_SOCKET_PATH": os.getenv("DAEMON_SOCKET_PATH", str(DAEMON_SOCKET_PATH)),
     # New features might add their own config variables here.
 }
 
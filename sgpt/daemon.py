@@ -0,0 +1,169 @@
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+from typing import Any, Dict, List
+
+import typer
+from click import UsageError
+
+from .client import HEADER, socket_path
+from .config import DEFAULT_CONFIG
+from .utils import option_callback
+
+# Besides config keys, these variables are read by provider SDKs.
+CONFIG_ENV_PREFIXES = ("OPENAI_", "LITELLM_", "SHELL_GPT_")
+
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Client disconnected.")
+        data += chunk
+    return data
+
+
+def _run(argv: List[str]) -> int:
+    from .app import main
+
+    app = typer.Typer(add_completion=False)
+    app.command()(main)
+    try:
+        app(args=argv, prog_name="sgpt")
+    except SystemExit as error:
+        return error.code if isinstance(error.code, int) else int(bool(error.code))
+    except Exception:
+        # Same output as uncaught exception would produce in-process.
+        sys.excepthook(*sys.exc_info())
+        return 1
+    return 0
+
+
+def _config_env(env: Dict[str, str]) -> Dict[str, str]:
+    return {
+        key: value
+        for key, value in env.items()
+        if key in DEFAULT_CONFIG or key.startswith(CONFIG_ENV_PREFIXES)
+    }
+
+
+def _handle(conn: socket.socket, daemon_env: Dict[str, str]) -> int:
+    """
+    Runs one sgpt command in forked worker process.
+    Client's stdin, stdout and stderr become our standard descriptors,
+    so all main() options work exactly like in-process.
+
+    :param daemon_env: Config environment variables of the daemon.
+    :return: Exit code, 0 if the client has to run the command itself.
+    """
+    message, fds, _flags, _address = socket.recv_fds(conn, HEADER.size, 3)
+    (size,) = HEADER.unpack(message)
+    request: Dict[str, Any] = json.loads(_recv_exact(conn, size))
+    if _config_env(request["env"]) != daemon_env:
+        # Provider client, cache and functions are built with daemon's config,
+        # closing connection without worker pid makes client run in-process.
+        for fd in fds:
+            os.close(fd)
+        return 0
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    conn.sendall(f"{os.getpid()}\n".encode())
+    exit_code = _run(request["argv"])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(f"{exit_code}\n".encode())
+    return exit_code
+
+
+def _finish_writes() -> None:
+    # Client has the exit code, its descriptors are released (so $(sgpt ...)
+    # gets EOF) and background writes are completed without delaying it.
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for target in range(3):
+        os.dup2(devnull, target)
+    os.close(devnull)
+    from .handlers.handler import Handler
+    from .remote_cache import PUT_TIMEOUT
+
+    if Handler.cache.remote:
+        Handler.cache.remote.wait(PUT_TIMEOUT)
+
+
+def _warm_up() -> None:
+    # Everything imported or built here is shared by all forked workers.
+    from .app import main  # noqa: F401
+    from .function import get_openai_schemas
+    from .handlers.handler import provider
+
+    provider.load()
+    get_openai_schemas()
+
+
+def serve() -> None:
+    """
+    Runs ShellGPT daemon, which keeps config, roles, functions and provider
+    SDK loaded. Every client connection is handled in a forked worker.
+    """
+    if not hasattr(socket, "send_fds"):
+        raise UsageError("ShellGPT daemon is available only on Unix systems.")
+    path = socket_path()
+    if path.exists():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(path))
+            except OSError:
+                path.unlink()  # Stale socket of a daemon which crashed.
+            else:
+                raise UsageError(f"ShellGPT daemon is already running on {path}")
+
+    daemon_env = _config_env(dict(os.environ))
+    _warm_up()
+    # Workers are reaped automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Socket is created accessible only by the owner, clients get our API key.
+    umask = os.umask(0o077)
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    server.listen()
+    typer.echo(f"ShellGPT daemon is listening on {path}")
+    try:
+        while True:
+            conn, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                exit_code = 1
+                try:
+                    with conn:
+                        exit_code = _handle(conn, daemon_env)
+                except Exception:
+                    traceback.print_exc()
+                    sys.stderr.flush()
+                finally:
+                    try:
+                        _finish_writes()
+                    finally:
+                        os._exit(exit_code)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        path.unlink(missing_ok=True)
+
+
+@option_callback
+def run_daemon(*_args: Any) -> None:
+    serve()
@@ -1,19 +1,127 @@
 import importlib.util
+import json
+import os
+import signal
+import subprocess
 import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from hashlib import sha256
 from pathlib import Path
-from typing import Any, Callable, Dict, List
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from pydantic import BaseModel
 
 from .config import cfg
 
+# Processes started by functions, killed if function calls are interrupted.
+_processes: Set["subprocess.Popen[bytes]"] = set()
+_processes_lock = Lock()
+
+
+@contextmanager
+def tracked_process(
+    process: "subprocess.Popen[bytes]",
+) -> Iterator["subprocess.Popen[bytes]"]:
+    """
+    Keeps process started by a function while it runs, so it is killed by
+    kill_processes. Functions run in worker threads don't get Ctrl+C.
+    """
+    with _processes_lock:
+        _processes.add(process)
+    try:
+        yield process
+    finally:
+        with _processes_lock:
+            _processes.discard(process)
+
+
+def kill_process(process: "subprocess.Popen[bytes]") -> None:
+    """
+    Kills the process with its children, if it was started in own session.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def kill_processes() -> None:
+    with _processes_lock:
+        processes = list(_processes)
+    for process in processes:
+        kill_process(process)
+
+
+class FunctionResults:
+    """
+    Results of function calls by function name and arguments, for functions
+    which declare themselves pure or give a TTL. Kept in memory of the process
+    (daemon workers exit after each command) up to length, least recently
+    used results are evicted first.
+    """
+
+    def __init__(self, length: int) -> None:
+        self.length = length
+        self._results: OrderedDict[Tuple[str, str], Tuple[str, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def call(
+        self, name: str, function: Callable[..., str], ttl: float, **kwargs: Any
+    ) -> str:
+        """
+        :param name: Function name.
+        :param function: Function to call if there is no result.
+        :param ttl: Seconds results are used for, 0 for no limit.
+        :param kwargs: Function arguments.
+        :return: Function result, marked if it is a result of a previous call.
+        """
+        key = (name, json.dumps(kwargs, sort_keys=True, separators=(",", ":")))
+        with self._lock:
+            result, created = self._results.get(key, (None, 0.0))
+            age = time.monotonic() - created
+            if result is not None and (not ttl or age <= ttl):
+                self._results.move_to_end(key)
+                return f"[Cached result of the same call {age:.0f}s ago]\n{result}"
+        # Identical concurrent calls are executed, functions can be slow.
+        result = function(**kwargs)
+        with self._lock:
+            self._results[key] = (result, time.monotonic())
+            self._results.move_to_end(key)
+            while len(self._results) > self.length:
+                self._results.popitem(last=False)
+        return result
+
+
+results = FunctionResults(int(cfg.get("FUNCTIONS_CACHE_LENGTH")))
+
 
 class Function:
-    def __init__(self, path: str):
-        module = self._read(path)
-        self._function = module.Function.execute
-        self._openai_schema = module.Function.openai_schema()
+    def __init__(self, path: str, openai_schema: Optional[Dict[str, Any]] = None):
+        """
+        :param path: Path to the function module.
+        :param openai_schema: Schema from the manifest, module is imported
+            only when the function is executed. If not provided, module
+            is imported to generate the schema.
+        """
+        self.path = path
+        self._function: Optional[Callable[..., str]] = None
+        self._lock = Lock()
+        module = None
+        if openai_schema is None:
+            module = self._read(path)
+            openai_schema = module.Function.openai_schema()
+        self._openai_schema = openai_schema
         self._name = self._openai_schema["function"]["name"]
+        if module is not None:
+            self._function = self._memoize(module.Function)
 
     @property
     def name(self) -> str:
@@ -21,11 +129,26 @@ class Function:
 
     @property
     def openai_schema(self) -> dict[str, Any]:
-        return self._openai_schema  # type: ignore
+        return self._openai_schema
 
     @property
     def execute(self) -> Callable[..., str]:
-        return self._function  # type: ignore
+        with self._lock:
+            if self._function is None:
+                self._function = self._memoize(self._read(self.path).Function)
+        return self._function
+
+    def _memoize(self, function_class: Any) -> Callable[..., str]:
+        """
+        :param function_class: Function class of the module, its results are
+            reused if it has "pure" or "cache_ttl" (seconds) class variable.
+        """
+        ttl = getattr(function_class, "cache_ttl", None)
+        if ttl is None and getattr(function_class, "pure", False):
+            ttl = 0.0
+        if ttl is None:
+            return function_class.execute  # type: ignore
+        return partial(results.call, self._name, function_class.execute, float(ttl))
 
     @classmethod
     def _read(cls, path: str) -> Any:
@@ -51,17 +174,80 @@ class Function:
         return module
 
 
+class FunctionManifest:
+    """
+    Keeps OpenAI schemas of function modules in a JSON file, keyed by module
+    path and validated by modification time, size and SHA-256 of the module.
+    Unchanged modules are not imported until their function is executed.
+    """
+
+    def __init__(self, functions_path: Path) -> None:
+        self.functions_path = functions_path
+        self.manifest_path = functions_path / ".manifest.json"
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _write(self, manifest: Dict[str, Dict[str, Any]]) -> None:
+        temp_path = self.manifest_path.with_name(f".manifest.{os.getpid()}.tmp")
+        try:
+            temp_path.write_text(json.dumps(manifest), encoding="utf-8")
+            os.replace(temp_path, self.manifest_path)
+        except OSError:
+            # Manifest is only an optimization, e.g. folder can be read-only.
+            temp_path.unlink(missing_ok=True)
+
+    def load(self) -> Dict[str, Function]:
+        """
+        :return: Functions by name, in order of module paths.
+        """
+        manifest = self._read()
+        updated: Dict[str, Dict[str, Any]] = {}
+        functions = {}
+        for path in sorted(self.functions_path.glob("*.py")):
+            stat = path.stat()
+            entry = manifest.get(str(path))
+            signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            if entry and all(entry.get(key) == signature[key] for key in signature):
+                function = Function(str(path), entry["schema"])
+            else:
+                digest = sha256(path.read_bytes()).hexdigest()
+                if entry and entry.get("sha256") == digest:
+                    # Touched, but not changed.
+                    function = Function(str(path), entry["schema"])
+                else:
+                    function = Function(str(path))
+                entry = {"sha256": digest, "schema": function.openai_schema}
+            updated[str(path)] = {**entry, **signature}
+            functions[function.name] = function
+        if updated != manifest:
+            self._write(updated)
+        return functions
+
+
 functions_folder = Path(cfg.get("OPENAI_FUNCTIONS_PATH"))
 functions_folder.mkdir(parents=True, exist_ok=True)
-functions = [Function(str(path)) for path in functions_folder.glob("*.py")]
+manifest = FunctionManifest(functions_folder)
+_functions: Optional[Dict[str, Function]] = None
+
+
+def get_functions() -> Dict[str, Function]:
+    global _functions
+    if _functions is None:
+        _functions = manifest.load()
+    return _functions
 
 
 def get_function(name: str) -> Callable[..., Any]:
-    for function in functions:
-        if function.name == name:
-            return function.execute
-    raise ValueError(f"Function {name} not found")
+    function = get_functions().get(name)
+    if function is None:
+        raise ValueError(f"Function {name} not found")
+    return function.execute
 
 
 def get_openai_schemas() -> List[Dict[str, Any]]:
-    return [function.openai_schema for function in functions]
+    return [function.openai_schema for function in get_functions().values()]
@@ -0,0 +1,126 @@
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import typer
+from click import BadParameter
+
+from ..cache_policy import CachePolicy
+from ..role import SystemRole
+from .default_handler import DefaultHandler
+
+
+class BatchHandler:
+    """
+    Runs prompts from a JSON Lines file concurrently. Each line is an object
+    with "prompt" and optional "id", "role", "model", "temperature" and
+    "top_p" keys. Results are written to stdout as JSON Lines in order of
+    completion. All requests share the same provider client and cache.
+    """
+
+    def __init__(self, role: SystemRole, concurrency: int) -> None:
+        self.role = role
+        self.concurrency = concurrency
+        self._handlers: Dict[str, DefaultHandler] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def read_records(path: Path) -> List[Dict[str, Any]]:
+        records = []
+        with path.open(encoding="utf-8") as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as error:
+                    raise BadParameter(f"Line {line_number}: {error}") from error
+                if not isinstance(record, dict) or not record.get("prompt"):
+                    raise BadParameter(f'Line {line_number}: missing "prompt".')
+                record.setdefault("id", line_number)
+                records.append(record)
+        return records
+
+    def get_handler(self, role_name: Optional[str]) -> DefaultHandler:
+        role_name = role_name or self.role.name
+        with self._lock:
+            if role_name not in self._handlers:
+                role = self.role if role_name == self.role.name else None
+                self._handlers[role_name] = DefaultHandler(
+                    role or SystemRole.get(role_name), False
+                )
+            return self._handlers[role_name]
+
+    def complete(
+        self,
+        record: Dict[str, Any],
+        model: str,
+        temperature: float,
+        top_p: float,
+        caching: bool,
+        functions: Optional[List[Dict[str, str]]],
+    ) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"id": record["id"]}
+        try:
+            handler = self.get_handler(record.get("role"))
+            policy = CachePolicy.from_config(handler.role.cache)
+            result["completion"] = "".join(
+                handler.get_completion(
+                    model=record.get("model", model),
+                    temperature=float(record.get("temperature", temperature)),
+                    top_p=float(record.get("top_p", top_p)),
+                    messages=handler.make_messages(str(record["prompt"]).strip()),
+                    functions=functions,
+                    caching=caching,
+                    similar=handler.similar,
+                    policy=policy,
+                )
+            )
+            result["cache"] = policy.decision
+            if policy.refresh:
+                handler.refresh_detached(policy.refresh)
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def handle(
+        self,
+        path: Path,
+        model: str,
+        temperature: float,
+        top_p: float,
+        caching: bool,
+        functions: Optional[List[Dict[str, str]]] = None,
+    ) -> None:
+        records = self.read_records(path)
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(
+                    self.complete,
+                    record,
+                    model,
+                    temperature,
+                    top_p,
+                    caching,
+                    functions,
+                )
+                for record in records
+            ]
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    failed += "error" in result
+                    sys.stdout.write(json.dumps(result) + "\n")
+                    sys.stdout.flush()
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                raise
+        raise typer.Exit(code=1 if failed else 0)
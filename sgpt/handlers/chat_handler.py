@@ -1,19 +1,39 @@
 import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from itertools import takewhile
 from pathlib import Path
-from typing import Any, Callable, Dict, Generator, List, Optional
+from threading import RLock
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 
 import typer
 from click import BadParameter, UsageError
-from rich.console import Console
-from rich.markdown import Markdown
 
+from ..chat_index import SORT_COLUMNS, ChatIndex
+from ..compress import check_method, compress, compress_block, decompress, method_of
 from ..config import cfg
 from ..role import DefaultRoles, SystemRole
-from ..utils import option_callback
+from ..stats import report_compaction, stats_enabled
+from ..tokens import message_tokens, messages_tokens, token_budget
+from ..utils import format_size, option_callback
 from .handler import Handler
 
+try:
+    import fcntl
+except ImportError:  # Windows, compactions are not coordinated.
+    fcntl = None  # type: ignore
+
 CHAT_CACHE_LENGTH = int(cfg.get("CHAT_CACHE_LENGTH"))
 CHAT_CACHE_PATH = Path(cfg.get("CHAT_CACHE_PATH"))
+SEARCH_LIMIT = 20
+SUMMARY_PREFIX = "Summary of the earlier part of the conversation:"
+SUMMARY_PROMPT = """Summarize the conversation below for its continuation.
+Keep facts, decisions, names, numbers, commands, code and open questions.
+Provide only the summary, in the language of the conversation."""
 
 
 class ChatSession:
@@ -21,18 +41,27 @@ class ChatSession:
     This class is used as a decorator for OpenAI chat API requests.
     The ChatSession class caches chat messages and keeps track of the
     conversation history. It is designed to store cached messages
-    in a specified directory and in JSON format.
+    in a specified directory and in JSON Lines format, each turn
+    appends only new messages to the chat file.
     """
 
-    def __init__(self, length: int, storage_path: Path):
+    def __init__(self, length: int, storage_path: Path, compression: str = "none"):
         """
         Initialize the ChatSession decorator.
 
         :param length: Integer, maximum number of cached messages to keep.
+        :param compression: Compression of chat files, "zlib", "zstd" or "none".
         """
         self.length = length
         self.storage_path = storage_path
         self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.compression = check_method(compression)
+        self.index = ChatIndex(storage_path.with_name(f"{storage_path.name}.index"))
+        # Parsed messages by chat id: file (mtime, size), messages, and whether
+        # file has to be rewritten (legacy JSON format or other compression).
+        self._cache: Dict[str, Tuple[Tuple[int, int], List[Dict[str, Any]], bool]] = {}
+        # Chat history can be compacted in background, see compact.
+        self._lock = RLock()
 
     def __call__(self, func: Callable[..., Any]) -> Callable[..., Any]:
         """
@@ -49,37 +78,354 @@ class ChatSession:
             if not chat_id:
                 yield from func(*args, **kwargs)
                 return
-            previous_messages = self._read(chat_id)
-            for message in kwargs["messages"]:
-                previous_messages.append(message)
-            kwargs["messages"] = previous_messages
+            history = self._read(chat_id)
+            messages = self._window(history, kwargs["messages"], kwargs.get("model"))
+            # Function calls append their messages to the list as well.
+            history_length = len(messages) - len(kwargs["messages"])
+            kwargs["messages"] = messages
             response_text = ""
             for word in func(*args, **kwargs):
                 response_text += word
                 yield word
-            previous_messages.append({"role": "assistant", "content": response_text})
-            self._write(kwargs["messages"], chat_id)
+            messages.append({"role": "assistant", "content": response_text})
+            self._write(messages[history_length:], chat_id)
 
         return wrapper
 
-    def _read(self, chat_id: str) -> List[Dict[str, str]]:
+    def _load(self, chat_id: str) -> List[Dict[str, Any]]:
+        """
+        Reads all stored messages of the chat, including the ones
+        which will be dropped by the next compaction. Parsed messages
+        are cached until the file is changed (by mtime and size).
+        """
         file_path = self.storage_path / chat_id
-        if not file_path.exists():
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            self._cache.pop(chat_id, None)
             return []
-        parsed_cache = json.loads(file_path.read_text())
-        return parsed_cache if isinstance(parsed_cache, list) else []
-
-    def _write(self, messages: List[Dict[str, str]], chat_id: str) -> None:
-        file_path = self.storage_path / chat_id
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(chat_id)
+        if cached and cached[0] == signature:
+            return list(cached[1])
+        data = file_path.read_bytes()
+        text = decompress(data)
+        # Chats created before JSON Lines format, migrated on next write.
+        legacy = text.lstrip().startswith("[")
+        if legacy:
+            parsed_cache = json.loads(text)
+            messages = parsed_cache if isinstance(parsed_cache, list) else []
+        else:
+            messages = [json.loads(line) for line in text.splitlines() if line]
+        rewrite = legacy or method_of(data) != self.compression
+        self._cache[chat_id] = (signature, messages, rewrite)
+        return list(messages)
+
+    def _update_cache(self, chat_id: str, messages: List[Dict[str, Any]]) -> None:
+        stat = (self.storage_path / chat_id).stat()
+        self._cache[chat_id] = ((stat.st_mtime_ns, stat.st_size), messages, False)
+
+    def _truncate(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         # Retain the first message since it defines the role
-        truncated_messages = (
-            messages[:1] + messages[1 + max(0, len(messages) - self.length) :]
+        return messages[:1] + messages[1 + max(0, len(messages) - self.length) :]
+
+    def _read(self, chat_id: str) -> List[Dict[str, Any]]:
+        return self._truncate(self._summarized(self._load(chat_id)))
+
+    @staticmethod
+    def _summarized(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replaces messages covered by the latest summary record with
+        a system message. Summary record {"role": "summary", "content": ...,
+        "keep": N} covers all messages stored before it, except the system
+        message and the last N messages.
+        """
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index]["role"] == "summary":
+                break
+        else:
+            return messages
+        summary = messages[index]
+        before = [
+            message for message in messages[:index] if message["role"] != "summary"
+        ]
+        system = before[:1] if before and before[0]["role"] == "system" else []
+        keep = min(summary["keep"], len(before) - len(system))
+        summary_message = {
+            "role": "system",
+            "content": f"{SUMMARY_PREFIX}\n{summary['content']}",
+        }
+        return (
+            system
+            + [summary_message]
+            + before[len(before) - keep :]
+            + messages[index + 1 :]
         )
-        json.dump(truncated_messages, file_path.open("w"))
+
+    def _window(
+        self,
+        history: List[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        model: Optional[str],
+    ) -> List[Dict[str, Any]]:
+        """
+        Selects messages to send within prompt token budget of the model
+        (CHAT_TOKEN_BUDGET): system messages, new messages and as many
+        of the most recent turns as fit. A turn (user message with following
+        assistant and tool messages) is never split. Stored history is kept.
+
+        :param history: Stored messages of the chat.
+        :param messages: New messages.
+        :param model: Model name.
+        :return: Messages to send.
+        """
+        budget = token_budget(model) if model else 0
+        if not budget:
+            return history + messages
+        system = list(takewhile(lambda message: message["role"] == "system", history))
+        tokens = messages_tokens(system + messages)
+        kept: List[Dict[str, Any]] = []
+        turn: List[Dict[str, Any]] = []
+        for index in range(len(history) - 1, len(system) - 1, -1):
+            turn.append(history[index])
+            if history[index]["role"] != "user" and index > len(system):
+                continue
+            tokens += messages_tokens(turn)
+            if tokens > budget:
+                break
+            kept += turn
+            turn = []
+        return system + kept[::-1] + messages
+
+    def _write(self, messages: List[Dict[str, Any]], chat_id: str) -> None:
+        """
+        Appends new messages to the chat file. Once the file holds twice as
+        many messages as CHAT_CACHE_LENGTH, it is compacted, so amortized
+        cost of each turn doesn't depend on the conversation length.
+
+        :param messages: Messages of the current turn.
+        :param chat_id: Chat id.
+        """
+        file_path = self.storage_path / chat_id
+        with self._lock:
+            stored = self._load(chat_id)
+            rewrite = chat_id in self._cache and self._cache[chat_id][2]
+            if rewrite or len(stored) + len(messages) > 2 * self.length + 1:
+                self._compact(stored + messages, chat_id)
+                return
+            lines = "".join(json.dumps(message) + "\n" for message in messages)
+            # Compressed block is appended, new file starts with the header.
+            compressed = compress_block if stored else compress
+            with file_path.open("ab") as file:
+                file.write(compressed(lines, self.compression))
+            self._update_cache(chat_id, stored + messages)
+            self._index(self.index.add, chat_id, messages, self._info(chat_id))
+
+    def _compact(self, messages: List[Dict[str, Any]], chat_id: str) -> None:
+        """
+        Rewrites the chat file with only retained messages (atomically).
+        """
+        file_path = self.storage_path / chat_id
+        messages = self._truncate(messages)
+        temp_path = file_path.with_name(f".{chat_id}.tmp")
+        lines = "".join(json.dumps(message) + "\n" for message in messages)
+        temp_path.write_bytes(compress(lines, self.compression))
+        os.replace(temp_path, file_path)
+        self._update_cache(chat_id, messages)
+        self._index(self.index.replace, chat_id, messages, self._info(chat_id))
+
+    def _info(self, chat_id: str) -> Dict[str, Any]:
+        """
+        Metadata of the chat for the index, from cached messages of the chat.
+        Last used time is modification time of the chat file.
+        """
+        (mtime_ns, size), stored, _ = self._cache[chat_id]
+        history = self._truncate(self._summarized(stored))
+        role = ""
+        if history and history[0]["role"] == "system":
+            role = SystemRole.get_role_name(history[0]["content"]) or ""
+        return {
+            "role": role,
+            "messages": sum(1 for message in stored if message["role"] != "summary"),
+            "size": size,
+            "tokens": messages_tokens(history),
+            "used": mtime_ns / 1e9,
+        }
+
+    @staticmethod
+    def _index(update: Callable[..., None], *args: Any) -> None:
+        try:
+            update(*args)
+        except sqlite3.Error as error:
+            # Search index is optional, it should never break the chat.
+            typer.secho(f"Chat index update failed: {error}", fg="red", err=True)
+
+    def _sync(self) -> None:
+        """
+        Indexes chats which were created without index (e.g. by older
+        versions) and removes chats deleted by hand from the index.
+        """
+        # Chats are added and removed by sgpt or by hand, folder's
+        # modification time tells if index may need to be synced.
+        synced = self.storage_path.stat().st_mtime_ns
+        if self.index.get_meta("synced") == synced:
+            return
+        chat_ids = {
+            name for name in os.listdir(self.storage_path) if not name.startswith(".")
+        }
+        indexed = self.index.chat_ids()
+        for chat_id in indexed - chat_ids:
+            self.index.remove(chat_id)
+        for chat_id in chat_ids - indexed:
+            messages = self._load(chat_id)
+            if messages:
+                self.index.replace(chat_id, messages, self._info(chat_id))
+        self.index.set_meta("synced", synced)
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, str, str]]:
+        """
+        Searches messages of all chats.
+
+        :return: Chat id, role and snippet of best matching messages.
+        """
+        self._sync()
+        return self.index.search(query, limit)
+
+    def list(
+        self,
+        sort: Optional[str] = "used",
+        match: str = "",
+        limit: int = -1,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Lists chats from the index, chat files are not read.
+        See ChatIndex.chats for parameters.
+
+        :return: Metadata of chats: chat_id, role, messages, size, tokens,
+            created and used (timestamps).
+        """
+        self._sync()
+        return self.index.chats(sort, match, limit, offset)
+
+    def gc(self, max_age: float, max_size: int) -> List[Dict[str, Any]]:
+        """
+        Removes chats which were not used for max_age seconds, and chats
+        which don't fit into max_size after more recently used chats.
+
+        :param max_age: Max age in seconds since last use, 0 for no limit.
+        :param max_size: Max total size of chat files in bytes, 0 for no limit.
+        :return: Metadata of removed chats.
+        """
+        expires = time.time() - max_age
+        total = 0
+        removed = []
+        # Most recently used chats are kept first.
+        for chat in self.list("used"):
+            expired = max_age and chat["used"] < expires
+            if expired or (max_size and total + chat["size"] > max_size):
+                self.invalidate(chat["chat_id"])
+                removed.append(chat)
+            else:
+                total += chat["size"]
+        return removed
+
+    def compact(
+        self,
+        chat_id: str,
+        summarize: Callable[[List[Dict[str, Any]]], str],
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Replaces older turns with a summary once estimated prompt tokens of
+        the history exceed CHAT_SUMMARY_TOKENS. Most recent turns up to
+        half of the threshold are kept as is. Summary is appended to the
+        chat file as a record, raw messages are kept.
+
+        :param chat_id: Chat id.
+        :param summarize: Function which summarizes messages.
+        :return: Estimated prompt tokens before and after, None if not compacted.
+        """
+        if not self.needs_compaction(chat_id):
+            return None
+        with self._compaction_lock(chat_id) as locked:
+            # Compacting by another process, or just compacted by it.
+            if not locked or not self.needs_compaction(chat_id):
+                return None
+            threshold = int(cfg.get("CHAT_SUMMARY_TOKENS"))
+            history = self._read(chat_id)
+            before = messages_tokens(history)
+            system = list(
+                takewhile(lambda message: message["role"] == "system", history)
+            )
+            # Index of the first kept message, turns are never split.
+            split = len(history)
+            tokens = 0
+            for index in range(len(history) - 1, len(system) - 1, -1):
+                tokens += message_tokens(history[index])
+                if tokens > threshold // 2:
+                    break
+                if history[index]["role"] == "user":
+                    split = index
+            if split <= len(system):
+                return None
+            stored = self._count_messages(chat_id)
+            # Previous summary is a system message, so it gets into the new one.
+            summary = summarize(history[1 if system else 0 : split])
+            with self._lock:
+                # Messages added while summarizing are kept as well.
+                keep = len(history) - split + self._count_messages(chat_id) - stored
+                record = {"role": "summary", "content": summary, "keep": keep}
+                self._write([record], chat_id)
+            return before, messages_tokens(self._read(chat_id))
+
+    @contextmanager
+    def _compaction_lock(self, chat_id: str) -> Generator[bool, None, None]:
+        """
+        Non-blocking lock (flock) of the chat compaction, so turns sent while
+        the chat is summarized don't start another summary request. Locks are
+        released by OS when the process exits.
+
+        :return: Whether the lock was taken.
+        """
+        if fcntl is None:
+            yield True
+            return
+        path = self.storage_path / f".{chat_id}.compact"
+        lock = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                current = os.fstat(lock).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                current = False
+            # Otherwise compaction was completed and the file removed after
+            # it was opened.
+            try:
+                yield current
+            finally:
+                if current:
+                    # Removed before the lock is released, see above.
+                    path.unlink(missing_ok=True)
+        finally:
+            os.close(lock)
+
+    def needs_compaction(self, chat_id: str) -> bool:
+        threshold = int(cfg.get("CHAT_SUMMARY_TOKENS"))
+        return bool(threshold) and messages_tokens(self._read(chat_id)) > threshold
+
+    def _count_messages(self, chat_id: str) -> int:
+        stored = self._load(chat_id)
+        return sum(1 for message in stored if message["role"] != "summary")
 
     def invalidate(self, chat_id: str) -> None:
         file_path = self.storage_path / chat_id
         file_path.unlink(missing_ok=True)
+        self._cache.pop(chat_id, None)
+        self._index(self.index.remove, chat_id)
 
     def get_messages(self, chat_id: str) -> List[str]:
         messages = self._read(chat_id)
@@ -88,15 +434,14 @@ class ChatSession:
     def exists(self, chat_id: Optional[str]) -> bool:
         return bool(chat_id and bool(self._read(chat_id)))
 
-    def list(self) -> List[Path]:
-        # Get all files in the folder.
-        files = self.storage_path.glob("*")
-        # Sort files by last modification time in ascending order.
-        return sorted(files, key=lambda f: f.stat().st_mtime)
-
 
 class ChatHandler(Handler):
-    chat_session = ChatSession(CHAT_CACHE_LENGTH, CHAT_CACHE_PATH)
+    chat_session = ChatSession(
+        CHAT_CACHE_LENGTH, CHAT_CACHE_PATH, cfg.get("STORAGE_COMPRESSION")
+    )
+    # REPL compacts chat history while waiting for input,
+    # other chats in a detached process, see compact_detached.
+    background_compaction = False
 
     def __init__(self, chat_id: str, role: SystemRole, markdown: bool) -> None:
         super().__init__(role, markdown)
@@ -115,7 +460,6 @@ class ChatHandler(Handler):
 
     @property
     def is_same_role(self) -> bool:
-        # TODO: Should be optimized for REPL mode.
         return self.role.same_role(self.initial_message(self.chat_id))
 
     @classmethod
@@ -123,17 +467,66 @@ class ChatHandler(Handler):
         chat_history = cls.chat_session.get_messages(chat_id)
         return chat_history[0] if chat_history else ""
 
+    @classmethod
+    def list_ids(cls, ctx: typer.Context, value: bool) -> None:
+        # Prints existing chats to the console, sort and filter
+        # options are eager, so they are parsed before this callback.
+        # Without --chats-sort, chats are listed least recently used first,
+        # plain output (e.g. to a pipe) has only chat paths for scripts.
+        if not value:
+            return
+        sort = ctx.params.get("chats_sort")
+        if sort is not None and sort not in SORT_COLUMNS:
+            raise BadParameter(
+                f"{sort}, use one of {', '.join(SORT_COLUMNS)}",
+                param_hint="'--chats-sort'",
+            )
+        chats = cls.chat_session.list(
+            sort,
+            ctx.params.get("chats_filter") or "",
+            ctx.params.get("chats_limit") or -1,
+            ctx.params.get("chats_offset") or 0,
+        )
+        for chat in chats:
+            if cls.plain_output():
+                typer.echo(cls.chat_session.storage_path / chat["chat_id"])
+                continue
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(chat["used"]))
+            typer.echo(cls.chat_session.storage_path / chat["chat_id"], nl=False)
+            typer.secho(
+                f"  {chat['role'] or '-'}, {chat['messages']} messages, "
+                f"{format_size(chat['size'])}, ~{chat['tokens']} tokens, "
+                f"used {used}",
+                fg="bright_black",
+            )
+        raise typer.Exit()
+
     @classmethod
     @option_callback
-    def list_ids(cls, value: str) -> None:
-        # Prints all existing chat IDs to the console.
-        for chat_id in cls.chat_session.list():
-            typer.echo(chat_id)
+    def gc(cls, value: bool) -> None:
+        # Removes chats by age and total size.
+        removed = cls.chat_session.gc(
+            float(cfg.get("CHAT_GC_MAX_DAYS")) * 24 * 60 * 60,
+            int(cfg.get("CHAT_GC_MAX_BYTES")),
+        )
+        size = format_size(sum(chat["size"] for chat in removed))
+        typer.echo(f"Removed {len(removed)} chats ({size}).")
+
+    @classmethod
+    @option_callback
+    def search(cls, query: str) -> None:
+        # Prints best matching messages of all chats.
+        for chat_id, role, snippet in cls.chat_session.search(query, SEARCH_LIMIT):
+            typer.secho(chat_id, fg="green", nl=False)
+            typer.echo(f" {role}: {' '.join(snippet.split())}")
 
     @classmethod
     def show_messages(cls, chat_id: str, markdown: bool) -> None:
         color = cfg.get("DEFAULT_COLOR")
         if "APPLY MARKDOWN" in cls.initial_message(chat_id) and markdown:
+            from rich.console import Console
+            from rich.markdown import Markdown
+
             theme = cfg.get("CODE_THEME")
             for message in cls.chat_session.get_messages(chat_id):
                 if message.startswith("assistant:"):
@@ -173,5 +566,61 @@ class ChatHandler(Handler):
     def get_completion(self, **kwargs: Any) -> Generator[str, None, None]:
         yield from super().get_completion(**kwargs)
 
+    def summarize(self, messages: List[Dict[str, Any]], model: str) -> str:
+        transcript = "\n\n".join(
+            f"{message['role']}: "
+            f"{message.get('content') or json.dumps(message.get('tool_calls'))}"
+            for message in messages
+        )
+        return self.complete(
+            model,
+            [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+        )
+
+    def compact(self, model: str, stats: bool = False) -> None:
+        """
+        Summarizes older turns of the chat if it is too long, see ChatSession.compact.
+        Compaction is an optimization, so errors are reported but not raised.
+        """
+        started = time.monotonic()
+        try:
+            result = self.chat_session.compact(
+                self.chat_id, lambda messages: self.summarize(messages, model)
+            )
+        except Exception as error:
+            typer.secho(f"Chat compaction failed: {error}", fg="red", err=True)
+            return
+        if result and stats_enabled(stats):
+            report_compaction(model, *result, time.monotonic() - started, stats)
+
+    def compact_detached(self, model: str) -> None:
+        """
+        Summarizes older turns of the chat in a detached process (see
+        compact_chat), so the command doesn't wait for the summary request.
+        """
+        subprocess.Popen(
+            [sys.executable, "-m", "sgpt", "--compact-chat", self.chat_id],
+            env={**os.environ, "DEFAULT_MODEL": model},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    @classmethod
+    @option_callback
+    def compact_chat(cls, chat_id: str) -> None:
+        # Runs in the process started by compact_detached.
+        handler = cls(chat_id, DefaultRoles.DEFAULT.get_role(), False)
+        handler.compact(cfg.get("DEFAULT_MODEL"))
+
     def handle(self, **kwargs: Any) -> str:  # type: ignore[override]
-        return super().handle(**kwargs, chat_id=self.chat_id)
+        full_completion = super().handle(**kwargs, chat_id=self.chat_id)
+        if not self.background_compaction and self.chat_session.needs_compaction(
+            self.chat_id
+        ):
+            self.compact_detached(kwargs["model"])
+        return full_completion
@@ -1,43 +1,52 @@
 import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, Dict, Generator, List, Optional, cast
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, List, Optional, cast
 
-from rich.live_render import VerticalOverflowMethod
+import click
+import typer
+from click import UsageError
 
-from ..cache import Cache
+from ..cache import cache_backend
+from ..cache_policy import CachePolicy
 from ..config import cfg
-from ..function import get_function
-from ..printer import MarkdownPrinter, Printer, TextPrinter
+from ..function import get_function, kill_processes
+from ..printer import MarkdownPrinter, PlainPrinter, Printer, TextPrinter
+from ..provider import Provider
+from ..remote_cache import RemoteCache
 from ..role import DefaultRoles, SystemRole
+from ..stats import RequestStats, stats_enabled
+from ..tokens import messages_tokens
+from ..utils import format_size, option_callback, parse_duration
 
-completion: Callable[..., Any] = lambda *args, **kwargs: Generator[Any, None, None]
+if TYPE_CHECKING:
+    from rich.live_render import VerticalOverflowMethod
 
-base_url = cfg.get("API_BASE_URL")
-use_litellm = cfg.get("USE_LITELLM") == "true"
-additional_kwargs = {
-    "timeout": int(cfg.get("REQUEST_TIMEOUT")),
-    "api_key": cfg.get("OPENAI_API_KEY"),
-    "base_url": None if base_url == "default" else base_url,
-}
-
-if use_litellm:
-    import litellm  # type: ignore
-
-    completion = litellm.completion
-    litellm.suppress_debug_info = True
-else:
-    from openai import OpenAI
-
-    client = OpenAI(**additional_kwargs)  # type: ignore
-    completion = client.chat.completions.create
-    additional_kwargs = {}
+provider = Provider()
+completion: Callable[..., Any] = provider.completion
+use_litellm = provider.use_litellm
 
 
 class Handler:
-    cache = Cache(int(cfg.get("CACHE_LENGTH")), Path(cfg.get("CACHE_PATH")))
+    cache = cache_backend(cfg.get("CACHE_BACKEND"))(
+        int(cfg.get("CACHE_LENGTH")),
+        Path(cfg.get("CACHE_PATH")),
+        int(cfg.get("CACHE_MAX_BYTES")),
+        cfg.get("STORAGE_COMPRESSION"),
+        float(cfg.get("CACHE_SIMILAR_THRESHOLD")),
+        RemoteCache.from_config(),
+    )
 
     def __init__(self, role: SystemRole, markdown: bool) -> None:
         self.role = role
+        # Cached completions of similar prompts are reused for these roles.
+        similar_roles = cfg.get("CACHE_SIMILAR_ROLES").split(",")
+        self.similar = role.name in (name.strip() for name in similar_roles)
 
         api_base_url = cfg.get("API_BASE_URL")
         self.base_url = None if api_base_url == "default" else api_base_url
@@ -45,11 +54,22 @@ class Handler:
 
         self.markdown = "APPLY MARKDOWN" in self.role.role and markdown
         self.code_theme, self.color = cfg.get("CODE_THEME"), cfg.get("DEFAULT_COLOR")
+        self.stats: Optional[RequestStats] = None
+
+    @staticmethod
+    def plain_output() -> bool:
+        # Output is for scripts, pipes and files, not for a person.
+        plain_output = cfg.get("PLAIN_OUTPUT")
+        return plain_output == "true" or (
+            plain_output == "auto" and not sys.stdout.isatty()
+        )
 
     @property
     def printer(self) -> Printer:
+        if self.plain_output():
+            return PlainPrinter()
         vertical_overflow = cast(
-            VerticalOverflowMethod, cfg.get("MARKDOWN_LIVE_VERTICAL_OVERFLOW")
+            "VerticalOverflowMethod", cfg.get("MARKDOWN_LIVE_VERTICAL_OVERFLOW")
         )
         refresh_interval = float(cfg.get("MARKDOWN_LIVE_REFRESH_INTERVAL"))
         return (
@@ -61,24 +81,33 @@ class Handler:
     def make_messages(self, prompt: str) -> List[Dict[str, str]]:
         raise NotImplementedError
 
-    def handle_function_call(
+    def handle_function_calls(
         self,
         messages: List[dict[str, Any]],
-        tool_call_id: str,
-        name: str,
-        arguments: str,
+        tool_calls: List[Dict[str, str]],
     ) -> Generator[str, None, None]:
-        # Add assistant message with tool call
+        """
+        Runs tool calls of a single model response concurrently and adds
+        their results to messages in the order model requested them.
+
+        :param messages: Conversation messages, modified in place.
+        :param tool_calls: Tool calls with "id", "name" and "arguments" keys.
+        """
+        # Add assistant message with tool calls
         messages.append(
             {
                 "role": "assistant",
                 "content": None,
                 "tool_calls": [
                     {
-                        "id": tool_call_id,
+                        "id": tool_call["id"],
                         "type": "function",
-                        "function": {"name": name, "arguments": arguments},
+                        "function": {
+                            "name": tool_call["name"],
+                            "arguments": tool_call["arguments"],
+                        },
                     }
+                    for tool_call in tool_calls
                 ],
             }
         )
@@ -86,18 +115,106 @@ class Handler:
         if messages and messages[-1]["role"] == "assistant":
             yield "\n"
 
-        dict_args = json.loads(arguments)
-        joined_args = ", ".join(f'{k}="{v}"' for k, v in dict_args.items())
-        yield f"> @FunctionCall `{name}({joined_args})` \n\n"
+        calls = []
+        for tool_call in tool_calls:
+            dict_args = json.loads(tool_call["arguments"] or "{}")
+            joined_args = ", ".join(f'{k}="{v}"' for k, v in dict_args.items())
+            yield f"> @FunctionCall `{tool_call['name']}({joined_args})` \n\n"
+            calls.append((get_function(tool_call["name"]), dict_args))
 
-        result = get_function(name)(**dict_args)
-        if cfg.get("SHOW_FUNCTIONS_OUTPUT") == "true":
-            yield f"```text\n{result}\n```\n"
+        started = time.perf_counter()
+        workers = min(len(calls), int(cfg.get("FUNCTIONS_MAX_WORKERS")))
+        if workers > 1:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [
+                    executor.submit(function, **args) for function, args in calls
+                ]
+                results = [future.result() for future in futures]
+            except BaseException:
+                # Ctrl+C is raised only in this thread, so running calls are
+                # not waited for and processes they started are killed.
+                executor.shutdown(wait=False, cancel_futures=True)
+                kill_processes()
+                raise
+            executor.shutdown()
+        else:
+            results = [function(**dict_args) for function, dict_args in calls]
+        if self.stats:
+            self.stats.add_tool_calls(len(calls), time.perf_counter() - started)
 
-        # Add tool response message
-        messages.append(
-            {"role": "tool", "content": result, "tool_call_id": tool_call_id}
+        for tool_call, result in zip(tool_calls, results, strict=True):
+            if cfg.get("SHOW_FUNCTIONS_OUTPUT") == "true":
+                yield f"```text\n{result}\n```\n"
+            # Add tool response message
+            messages.append(
+                {"role": "tool", "content": result, "tool_call_id": tool_call["id"]}
+            )
+
+    def stream_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        **kwargs: Any,
+    ) -> Generator[str, None, List[Dict[str, str]]]:
+        """
+        Streams content of a single completion request.
+
+        :param messages: Conversation messages.
+        :return: Tool calls requested by the model, ordered by index.
+        """
+        tool_calls: Dict[int, Dict[str, str]] = {}
+        response = completion(messages=messages, stream=True, **kwargs)
+        try:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+
+                # LiteLLM uses dict instead of Pydantic object like OpenAI does.
+                delta_tool_calls = (
+                    delta.get("tool_calls") if use_litellm else delta.tool_calls
+                )
+                for tool_call in delta_tool_calls or []:
+                    if use_litellm:
+                        # TODO: test.
+                        function = tool_call.get("function") or {}
+                        index = tool_call.get("index")
+                        tool_call_id = tool_call.get("id")
+                        name = function.get("name")
+                        arguments = function.get("arguments")
+                    else:
+                        function = tool_call.function
+                        index = tool_call.index
+                        tool_call_id = tool_call.id
+                        name = function.name if function else None
+                        arguments = function.arguments if function else None
+                    # Tool calls are streamed in parts, matched by index.
+                    call = tool_calls.setdefault(
+                        index or 0, {"id": "", "name": "", "arguments": ""}
+                    )
+                    call["id"] = tool_call_id or call["id"]
+                    call["name"] = name or call["name"]
+                    call["arguments"] += arguments or ""
+                if chunk.choices[0].finish_reason == "tool_calls":
+                    break
+
+                yield delta.content or ""
+        except KeyboardInterrupt:
+            response.close()
+            raise
+        return [tool_calls[index] for index in sorted(tool_calls)]
+
+    def complete(self, model: str, messages: List[Dict[str, Any]]) -> str:
+        """
+        Requests a completion without streaming, tools and cache,
+        for internal use (e.g. summarizing chat history).
+
+        :return: Completion text.
+        """
+        response = completion(
+            model=model, temperature=0.0, messages=messages, stream=False
         )
+        return str(response.choices[0].message.content or "")
 
     @cache
     def get_completion(
@@ -108,7 +225,7 @@ class Handler:
         messages: List[Dict[str, Any]],
         functions: Optional[List[Dict[str, str]]],
     ) -> Generator[str, None, None]:
-        tool_call_id = name = arguments = ""
+        additional_kwargs: Dict[str, Any] = {}
         is_shell_role = self.role.name == DefaultRoles.SHELL.value
         is_code_role = self.role.name == DefaultRoles.CODE.value
         is_dsc_shell_role = self.role.name == DefaultRoles.DESCRIBE_SHELL.value
@@ -118,57 +235,42 @@ class Handler:
         if functions:
             additional_kwargs["tool_choice"] = "auto"
             additional_kwargs["tools"] = functions
-            additional_kwargs["parallel_tool_calls"] = False
-
-        response = completion(
-            model=model,
-            temperature=temperature,
-            top_p=top_p,
-            messages=messages,
-            stream=True,
-            **additional_kwargs,
-        )
 
+        # Model calls tools and gets their results until it answers without
+        # tool calls, limited by amount of steps and time.
+        max_steps = int(cfg.get("FUNCTIONS_MAX_STEPS"))
+        time_budget = float(cfg.get("FUNCTIONS_TIME_BUDGET"))
+        started = time.monotonic()
+        step = 0
         try:
-            for chunk in response:
-                if not chunk.choices:
-                    continue
-                delta = chunk.choices[0].delta
-
-                # LiteLLM uses dict instead of Pydantic object like OpenAI does.
-                tool_calls = (
-                    delta.get("tool_calls") if use_litellm else delta.tool_calls
+            while True:
+                step += 1
+                step_started = time.monotonic()
+                if self.stats and step == 1:
+                    self.stats.prompt_tokens = messages_tokens(messages)
+                if functions and (
+                    step >= max_steps or step_started - started >= time_budget
+                ):
+                    # Budget is exhausted, ask for an answer with results so far.
+                    additional_kwargs["tool_choice"] = "none"
+                tool_calls = yield from self.stream_completion(
+                    model=model,
+                    temperature=temperature,
+                    top_p=top_p,
+                    messages=messages,
+                    **additional_kwargs,
                 )
-                if tool_calls:
-                    for tool_call in tool_calls:
-                        if use_litellm:
-                            # TODO: test.
-                            tool_call_id = tool_call.get("id") or tool_call_id
-                            name = tool_call.get("function", {}).get("name") or name
-                            arguments += tool_call.get("function", {}).get(
-                                "arguments", ""
-                            )
-                        else:
-                            tool_call_id = tool_call.id or tool_call_id
-                            name = tool_call.function.name or name
-                            arguments += tool_call.function.arguments or ""
-                if chunk.choices[0].finish_reason == "tool_calls":
-                    yield from self.handle_function_call(
-                        messages, tool_call_id, name, arguments
-                    )
-                    yield from self.get_completion(
-                        model=model,
-                        temperature=temperature,
-                        top_p=top_p,
-                        messages=messages,
-                        functions=functions,
-                        caching=False,
-                    )
+                if tool_calls and additional_kwargs.get("tool_choice") != "none":
+                    yield from self.handle_function_calls(messages, tool_calls)
+                else:
+                    tool_calls = []
+                if self.stats:
+                    elapsed = time.monotonic() - step_started
+                    self.stats.add_step(elapsed, len(tool_calls))
+                if not tool_calls:
                     return
-
-                yield delta.content or ""
         except KeyboardInterrupt:
-            response.close()
+            return
 
     def handle(
         self,
@@ -178,10 +280,14 @@ class Handler:
         top_p: float,
         caching: bool,
         functions: Optional[List[Dict[str, str]]] = None,
+        stats: bool = False,
+        replay_speed: float = 0.0,
         **kwargs: Any,
     ) -> str:
         disable_stream = cfg.get("DISABLE_STREAMING") == "true"
+        self.stats = RequestStats(model) if stats_enabled(stats) else None
         messages = self.make_messages(prompt.strip())
+        policy = CachePolicy.from_config(self.role.cache)
         generator = self.get_completion(
             model=model,
             temperature=temperature,
@@ -189,6 +295,135 @@ class Handler:
             messages=messages,
             functions=functions,
             caching=caching,
+            replay_speed=replay_speed,
+            similar=self.similar,
+            policy=policy,
             **kwargs,
         )
-        return self.printer(generator, not disable_stream)
+        if self.stats:
+            generator = self.stats.track(generator)
+        full_completion = self.printer(generator, not disable_stream)
+        if policy.refresh:
+            self.refresh_detached(policy.refresh)
+        if not self.stats:
+            return full_completion
+        self.stats.cache, self.stats.cache_policy = policy.decision, policy.reason
+        self.stats.finish()
+        self.stats.report(show=stats)
+        return full_completion
+
+    def refresh_detached(self, request: str) -> None:
+        """
+        Requests completion of stale cache entry again in a detached process
+        (see refresh_cache), so the command doesn't wait for it.
+
+        :param request: Request of the entry, see CachePolicy.refresh.
+        """
+        # Requests can be larger than pipe buffer, so they are passed in a file.
+        file, path = tempfile.mkstemp(prefix="sgpt-refresh-", suffix=".json")
+        with os.fdopen(file, "w", encoding="utf-8") as request_file:
+            json.dump({"role": self.role.name, "request": request}, request_file)
+        subprocess.Popen(
+            [sys.executable, "-m", "sgpt", "--refresh-cache", path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    @classmethod
+    @option_callback
+    def refresh_cache(cls, path: str) -> None:
+        # Runs in the process started by refresh_detached.
+        request_path = Path(path)
+        data = json.loads(request_path.read_text(encoding="utf-8"))
+        request_path.unlink()
+        handler = cls(SystemRole.get(data["role"]), False)
+        args, kwargs = json.loads(data["request"])
+        refreshed = handler.get_completion(
+            *args, **kwargs, refresh=True, similar=handler.similar
+        )
+        for _ in refreshed:
+            pass
+
+    @classmethod
+    @option_callback
+    def cache_stats(cls, value: bool) -> None:
+        # Prints size of the cache and counters of requests since first one.
+        entries = cls.cache.entries()
+        counters = cls.cache.counters.get()
+        size = sum(entry["size"] for entry in entries)
+        limit = format_size(cls.cache.max_bytes) if cls.cache.max_bytes else "none"
+        hits, misses = counters["hits"], counters["misses"]
+        rate = hits / (hits + misses) if hits + misses else 0
+        typer.echo(
+            f"Entries: {len(entries)} of {cls.cache.length}, "
+            f"{format_size(size)} (limit {limit})"
+        )
+        typer.echo(
+            f"Requests: {hits + misses + counters['bypasses']:.0f}, "
+            f"{hits:.0f} hits ({rate:.1%}), {counters['similar_hits']:.0f} similar, "
+            f"{counters['remote_hits']:.0f} remote, "
+            f"{counters['stale_hits']:.0f} stale, {misses:.0f} misses, "
+            f"{counters['bypasses']:.0f} bypassed"
+        )
+        typer.echo(
+            f"Written: {format_size(counters['bytes_written'])}, "
+            f"{counters['evictions']:.0f} evicted, {counters['purged']:.0f} purged"
+        )
+        typer.echo(
+            f"Saved: {counters['saved_seconds']:.1f}s of requests, "
+            f"~{counters['saved_tokens']:.0f} tokens"
+        )
+        if counters["since"]:
+            since = time.localtime(counters["since"])
+            typer.echo(f"Since: {time.strftime('%Y-%m-%d %H:%M', since)}")
+
+    @classmethod
+    @option_callback
+    def cache_ls(cls, value: bool) -> None:
+        # Prints cache entries, most recently written first.
+        for entry in cls.cache.entries():
+            preview = cls.cache.preview(entry["key"])
+            if preview is None:
+                continue  # Evicted by another process.
+            written = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"]))
+            typer.echo(entry["key"], nl=False)
+            typer.secho(
+                f"  {format_size(entry['size'])}, written {written}, ",
+                fg="bright_black",
+                nl=False,
+            )
+            typer.echo(preview)
+
+    @classmethod
+    def cache_purge(cls, ctx: typer.Context, value: bool) -> None:
+        # Removes cache entries, --older-than is eager,
+        # so it is parsed before this callback.
+        if not value:
+            return
+        older_than = ctx.params.get("older_than")
+        seconds = parse_duration(older_than, "'--older-than'") if older_than else 0
+        removed = cls.cache.purge(seconds)
+        size = format_size(sum(entry["size"] for entry in removed))
+        typer.echo(f"Removed {len(removed)} entries ({size}).")
+        raise typer.Exit()
+
+    @classmethod
+    @option_callback
+    def cache_export(cls, path: str) -> None:
+        # Writes entries as JSON lines, "-" for stdout.
+        with click.open_file(path, "w", encoding="utf-8") as file:
+            exported = cls.cache.export_entries(file)
+        typer.echo(f"Exported {exported} entries.", err=path == "-")
+
+    @classmethod
+    @option_callback
+    def cache_import(cls, path: str) -> None:
+        # Reads entries written by --cache-export, "-" for stdin.
+        with click.open_file(path, encoding="utf-8") as file:
+            try:
+                imported = cls.cache.import_entries(file)
+            except ValueError as error:
+                raise UsageError(f"{path}: {error}") from error
+        typer.echo(f"Imported {imported} entries.")
@@ -1,8 +1,7 @@
-from typing import Any
+from threading import Thread
+from typing import Any, Optional
 
 import typer
-from rich import print as rich_print
-from rich.rule import Rule
 
 from ..role import DefaultRoles, SystemRole
 from ..utils import run_command
@@ -11,8 +10,11 @@ from .default_handler import DefaultHandler
 
 
 class ReplHandler(ChatHandler):
+    background_compaction = True
+
     def __init__(self, chat_id: str, role: SystemRole, markdown: bool) -> None:
         super().__init__(chat_id, role, markdown)
+        self._compaction: Optional[Thread] = None
 
     @classmethod
     def _get_multiline_input(cls) -> str:
@@ -22,6 +24,9 @@ class ReplHandler(ChatHandler):
         return multiline_input
 
     def handle(self, init_prompt: str, **kwargs: Any) -> None:  # type: ignore
+        from rich import print as rich_print
+        from rich.rule import Rule
+
         if self.initiated:
             rich_print(Rule(title="Chat History", style="bold magenta"))
             self.show_messages(self.chat_id, self.markdown)
@@ -49,6 +54,8 @@ class ReplHandler(ChatHandler):
             if prompt == '"""':
                 prompt = self._get_multiline_input()
             if prompt == "exit()":
+                if self._compaction:
+                    self._compaction.join()
                 raise typer.Exit()
             if init_prompt:
                 prompt = f"{init_prompt}\n\n\n{prompt}"
@@ -63,4 +70,13 @@ class ReplHandler(ChatHandler):
                     DefaultRoles.DESCRIBE_SHELL.get_role(), self.markdown
                 ).handle(prompt=full_completion, **kwargs)
             else:
+                if self._compaction:
+                    self._compaction.join()
                 full_completion = super().handle(prompt=prompt, **kwargs)
+                # Summarize history while user is typing the next prompt.
+                self._compaction = Thread(
+                    target=self.compact,
+                    args=(kwargs["model"], kwargs.get("stats", False)),
+                    daemon=True,
+                )
+                self._compaction.start()
@@ -1,8 +1,55 @@
 import subprocess
-from typing import Any, Dict
+import time
+from threading import Thread
+from typing import IO, Any, Dict
 
 from pydantic import BaseModel, Field
 
+from sgpt.config import cfg
+from sgpt.function import kill_process, tracked_process
+
+READ_SIZE = 64 * 1024
+
+
+class Output:
+    """
+    Keeps first head_size and last tail_size bytes of the output,
+    so memory usage doesn't depend on the amount of output.
+    """
+
+    def __init__(self, head_size: int, tail_size: int) -> None:
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if len(self.head) < self.head_size:
+            free = self.head_size - len(self.head)
+            self.head += data[:free]
+            data = data[free:]
+        self.tail += data
+        # Trim once tail is twice as big, to not copy it on every write.
+        if len(self.tail) > 2 * self.tail_size:
+            del self.tail[: len(self.tail) - self.tail_size]
+
+    def read_from(self, stream: IO[bytes]) -> None:
+        while data := stream.read1(READ_SIZE):  # type: ignore
+            self.write(data)
+
+    def __str__(self) -> str:
+        tail = self.tail[max(0, len(self.tail) - self.tail_size) :]
+        truncated = self.size - len(self.head) - len(tail)
+        if truncated <= 0:
+            return (self.head + self.tail).decode(errors="replace")
+        return (
+            f"{self.head.decode(errors='replace')}\n"
+            f"[... {truncated} bytes truncated ...]\n"
+            f"{tail.decode(errors='replace')}"
+        )
+
 
 class Function(BaseModel):
     """
@@ -17,12 +64,48 @@ class Function(BaseModel):
 
     @classmethod
     def execute(cls, shell_command: str) -> str:
+        timeout = float(cfg.get("SHELL_COMMAND_TIMEOUT"))
+        output = Output(
+            int(cfg.get("SHELL_OUTPUT_HEAD_BYTES")),
+            int(cfg.get("SHELL_OUTPUT_TAIL_BYTES")),
+        )
+        started = time.monotonic()
         process = subprocess.Popen(
-            shell_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            shell_command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            # Own process group, to kill the command with all its children.
+            start_new_session=True,
         )
-        output, _ = process.communicate()
-        exit_code = process.returncode
-        return f"Exit code: {exit_code}, Output:\n{output.decode()}"
+        reader = Thread(target=output.read_from, args=(process.stdout,), daemon=True)
+        reader.start()
+
+        timed_out = False
+        try:
+            # Killed if calls running in parallel are interrupted.
+            with tracked_process(process):
+                process.wait(timeout)
+                # Background children can keep the output open.
+                reader.join(max(0.0, timeout - (time.monotonic() - started)))
+                timed_out = reader.is_alive()
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        except BaseException:
+            # Command is in its own session and doesn't get Ctrl+C.
+            kill_process(process)
+            raise
+        if timed_out:
+            kill_process(process)
+            reader.join(1)
+        if not reader.is_alive():
+            process.stdout.close()  # type: ignore
+        elapsed = time.monotonic() - started
+
+        status = f"Exit code: {process.returncode}"
+        if timed_out:
+            status += f" (killed after {timeout:g}s timeout)"
+        return f"{status}, Elapsed: {elapsed:.2f}s, Output:\n{output}"
 
     @classmethod
     def openai_schema(cls) -> Dict[str, Any]:
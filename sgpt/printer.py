@@ -1,16 +1,40 @@
+import sys
 import time
 from abc import ABC, abstractmethod
-from typing import Generator
+from typing import TYPE_CHECKING, Any, Dict, Generator, List, Optional, Tuple
 
-from rich.console import Console
-from rich.live import Live
-from rich.live_render import VerticalOverflowMethod
-from rich.markdown import Markdown
 from typer import secho
 
+# Rich is imported only by printers which render with it,
+# plain output (e.g. to a pipe) should not pay for importing it.
+if TYPE_CHECKING:
+    from markdown_it.token import Token
+    from rich.console import Console, RenderableType
+    from rich.live import Live
+    from rich.live_render import VerticalOverflowMethod
+
+SELF_SEPARATED_BLOCKS = (
+    "bullet_list_open",
+    "ordered_list_open",
+    "blockquote_open",
+    "table_open",
+)
+
 
 class Printer(ABC):
-    console = Console()
+    _console: Optional["Console"] = None
+
+    @property
+    def console(self) -> "Console":
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console()
+        return self._console
+
+    @console.setter
+    def console(self, console: "Console") -> None:
+        self._console = console
 
     @abstractmethod
     def live_print(self, chunks: Generator[str, None, None]) -> str:
@@ -34,15 +58,105 @@ class MarkdownPrinter(Printer):
         self,
         theme: str,
         refresh_interval: float,
-        vertical_overflow: VerticalOverflowMethod,
+        vertical_overflow: "VerticalOverflowMethod",
     ) -> None:
-        self.console = Console()
+        from markdown_it import MarkdownIt
+
         self.theme = theme
         self.refresh_interval = refresh_interval
-        self.vertical_overflow: VerticalOverflowMethod = vertical_overflow
+        self.vertical_overflow: "VerticalOverflowMethod" = vertical_overflow
+        # Same parser rich uses to render Markdown.
+        self.parser = MarkdownIt().enable("strikethrough").enable("table")
+        # If the last printed block should be followed by an empty line.
+        self.new_line = False
+        # Reference link definitions of printed text, by normalized label.
+        self.references: Dict[str, Dict[str, Any]] = {}
+
+    def _definitions(self) -> str:
+        # Definitions of printed text, so links of later text are resolved.
+        lines = []
+        for label, reference in self.references.items():
+            title = reference.get("title") or ""
+            title = title.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'[{label}]: <{reference["href"]}> "{title}"\n')
+        return "".join(lines) + "\n" if lines else ""
+
+    def _markdown(self, text: str, blocks: List["Token"]) -> "RenderableType":
+        from rich.console import Group, NewLine
+        from rich.markdown import Markdown
+
+        markdown = Markdown(markup=self._definitions() + text, code_theme=self.theme)
+        # Rich separates top-level blocks with an empty line, lists, quotes
+        # and tables get it from their nested elements.
+        if self.new_line and blocks and blocks[0].type not in SELF_SEPARATED_BLOCKS:
+            return Group(NewLine(), markdown)
+        return markdown
+
+    def _parse(
+        self, text: str
+    ) -> Tuple[List["Token"], Optional[int], Dict[str, Dict[str, Any]]]:
+        """
+        :return: Top-level blocks of the text, index of the first one with
+            text which can become a reference link (None if there is no such
+            block), and definitions of printed and this text.
+        """
+        blocks: List["Token"] = []
+        unresolved = None
+        # First definition of a label is used, as in CommonMark.
+        env: Dict[str, Any] = {"references": dict(self.references)}
+        for token in self.parser.parse(text, env):
+            if token.level == 0 and token.nesting >= 0 and token.map:
+                blocks.append(token)
+            elif unresolved is None and token.type == "inline":
+                if any(
+                    child.type == "text" and "]" in child.content
+                    for child in token.children or []
+                ):
+                    unresolved = len(blocks) - 1
+        return blocks, unresolved, env["references"]
+
+    def _render(self, live: "Live", text: str) -> int:
+        """
+        Prints completed top-level blocks above the live display once, and
+        renders only the last block in the live display. New chunks can
+        change only the last block, so rendering cost doesn't grow with
+        the length of completion. Blocks with reference links which are not
+        defined yet (e.g. "[docs][d]" before "[d]: url") are not printed,
+        the definition can come later.
+
+        :param text: Markdown text which is not printed yet.
+        :return: Length of the text printed above the live display.
+        """
+        from rich.markdown import Markdown, UnknownElement
+
+        blocks, unresolved, _ = self._parse(text)
+        printed = len(blocks) - 1 if unresolved is None else unresolved
+        offset = 0
+        while printed > 0:
+            offset = 0
+            for _ in range(blocks[printed].map[0]):  # type: ignore
+                offset = text.index("\n", offset) + 1
+            # Definitions in the rest of the text are not printed with links.
+            _, unresolved, references = self._parse(text[:offset])
+            if unresolved is None:
+                break
+            printed, offset = unresolved, 0
+        if printed > 0:
+            live.console.print(self._markdown(text[:offset], blocks[:printed]))
+            self.references = references
+            element = Markdown.elements.get(blocks[printed - 1].type, UnknownElement)
+            self.new_line = element.new_line
+            blocks = blocks[printed:]
+        live.update(self._markdown(text[offset:], blocks), refresh=True)
+        return offset
 
     def live_print(self, chunks: Generator[str, None, None]) -> str:
+        from rich.live import Live
+
         full_completion = ""
+        printed = 0
+        self.new_line = False
+        self.references = {}
         with Live(
             console=self.console,
             vertical_overflow=self.vertical_overflow,
@@ -55,21 +169,17 @@ class MarkdownPrinter(Printer):
                     self.refresh_interval == 0
                     or time.monotonic() - last_refresh >= self.refresh_interval
                 ):
-                    live.update(
-                        Markdown(markup=full_completion, code_theme=self.theme),
-                        refresh=True,
-                    )
+                    printed += self._render(live, full_completion[printed:])
                     last_refresh = time.monotonic()
 
             # Ensure the complete output is always rendered when streaming finishes.
-            live.update(
-                Markdown(markup=full_completion, code_theme=self.theme),
-                refresh=True,
-            )
+            self._render(live, full_completion[printed:])
 
         return full_completion
 
     def static_print(self, text: str) -> str:
+        from rich.markdown import Markdown
+
         markdown = Markdown(markup=text, code_theme=self.theme)
         self.console.print(markdown)
         return text
@@ -91,3 +201,38 @@ class TextPrinter(Printer):
     def static_print(self, text: str) -> str:
         secho(text, fg=self.color)
         return text
+
+
+class PlainPrinter(Printer):
+    """
+    Printer for non-interactive output (pipes, files). Writes chunks as is,
+    without colors or Markdown rendering, through buffered stdout which is
+    flushed on new lines or at least every flush_interval seconds.
+    """
+
+    def __init__(self, flush_interval: float = 0.1) -> None:
+        self.flush_interval = flush_interval
+
+    def live_print(self, chunks: Generator[str, None, None]) -> str:
+        stream = sys.stdout
+        parts = []
+        last_flush = time.monotonic()
+        for chunk in chunks:
+            parts.append(chunk)
+            stream.write(chunk)
+            if "\n" in chunk or time.monotonic() - last_flush >= self.flush_interval:
+                stream.flush()
+                last_flush = time.monotonic()
+        stream.write("\n")  # Add new line after last chunk.
+        stream.flush()
+        return "".join(parts)
+
+    def static_print(self, text: str) -> str:
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+        return text
+
+    def __call__(self, chunks: Generator[str, None, None], live: bool = True) -> str:
+        if live:
+            return self.live_print(chunks)
+        return self.static_print("".join(chunks))
@@ -0,0 +1,53 @@
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from .config import cfg
+
+
+class Provider:
+    """
+    Completion backend (OpenAI client or LiteLLM) which is built on first use.
+    Importing provider SDKs is the most expensive part of the startup, commands
+    that never make a request (--version, --list-chats, etc.) should not pay for it.
+    """
+
+    def __init__(self) -> None:
+        self._completion: Optional[Callable[..., Any]] = None
+        self._kwargs: Dict[str, Any] = {}
+        self._lock = Lock()
+
+    @property
+    def use_litellm(self) -> bool:
+        return cfg.get("USE_LITELLM") == "true"
+
+    def load(self) -> Callable[..., Any]:
+        """
+        Imports provider SDK and builds the client, only once per process.
+
+        :return: Completion function of the provider.
+        """
+        with self._lock:
+            if self._completion is not None:
+                return self._completion
+            base_url = cfg.get("API_BASE_URL")
+            client_kwargs = {
+                "timeout": int(cfg.get("REQUEST_TIMEOUT")),
+                "api_key": cfg.get("OPENAI_API_KEY"),
+                "base_url": None if base_url == "default" else base_url,
+            }
+            if self.use_litellm:
+                import litellm  # type: ignore
+
+                litellm.suppress_debug_info = True
+                self._kwargs = client_kwargs
+                self._completion = litellm.completion
+            else:
+                from openai import OpenAI
+
+                client = OpenAI(**client_kwargs)  # type: ignore
+                self._completion = client.chat.completions.create
+            return self._completion
+
+    def completion(self, **kwargs: Any) -> Any:
+        completion = self._completion or self.load()
+        return completion(**self._kwargs, **kwargs)
@@ -0,0 +1,149 @@
+import atexit
+import time
+import urllib.error
+import urllib.request
+from email.utils import parsedate_to_datetime
+from http.client import HTTPException
+from pathlib import Path
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from .config import cfg
+
+# Seconds for writes, they are in background so they can take longer than lookups.
+PUT_TIMEOUT = 10
+# Seconds the server is not used after it failed to answer, so an unavailable
+# server doesn't delay every miss by timeout.
+RETRY_AFTER = 60
+
+
+class RemoteCache:
+    """
+    Client of a cache shared over HTTP, e.g. by a team, see cache_server for
+    the reference server. Entry of a request is read by GET and written by
+    PUT of {url}/{key}, key is md5 hex digest of the request, body is the
+    entry as Cache keeps it and Last-Modified header is its write time.
+    Lookups which take longer than timeout are misses, writes are done in
+    background threads, which delay exit of the process by timeout at most,
+    so the remote cache never delays the completion much. Server which
+    failed to answer is not used for RETRY_AFTER seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float,
+        token: Optional[str] = None,
+        failure_path: Optional[Path] = None,
+    ):
+        """
+        :param url: Base URL of the server, e.g. http://cache.local:8765.
+        :param timeout: Seconds to wait for lookups.
+        :param token: Sent as bearer token, if the server requires one.
+        :param failure_path: File which keeps time of the last failure for
+            other processes, only this process skips the server without it.
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+        self.failure_path = failure_path
+        self.failed = 0.0
+        # Background writes, the process waits for them up to timeout.
+        self.puts: List[Thread] = []
+        atexit.register(self.wait, timeout)
+
+    @classmethod
+    def from_config(cls) -> Optional["RemoteCache"]:
+        """
+        :return: Client of CACHE_REMOTE_URL, None if it is not set.
+        """
+        url, token = cfg.get("CACHE_REMOTE_URL"), cfg.get("CACHE_REMOTE_TOKEN")
+        if url == "none":
+            return None
+        timeout = float(cfg.get("CACHE_REMOTE_TIMEOUT"))
+        failure_path = Path(cfg.get("CACHE_PATH")) / "remote.failed"
+        return cls(url, timeout, None if token == "none" else token, failure_path)
+
+    def available(self) -> bool:
+        """
+        :return: False if the server failed less than RETRY_AFTER seconds ago.
+        """
+        failed = self.failed
+        if self.failure_path:
+            try:
+                failed = max(failed, self.failure_path.stat().st_mtime)
+            except OSError:
+                pass
+        return time.time() - failed >= RETRY_AFTER
+
+    def _fail(self) -> None:
+        self.failed = time.time()
+        if self.failure_path:
+            try:
+                self.failure_path.touch()
+            except OSError:
+                pass
+
+    def _request(
+        self, key: str, method: str, data: Optional[bytes] = None
+    ) -> urllib.request.Request:
+        headers: Dict[str, str] = {"Content-Type": "application/octet-stream"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return urllib.request.Request(f"{self.url}/{key}", data, headers, method=method)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """
+        :return: Entry and its write time, None if there is no entry,
+            or the server is not available or didn't answer in time.
+        """
+        if not self.available():
+            return None
+        request = self._request(key, "GET")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+                modified = response.headers.get("Last-Modified")
+            created = (
+                parsedate_to_datetime(modified).timestamp() if modified else time.time()
+            )
+        except urllib.error.HTTPError:
+            return None  # 404 for missing entries, the server is available.
+        except (OSError, HTTPException):
+            # Connection errors and timeouts.
+            self._fail()
+            return None
+        except (TypeError, ValueError):
+            return None
+        # Clock of the server might be ahead.
+        return data, min(created, time.time())
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Writes the entry in background thread. Errors are ignored, the entry
+        is written again by the next request which doesn't find it.
+        """
+
+        def run() -> None:
+            request = self._request(key, "PUT", data)
+            try:
+                with urllib.request.urlopen(request, timeout=PUT_TIMEOUT):
+                    pass
+            except urllib.error.HTTPError:
+                pass
+            except (OSError, HTTPException):
+                self._fail()
+
+        if not self.available():
+            return
+        self.puts = [thread for thread in self.puts if thread.is_alive()]
+        self.puts.append(Thread(target=run, name=f"remote-put-{key}", daemon=True))
+        self.puts[-1].start()
+
+    def wait(self, timeout: float) -> None:
+        """
+        Waits for background writes, up to timeout seconds in total.
+        """
+        deadline = time.monotonic() + timeout
+        for thread in self.puts:
+            thread.join(max(deadline - time.monotonic(), 0))
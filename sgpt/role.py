@@ -4,7 +4,7 @@ from enum import Enum
 from os import getenv, pathsep
 from os.path import basename
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
 import typer
 from click import UsageError
@@ -52,12 +52,15 @@ class SystemRole:
         name: str,
         role: str,
         variables: Optional[Dict[str, str]] = None,
+        cache: Optional[Dict[str, Any]] = None,
     ) -> None:
         self.storage.mkdir(parents=True, exist_ok=True)
         self.name = name
         if variables:
             role = role.format(**variables)
         self.role = role
+        # Cache policy settings overriding .sgptrc, see CachePolicy.
+        self.cache = cache or {}
 
     @classmethod
     def create_defaults(cls) -> None:
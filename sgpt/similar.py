@@ -0,0 +1,215 @@
+import re
+import sqlite3
+import struct
+import zlib
+from functools import lru_cache
+from hashlib import shake_128
+from pathlib import Path
+from threading import RLock
+from typing import Iterable, List, Optional, Tuple, cast
+
+# MinHash signature of a prompt is split into bands, prompts which have
+# at least one equal band are compared. With 32 bands of 8 hashes, prompts
+# with similarity 0.8 are candidates with probability 0.997, 0.12 for 0.5
+# and 0.002 for 0.3, so prompts sharing only common words are rarely read.
+BANDS = 32
+ROWS = 8
+# Hash functions of MinHash are parts of a single extendable output hash.
+WORD_HASHES = struct.Struct(f">{BANDS * ROWS}I")
+BAND = struct.Struct(f">B{ROWS}I")
+# Words which don't change the request, prompts which differ by any other
+# word (verb, operand, number, negation) or by order of other words ask for
+# a different command.
+FILLER = frozenset(
+    (
+        "a", "an", "the", "please", "pls", "kindly", "just", "me", "i", "you",
+        "can", "could", "would", "how", "do", "what", "is",
+    )
+)  # fmt: skip
+
+
+def normalize(prompt: str) -> Tuple[str, ...]:
+    """
+    :param prompt: User prompt.
+    :return: Lowercase words of the prompt in order, case, punctuation
+        and whitespace don't matter.
+    """
+    return tuple(re.findall(r"\w+", prompt.lower()))
+
+
+def content(words: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    :return: Words of normalized prompt which are not FILLER, in order.
+    """
+    return tuple(word for word in words if word not in FILLER)
+
+
+def similarity(first: Tuple[str, ...], second: Tuple[str, ...]) -> float:
+    """
+    :return: Jaccard similarity of word sets, 0 if words other than FILLER
+        or their order are different.
+    """
+    if content(first) != content(second):
+        return 0.0
+    return len(set(first) & set(second)) / len(set(first) | set(second))
+
+
+@lru_cache(maxsize=4096)
+def _hashes(word: str) -> Tuple[int, ...]:
+    data = shake_128(word.encode("utf-8")).digest(WORD_HASHES.size)
+    return WORD_HASHES.unpack(data)
+
+
+def buckets(context: str, words: Tuple[str, ...]) -> List[int]:
+    """
+    :param context: Everything else the completion depends on (model, role).
+    :param words: Normalized prompt.
+    :return: LSH bucket of each band of MinHash signature of prompt words
+        other than FILLER, only such prompts can be similar.
+    """
+    signature = list(map(min, zip(*map(_hashes, set(content(words))), strict=True)))
+    # Buckets of different contexts are different, candidates are checked anyway.
+    seed = zlib.crc32(context.encode("utf-8"))
+    return [
+        zlib.crc32(BAND.pack(band, *signature[band * ROWS : (band + 1) * ROWS]), seed)
+        for band in range(BANDS)
+    ]
+
+
+class SimilarIndex:
+    """
+    Local MinHash/LSH index of prompts of cached requests in SQLite database,
+    used to find cache entries of requests which differ only in wording of
+    the prompt. Buckets are indexed, so lookup cost doesn't grow with amount
+    of prompts. Only the most recently added prompts up to length are kept.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS prompts (
+        id INTEGER PRIMARY KEY,
+        key TEXT NOT NULL UNIQUE,
+        context TEXT NOT NULL,
+        sequence TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS buckets (
+        hash INTEGER NOT NULL,
+        prompt INTEGER NOT NULL,
+        PRIMARY KEY (hash, prompt)
+    ) WITHOUT ROWID;
+    """
+    # Indexes created before word order mattered, prompts are indexed again.
+    MIGRATION = """
+    DROP TABLE prompts;
+    DROP TABLE buckets;
+    """
+
+    def __init__(self, db_path: Path, length: int, threshold: float) -> None:
+        """
+        :param length: Max amount of prompts.
+        :param threshold: Min similarity of prompts, from 0 to 1.
+        """
+        self.db_path = db_path
+        self.length = length
+        self.threshold = threshold
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connect lazily, only requests of opted in roles use the index.
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                columns = connection.execute("PRAGMA table_info(prompts)")
+                if "words" in {name for _, name, *_ in columns}:
+                    try:
+                        connection.executescript(
+                            f"BEGIN IMMEDIATE; {self.MIGRATION} COMMIT;"
+                        )
+                    except sqlite3.OperationalError:
+                        # Migrated by another process.
+                        if connection.in_transaction:
+                            connection.execute("ROLLBACK")
+                with connection:
+                    connection.executescript(self.SCHEMA)
+                self._connection = connection
+            return self._connection
+
+    def add(self, key: str, context: str, prompt: str) -> None:
+        """
+        :param key: Cache key of the request.
+        :param context: Everything else the completion depends on.
+        :param prompt: User prompt.
+        """
+        words = normalize(prompt)
+        if not content(words):
+            return
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self._delete("key = ?", (key,))
+            prompt_id = cast(
+                int,
+                self.connection.execute(
+                    "INSERT INTO prompts (key, context, sequence) VALUES (?, ?, ?)",
+                    (key, context, " ".join(words)),
+                ).lastrowid,
+            )
+            self.connection.executemany(
+                "INSERT INTO buckets VALUES (?, ?)",
+                ((bucket, prompt_id) for bucket in buckets(context, words)),
+            )
+            self._delete("id <= ?", (prompt_id - self.length,))
+
+    def lookup(self, context: str, prompt: str) -> List[str]:
+        """
+        :return: Cache keys of similar prompts with the same context,
+            most similar first.
+        """
+        words = normalize(prompt)
+        if not content(words):
+            return []
+        hashes = buckets(context, words)
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT key, sequence FROM prompts WHERE id IN "
+                f"(SELECT prompt FROM buckets WHERE hash IN ({','.join('?' * BANDS)})) "
+                "AND context = ?",
+                (*hashes, context),
+            ).fetchall()
+        scores = [(similarity(words, tuple(other.split())), key) for key, other in rows]
+        return [
+            key
+            for score, key in sorted(scores, reverse=True)
+            if score >= self.threshold
+        ]
+
+    def remove(self, key: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self._delete("key = ?", (key,))
+
+    def _delete(self, where: str, parameters: Iterable[object]) -> None:
+        # Buckets are not indexed by prompt (it would double the index size),
+        # they are computed again from words.
+        rows: List[Tuple[int, str, str]] = self.connection.execute(
+            f"SELECT id, context, sequence FROM prompts WHERE {where}",
+            tuple(parameters),
+        ).fetchall()
+        self.connection.executemany(
+            "DELETE FROM prompts WHERE id = ?", ((row[0],) for row in rows)
+        )
+        self.connection.executemany(
+            "DELETE FROM buckets WHERE hash = ? AND prompt = ?",
+            (
+                (bucket, prompt_id)
+                for prompt_id, context, sequence in rows
+                for bucket in buckets(context, tuple(sequence.split()))
+            ),
+        )
@@ -0,0 +1,183 @@
+import json
+import math
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, List, Optional
+
+import typer
+
+from .config import cfg
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    :param values: Sorted list of values.
+    :param percent: Percentile from 0 to 100.
+    :return: Percentile value, 0 for empty list.
+    """
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class RequestStats:
+    """
+    Collects timings of a single request: time to first token, total
+    latency, chunks, gaps between chunks, tool calls and time spent
+    by the printer rendering the output.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.start = time.perf_counter()
+        self.end = self.start
+        # Time when each non-empty chunk was received.
+        self.chunk_times: List[float] = []
+        # Time spent waiting for chunks (provider and tool calls).
+        self.stream_time = 0.0
+        self.tool_calls = 0
+        self.tool_time = 0.0
+        # Estimated tokens of messages sent with the first request.
+        self.prompt_tokens: Optional[int] = None
+        # Duration of each completion request, followed by tool calls if any.
+        self.steps: List[Dict[str, Any]] = []
+        # Cache decision and the policy setting behind it, see CachePolicy.
+        self.cache: Optional[str] = None
+        self.cache_policy: Optional[str] = None
+
+    def track(self, chunks: Iterable[str]) -> Generator[str, None, None]:
+        """
+        Wraps completion chunks to record when they were received.
+
+        :param chunks: Completion generator.
+        :return: Generator with the same chunks.
+        """
+        iterator = iter(chunks)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    received = time.perf_counter()
+                    self.stream_time += received - started
+                if chunk:
+                    self.chunk_times.append(received)
+                yield chunk
+        finally:
+            if isinstance(iterator, Generator):
+                iterator.close()
+
+    def add_tool_calls(self, count: int, elapsed: float) -> None:
+        self.tool_calls += count
+        self.tool_time += elapsed
+
+    def add_step(self, elapsed: float, tool_calls: int) -> None:
+        self.steps.append({"time": round(elapsed, 4), "tool_calls": tool_calls})
+
+    def finish(self) -> None:
+        self.end = time.perf_counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        times = self.chunk_times
+        gaps = sorted(times[i] - times[i - 1] for i in range(1, len(times)))
+        streaming = times[-1] - times[0] if len(times) > 1 else 0.0
+        total = self.end - self.start
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": self.model,
+            "ttft": round(times[0] - self.start, 4) if times else None,
+            "total": round(total, 4),
+            "chunks": len(times),
+            "prompt_tokens": self.prompt_tokens,
+            # Providers usually stream one token per chunk.
+            "chunks_per_sec": round((len(times) - 1) / streaming, 2)
+            if streaming
+            else None,
+            "gap_p50": round(percentile(gaps, 50), 4),
+            "gap_p90": round(percentile(gaps, 90), 4),
+            "gap_p99": round(percentile(gaps, 99), 4),
+            "gap_max": round(gaps[-1], 4) if gaps else 0.0,
+            "tool_calls": self.tool_calls,
+            "tool_time": round(self.tool_time, 4),
+            "render_time": round(max(0.0, total - self.stream_time), 4),
+            "steps": self.steps,
+            "cache": self.cache,
+            "cache_policy": self.cache_policy,
+        }
+
+    def report(self, show: bool) -> None:
+        """
+        Prints summary to stderr and writes it to STATS_PATH file.
+
+        :param show: Print summary to stderr.
+        """
+        stats = self.to_dict()
+        if show:
+            ttft = "-" if stats["ttft"] is None else f"{stats['ttft']:.3f}s"
+            rate = stats["chunks_per_sec"] or 0
+            typer.secho(
+                f"[{stats['model']}] prompt ~{stats['prompt_tokens'] or 0} tokens, "
+                f"ttft {ttft}, total {stats['total']:.3f}s, "
+                f"{stats['chunks']} chunks ({rate:.1f}/s), "
+                f"gaps p50 {stats['gap_p50']:.3f}s p90 {stats['gap_p90']:.3f}s "
+                f"p99 {stats['gap_p99']:.3f}s, "
+                f"tools {stats['tool_calls']} ({stats['tool_time']:.3f}s), "
+                f"steps {len(stats['steps'])}, "
+                f"render {stats['render_time']:.3f}s"
+                + (f", cache {self.cache} ({self.cache_policy})" if self.cache else ""),
+                fg="bright_black",
+                err=True,
+            )
+        write_stats(stats)
+
+
+def stats_enabled(show: bool) -> bool:
+    return show or cfg.get("STATS_PATH") != "none"
+
+
+def write_stats(stats: Dict[str, Any]) -> None:
+    """
+    Appends stats as JSON line to STATS_PATH file if configured.
+    """
+    stats_path = cfg.get("STATS_PATH")
+    if stats_path != "none":
+        path = Path(stats_path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as file:
+            file.write(json.dumps(stats) + "\n")
+
+
+def report_compaction(
+    model: str, before: int, after: int, elapsed: float, show: bool
+) -> None:
+    """
+    Reports chat history compaction, see ChatSession.compact.
+
+    :param before: Estimated prompt tokens of the history before compaction.
+    :param after: Estimated prompt tokens of the history after compaction.
+    :param show: Print summary to stderr.
+    """
+    if show:
+        typer.secho(
+            f"[{model}] chat history compacted: prompt ~{before} -> ~{after} "
+            f"tokens, {elapsed:.3f}s",
+            fg="bright_black",
+            err=True,
+        )
+    write_stats(
+        {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": model,
+            "event": "compaction",
+            "prompt_tokens_before": before,
+            "prompt_tokens_after": after,
+            "total": round(elapsed, 4),
+        }
+    )
@@ -0,0 +1,53 @@
+import json
+from math import ceil
+from typing import Any, Dict, List
+
+from .config import cfg
+
+# Every message is wrapped into a few service tokens (role, separators).
+MESSAGE_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates amount of tokens in the text without a tokenizer (which would
+    need to download its vocabulary). BPE tokenizers produce about one token
+    per 4 characters of English text or code, and about one token per
+    character of non-latin text.
+
+    :param text: Any text.
+    :return: Estimated amount of tokens.
+    """
+    if text.isascii():
+        return ceil(len(text) / 4)
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_TOKENS + estimate_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"]))
+    return tokens
+
+
+def messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def token_budget(model: str) -> int:
+    """
+    Parses CHAT_TOKEN_BUDGET, comma separated "model:tokens" pairs and
+    optional budget for all other models, e.g. "gpt-4o:100000,16000".
+
+    :param model: Model name.
+    :return: Prompt token budget of the model, 0 if unlimited.
+    """
+    default = 0
+    for item in cfg.get("CHAT_TOKEN_BUDGET").split(","):
+        name, _, tokens = item.strip().rpartition(":")
+        if not name:
+            default = int(tokens)
+        elif name == model:
+            return int(tokens)
+    return default
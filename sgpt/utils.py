@@ -53,6 +53,37 @@ def run_command(command: str) -> None:
     os.system(full_command)
 
 
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+# Units of durations, e.g. "90s", "30m", "12h", "7d".
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_duration(value: str, param_hint: str) -> float:
+    """
+    :param value: Seconds, or amount with unit (s, m, h or d), e.g. "7d".
+    :param param_hint: Option name for the error message.
+    :return: Seconds.
+    """
+    unit = value[-1:].lower()
+    try:
+        amount = float(value[:-1] if unit in DURATION_UNITS else value)
+    except ValueError:
+        amount = -1
+    if amount < 0:
+        raise BadParameter(
+            f"{value}, use seconds or amount with s, m, h or d unit, e.g. 7d",
+            param_hint=param_hint,
+        )
+    return amount * DURATION_UNITS.get(unit, 1)
+
+
 def option_callback(func: Callable) -> Callable:  # type: ignore
     def wrapper(cls: Any, value: str) -> None:
         if not value:
@@ -0,0 +1,96 @@
+import json
+from pathlib import Path
+from threading import Barrier
+from unittest.mock import patch
+from uuid import uuid4
+
+from sgpt.role import DefaultRoles, SystemRole
+
+from .utils import app, assert_usage_error, cmd_args, comp_args, mock_comp, runner
+
+
+def write_batch(path: Path, records: list) -> Path:
+    batch = path / "batch.jsonl"
+    batch.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+    return batch
+
+
+def read_results(output: str) -> dict:
+    results = [json.loads(line) for line in output.splitlines()]
+    return {result["id"]: result for result in results}
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_batch(completion, tmp_path: Path):
+    completion.side_effect = lambda **kwargs: mock_comp(
+        kwargs["messages"][-1]["content"].upper()
+    )
+    batch = write_batch(
+        tmp_path,
+        [
+            {"prompt": "one"},
+            {"id": "code", "prompt": "two", "role": DefaultRoles.CODE.value},
+            {"prompt": "three", "temperature": 0.5, "model": "other"},
+        ],
+    )
+    result = runner.invoke(app, cmd_args(**{"--batch": str(batch)}))
+    assert result.exit_code == 0
+
+    results = read_results(result.stdout)
+    assert {key: value["completion"] for key, value in results.items()} == {
+        1: "ONE",
+        "code": "TWO",
+        3: "THREE",
+    }
+    code_role = SystemRole.get(DefaultRoles.CODE.value)
+    completion.assert_any_call(**comp_args(code_role, "two"))
+    default_role = SystemRole.get(DefaultRoles.DEFAULT.value)
+    completion.assert_any_call(
+        **comp_args(default_role, "three", model="other", temperature=0.5)
+    )
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_batch_concurrency(completion, tmp_path: Path):
+    # Both requests must be in progress at the same time to pass the barrier.
+    barrier = Barrier(2, timeout=5)
+
+    def concurrent_completion(**kwargs):
+        barrier.wait()
+        return mock_comp("ok")
+
+    completion.side_effect = concurrent_completion
+    batch = write_batch(tmp_path, [{"prompt": "one"}, {"prompt": "two"}])
+    args = cmd_args(**{"--batch": str(batch), "--concurrency": "2"})
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    assert [value["completion"] for value in read_results(result.stdout).values()] == [
+        "ok",
+        "ok",
+    ]
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_batch_cache(completion, tmp_path: Path):
+    completion.return_value = mock_comp("ok")
+    batch = write_batch(tmp_path, [{"prompt": f"cached {uuid4()}"}])
+    args = ["--batch", str(batch), "--cache", "--no-functions"]
+    for _ in range(2):
+        result = runner.invoke(app, args)
+        assert result.exit_code == 0
+        assert read_results(result.stdout)[1]["completion"] == "ok"
+    assert completion.call_count == 1
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_batch_errors(completion, tmp_path: Path):
+    completion.return_value = mock_comp("ok")
+    batch = write_batch(tmp_path, [{"prompt": "one", "role": "missing"}])
+    result = runner.invoke(app, cmd_args(**{"--batch": str(batch)}))
+    assert result.exit_code == 1
+    assert "error" in read_results(result.stdout)[1]
+    completion.assert_not_called()
+
+    batch.write_text('{"id": 1}\n')
+    result = runner.invoke(app, cmd_args(**{"--batch": str(batch)}))
+    assert_usage_error(result, 'missing "prompt"')
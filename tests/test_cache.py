@@ -0,0 +1,429 @@
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from pathlib import Path
+from threading import Event
+
+import pytest
+from click import UsageError
+
+from sgpt.cache import Cache, SqliteCache, cache_backend
+from sgpt.cache_policy import CachePolicy
+from sgpt.compress import compress
+
+
+def make_completion(cache: Cache, calls: list[str]):
+    @cache
+    def get_completion(self, prompt):
+        calls.append(prompt)
+        yield from prompt.upper()
+
+    return lambda prompt, caching=True: "".join(
+        get_completion(None, prompt=prompt, caching=caching)
+    )
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache(tmp_path: Path, cache_class):
+    calls: list[str] = []
+    completion = make_completion(cache_class(2, tmp_path), calls)
+
+    assert completion("a") == "A"
+    assert completion("a") == "A"
+    assert calls == ["a"]
+
+    completion("b")
+    completion("c")
+    # Oldest entry is evicted.
+    completion("a")
+    assert calls == ["a", "b", "c", "a"]
+
+    assert completion("c", caching=False) == "C"
+    assert calls == ["a", "b", "c", "a", "c"]
+
+
+def test_sqlite_cache_eviction_by_last_access(tmp_path: Path):
+    calls: list[str] = []
+    completion = make_completion(SqliteCache(2, tmp_path), calls)
+    completion("a")
+    completion("b")
+    completion("a")  # Hit makes "a" most recently used.
+    completion("c")  # Evicts "b".
+    completion("a")
+    completion("b")
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_sqlite_cache_migrates_files(tmp_path: Path):
+    calls: list[str] = []
+    make_completion(Cache(10, tmp_path), calls)("a")
+    assert len([path for path in tmp_path.iterdir() if Cache._is_entry(path)]) == 1
+
+    completion = make_completion(SqliteCache(10, tmp_path), calls)
+    assert completion("a") == "A"
+    assert calls == ["a"]
+    assert not [path for path in tmp_path.iterdir() if Cache._is_entry(path)]
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_compression(tmp_path: Path, cache_class):
+    calls: list[str] = []
+    cache = cache_class(10, tmp_path, compression="zlib")
+    completion = make_completion(cache, calls)
+    prompt = "ls -la " * 100
+    assert completion(prompt) == prompt.upper()
+    assert completion("a") == "A"
+    assert completion(prompt) == prompt.upper()
+    assert calls == [prompt, "a"]
+
+    # Entries written without compression are read as is.
+    plain = make_completion(cache_class(10, tmp_path), calls)
+    assert plain(prompt) == prompt.upper()
+    assert plain("b") == "B"
+    assert completion("b") == "B"
+    assert calls == [prompt, "a", "b"]
+
+
+def test_cache_compressed_size(tmp_path: Path):
+    text = "drwxr-xr-x 2 user user 4096 Jan 1 00:00 folder\n" * 100
+    compressed = Cache(10, tmp_path, compression="zlib")
+    compressed._set("a" * 32, compressed._encode([text]))
+    assert (tmp_path / ("a" * 32)).stat().st_size < len(text) / 10
+    assert compressed._get("a" * 32) == text
+    # Short texts are kept plain.
+    compressed._set("b" * 32, compressed._encode(["ls"]))
+    assert (tmp_path / ("b" * 32)).read_bytes().endswith(b"ls")
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_eviction_by_size(tmp_path: Path, cache_class):
+    calls: list[str] = []
+    entry_size = len(Cache(10, tmp_path)._encode(list("A" * 10)))
+    cache = cache_class(10, tmp_path, max_bytes=2 * entry_size + 5)
+    completion = make_completion(cache, calls)
+    for prompt in ("a" * 10, "b" * 10, "c" * 10):
+        completion(prompt)
+        time.sleep(0.01)
+    # Oldest entry is evicted, two entries fit.
+    completion("b" * 10)
+    completion("c" * 10)
+    completion("a" * 10)
+    assert calls == ["a" * 10, "b" * 10, "c" * 10, "a" * 10]
+
+
+def test_sqlite_cache_migrates_counters(tmp_path: Path):
+    connection = sqlite3.connect(tmp_path / "cache.sqlite3")
+    connection.executescript(
+        """
+        CREATE TABLE entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL);
+        CREATE TABLE counters (entries INTEGER NOT NULL);
+        INSERT INTO counters VALUES (1);
+        CREATE TRIGGER entries_insert AFTER INSERT ON entries
+        BEGIN UPDATE counters SET entries = entries + 1; END;
+        CREATE TRIGGER entries_delete AFTER DELETE ON entries
+        BEGIN UPDATE counters SET entries = entries - 1; END;
+        """
+    )
+    connection.execute("INSERT INTO entries VALUES ('key', 'value', 0)")
+    connection.execute("UPDATE counters SET entries = 1")
+    connection.commit()
+    connection.close()
+
+    cache = SqliteCache(10, tmp_path)
+    assert cache._get("key") == "value"
+    cache._set("other", b"12345")
+    row = cache.connection.execute("SELECT entries, bytes FROM counters").fetchone()
+    assert row == (2, 10)
+    # Write time of old entries is their last access time.
+    assert cache._age("key") > time.time() - 1
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_replays_chunks(tmp_path: Path, cache_class, monkeypatch):
+    calls: list[str] = []
+    cache = cache_class(10, tmp_path, compression="zlib")
+
+    @cache
+    def get_completion(self, prompt):
+        calls.append(prompt)
+        yield "Hello"
+        time.sleep(0.05)
+        yield ""  # Empty chunks are not stored.
+        yield ", wörld"
+        yield "!" * 100
+
+    chunks = list(get_completion(None, prompt="a", caching=True))
+    assert list(get_completion(None, prompt="a", caching=True)) == [
+        chunk for chunk in chunks if chunk
+    ]
+    assert calls == ["a"]
+
+    sleeps: list[float] = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    list(get_completion(None, prompt="a", caching=True, replay_speed=2))
+    assert len(sleeps) == 3
+    assert 0.02 <= sleeps[1] < 0.05
+    assert calls == ["a"]
+
+
+def test_cache_replays_memory_mapped(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr("sgpt.cache.MMAP_SIZE", 0)
+    monkeypatch.setattr("sgpt.compress.PIECE_SIZE", 100)
+    chunks = [f"line {index}\n" for index in range(1000)]
+    for compression in ("none", "zlib"):
+        cache = Cache(10, tmp_path, compression=compression)
+        cache._set("a" * 32, cache._encode(chunks))
+        replayed = cache._replay("a" * 32)
+        assert [chunk for chunk, _ in replayed] == chunks
+        # Stopped replay releases the mapping.
+        replayed = cache._replay("a" * 32)
+        assert next(replayed) == ("line 0\n", 0)
+        replayed.close()
+
+
+def test_cache_replays_entries_without_chunks(tmp_path: Path):
+    (tmp_path / ("a" * 32)).write_text("plain text")
+    (tmp_path / ("b" * 32)).write_bytes(compress("compressed text", "zlib"))
+    cache = Cache(10, tmp_path)
+    assert list(cache._replay("a" * 32)) == [("plain text", 0)]
+    assert list(cache._replay("b" * 32)) == [("compressed text", 0)]
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_unknown_compression(tmp_path: Path, cache_class):
+    # Checked on startup, not when the completion is written.
+    for method in ("gzip", "ZLIB"):
+        with pytest.raises(UsageError, match="use zlib, zstd or none"):
+            cache_class(10, tmp_path, compression=method)
+        with pytest.raises(ValueError):
+            compress("text", method)
+
+
+def test_cache_unknown_backend():
+    assert cache_backend("file") is Cache
+    for name in ("File", "sqlite3"):
+        with pytest.raises(UsageError, match="use file or sqlite"):
+            cache_backend(name)
+
+
+def make_slow_completion(cache: Cache, calls: list[str], started: Event, fail=False):
+    @cache
+    def get_completion(self, prompt):
+        calls.append(prompt)
+        yield "Hello"
+        started.set()
+        time.sleep(0.2)
+        if fail:
+            raise ConnectionError("API error")
+        yield ", world"
+
+    return lambda: "".join(get_completion(None, prompt="a", caching=True))
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_coalesces_concurrent_requests(tmp_path: Path, cache_class):
+    calls: list[str] = []
+    started = Event()
+    # Separate instances, as in separate processes.
+    leader = make_slow_completion(cache_class(10, tmp_path), calls, started)
+    follower = make_slow_completion(cache_class(10, tmp_path), calls, Event())
+    with ThreadPoolExecutor() as executor:
+        leading = executor.submit(leader)
+        started.wait()
+        assert follower() == "Hello, world"
+        assert leading.result() == "Hello, world"
+    assert calls == ["a"]
+    assert [path.name for path in tmp_path.glob(".*.flight")] == []
+
+
+def test_cache_follower_takes_over_failed_request(tmp_path: Path):
+    calls: list[str] = []
+    started = Event()
+    leader = make_slow_completion(Cache(10, tmp_path), calls, started, fail=True)
+    follower = make_slow_completion(Cache(10, tmp_path), calls, Event())
+    with ThreadPoolExecutor() as executor:
+        leading = executor.submit(leader)
+        started.wait()
+        # "Hello" is streamed from the failed request and not repeated.
+        assert follower() == "Hello, world"
+        with pytest.raises(ConnectionError):
+            leading.result()
+    assert calls == ["a", "a"]
+
+
+def test_cache_ignores_flight_of_crashed_process(tmp_path: Path):
+    calls: list[str] = []
+    completion = make_completion(Cache(10, tmp_path), calls)
+    key = md5(json.dumps(((), {"prompt": "a", "caching": True})).encode()).hexdigest()
+    (tmp_path / f".{key}.flight").write_bytes(b"\0\0\0\1\0\0\0\0x")
+    assert completion("a") == "A"
+    assert calls == ["a"]
+    assert not (tmp_path / f".{key}.flight").exists()
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_similar_prompts(tmp_path: Path, cache_class):
+    calls: list[str] = []
+
+    @cache_class(3, tmp_path)
+    def get_completion(self, model, messages):
+        calls.append(messages[-1]["content"])
+        yield messages[-1]["content"].upper()
+
+    def completion(prompt, model="gpt", role="Shell", similar=True):
+        messages = [
+            {"role": "system", "content": f"You are {role}"},
+            {"role": "user", "content": prompt},
+        ]
+        return "".join(
+            get_completion(
+                None, model=model, messages=messages, caching=True, similar=similar
+            )
+        )
+
+    assert completion("list files by size") == "LIST FILES BY SIZE"
+    # Case, punctuation, whitespace and filler words don't matter.
+    assert completion("List  files, by SIZE?") == "LIST FILES BY SIZE"
+    # Jaccard similarity 0.8.
+    assert completion("list the files by size") == "LIST FILES BY SIZE"
+    assert len(calls) == 1
+    # Different model, role, opted out request, numbers are not reused.
+    completion("list files by size", model="other")
+    completion("list files by size", role="Code")
+    completion("List files by size?", similar=False)
+    completion("delete files older than 7 days")
+    completion("delete files older than 8 days")
+    assert len(calls) == 6
+
+    # Entry of "list files by size" is evicted, so its prompt is removed.
+    assert completion("list the files by size") == "LIST THE FILES BY SIZE"
+    assert len(calls) == 7
+
+    # Swapped operands, other verbs, words and negations ask for another command.
+    prompts = [
+        ("rename a.txt to b.txt", "rename b.txt to a.txt"),
+        ("copy src to dst", "copy dst to src"),
+        ("list files by size", "by size list files"),
+        (
+            "find logs older than a week and compress them",
+            "find logs older than a week and delete them",
+        ),
+        ("list files by size", "list files sorted by size"),
+        ("show hidden files sorted by size", "show hidden files not sorted by size"),
+    ]
+    for first, second in prompts:
+        assert completion(first) == first.upper()
+        assert completion(second) == second.upper()
+    assert len(calls) == 7 + 2 * len(prompts)
+
+
+def make_aged(cache: Cache):
+    def age(key: str, seconds: float) -> None:
+        if isinstance(cache, SqliteCache):
+            cache.connection.execute(
+                "UPDATE entries SET created = created - ? WHERE key = ?",
+                (seconds, key),
+            )
+        else:
+            path = cache.cache_path / key
+            written = path.stat().st_mtime - seconds
+            os.utime(path, (written, written))
+
+    return age
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_policy_ttl(tmp_path: Path, cache_class):
+    calls: list[str] = []
+    cache = cache_class(10, tmp_path)
+
+    @cache
+    def get_completion(self, prompt, temperature):
+        calls.append(prompt)
+        yield f"{prompt}{len(calls)}"
+
+    def completion(policy, temperature=0.0):
+        chunks = get_completion(
+            None, prompt="a", temperature=temperature, caching=True, policy=policy
+        )
+        return "".join(chunks), policy.decision, policy.reason
+
+    key = md5(
+        json.dumps(((), {"prompt": "a", "temperature": 0.0, "caching": True})).encode()
+    ).hexdigest()
+    age = make_aged(cache)
+    sources = {"ttl": "config", "stale_ttl": "role", "max_temperature": "role"}
+    ttl = CachePolicy(ttl=60, sources=sources)
+    assert completion(ttl) == ("a1", "miss", "not cached")
+    assert completion(ttl) == ("a1", "hit", "config ttl=60")
+    assert completion(CachePolicy()) == ("a1", "hit", "no ttl")
+    age(key, 120)
+    assert completion(ttl) == ("a2", "miss", "config ttl=60")
+
+    # Stale entry is used while it is refreshed in background.
+    age(key, 120)
+    stale = CachePolicy(ttl=60, stale_ttl=3600, sources=sources)
+    assert completion(stale) == ("a2", "stale hit", "role stale_ttl=3600")
+    args, kwargs = json.loads(stale.refresh)
+    assert list(get_completion(None, *args, **kwargs, refresh=True)) == []
+    assert completion(stale) == ("a3", "hit", "config ttl=60")
+    assert len(calls) == 3
+
+    hot = CachePolicy(max_temperature=0.5, sources=sources)
+    assert completion(hot, 1.0) == ("a4", "bypass", "role max_temperature=0.5")
+    assert completion(hot, 1.0) == ("a5", "bypass", "role max_temperature=0.5")
+    disabled = CachePolicy(enabled=False)
+    assert completion(disabled) == ("a6", "bypass", "default enabled=false")
+    # Requests which are not cached are not written either.
+    assert completion(CachePolicy()) == ("a3", "hit", "no ttl")
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_stale_refresh(tmp_path: Path, cache_class):
+    requests: list[list[str]] = []
+    cache = cache_class(10, tmp_path)
+
+    @cache
+    def get_completion(self, messages, functions):
+        requests.append([message["content"] for message in messages])
+        yield "answer"
+
+    def completion(messages, functions=None):
+        policy = CachePolicy(ttl=60, stale_ttl=3600)
+        answer = "".join(
+            get_completion(
+                None,
+                messages=messages,
+                functions=functions,
+                caching=True,
+                policy=policy,
+            )
+        )
+        return answer, policy.refresh
+
+    def key(messages, functions=None):
+        request = {"messages": messages, "functions": functions, "caching": True}
+        return md5(json.dumps(((), request)).encode()).hexdigest()
+
+    age = make_aged(cache)
+    messages = [{"role": "user", "content": "q"}]
+    assert completion(messages) == ("answer", None)
+    age(key(messages), 120)
+    answer, refresh = completion(messages)
+    # Refresh requests the completion of the stale entry, not of the chat
+    # which is continued by the caller.
+    messages.append({"role": "assistant", "content": "answer"})
+    args, kwargs = json.loads(refresh)
+    list(get_completion(None, *args, **kwargs, refresh=True))
+    assert requests == [["q"], ["q"]]
+    assert list(tmp_path.glob(".*.flight")) == []
+
+    # Completions with function calls are not requested without the caller.
+    functions = [{"name": "execute_shell_command"}]
+    messages = [{"role": "user", "content": "ls"}]
+    assert completion(messages, functions) == ("answer", None)
+    age(key(messages, functions), 120)
+    assert completion(messages, functions) == ("answer", None)
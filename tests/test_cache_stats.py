@@ -0,0 +1,94 @@
+import json
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from sgpt.cache import Cache, SqliteCache
+from sgpt.handlers.handler import Handler
+
+from .test_cache import make_completion
+from .utils import app, assert_usage_error, runner
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_counters(tmp_path: Path, cache_class):
+    cache = cache_class(2, tmp_path)
+
+    @cache
+    def get_completion(self, messages):
+        time.sleep(0.05)
+        yield messages[-1]["content"].upper()
+
+    def completion(prompt, caching=True):
+        messages = [{"role": "user", "content": prompt}]
+        return "".join(get_completion(None, messages=messages, caching=caching))
+
+    for prompt in ("a", "a", "b", "c", "a", "c"):
+        completion(prompt)
+    completion("d", caching=False)
+
+    counters = cache.counters.get()
+    assert counters["hits"] == 2
+    assert counters["misses"] == 4
+    assert counters["bypasses"] == 1
+    # Entry of "d" is written, "a" and "b" are evicted once, "c" or "d" again.
+    assert counters["evictions"] == 3
+    entry_size = len(cache._encode(["A"]))
+    assert counters["bytes_written"] == 5 * entry_size
+    # Latency of original request and estimated prompt and completion tokens.
+    assert 0.1 <= counters["saved_seconds"] < 0.2
+    assert counters["saved_tokens"] == 2 * (4 + 1 + 1)
+    assert time.time() - 60 < counters["since"] <= time.time()
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_cache_commands(tmp_path: Path, cache_class):
+    cache = cache_class(10, tmp_path / "cache")
+    completion = make_completion(cache, [])
+    for prompt in ("first prompt", "second prompt", "first prompt"):
+        completion(prompt)
+    entries = cache.entries()
+    keys = [entry["key"] for entry in entries]
+
+    with patch.object(Handler, "cache", cache):
+        result = runner.invoke(app, ["--cache-stats"])
+        assert result.exit_code == 0
+        assert f"Entries: 2 of 10, {sum(e['size'] for e in entries)} B" in result.stdout
+        assert "Requests: 3, 1 hits (33.3%)" in result.stdout
+
+        result = runner.invoke(app, ["--cache-ls"])
+        lines = result.stdout.splitlines()
+        assert [line.split()[0] for line in lines] == keys
+        assert lines[0].endswith("SECOND PROMPT")
+
+        export_path = tmp_path / "export.jsonl"
+        result = runner.invoke(app, ["--cache-export", str(export_path)])
+        assert result.stdout == "Exported 2 entries.\n"
+        result = runner.invoke(app, ["--cache-export", "-"])
+        exported = [json.loads(line) for line in result.stdout.splitlines()]
+        assert [record["key"] for record in exported] == keys[::-1]
+
+        # Written a day ago.
+        cache._set(keys[0], cache._read(keys[0]), time.time() - 24 * 60 * 60)
+        result = runner.invoke(app, ["--cache-purge", "--older-than", "12h"])
+        assert result.stdout.startswith("Removed 1 entries")
+        assert [entry["key"] for entry in cache.entries()] == keys[1:]
+        result = runner.invoke(app, ["--cache-purge"])
+        assert result.stdout.startswith("Removed 1 entries")
+        assert cache.entries() == []
+
+        result = runner.invoke(app, ["--cache-import", str(export_path)])
+        assert result.stdout == "Imported 2 entries.\n"
+        assert cache._get(keys[0]) == "SECOND PROMPT"
+        assert abs(cache.entries()[0]["created"] - entries[0]["created"]) < 0.01
+        # Entries which are already in the cache are not replaced.
+        result = runner.invoke(app, ["--cache-import", str(export_path)])
+        assert result.stdout == "Imported 0 entries.\n"
+
+        export_path.write_text('{"key": "../file", "created": 0, "value": ""}\n')
+        result = runner.invoke(app, ["--cache-import", str(export_path)])
+        assert_usage_error(result, "Line 1 is not a cache entry.")
+        result = runner.invoke(app, ["--cache-purge", "--older-than", "week"])
+        assert_usage_error(result, "week, use seconds")
@@ -0,0 +1,124 @@
+import os
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from sgpt.handlers.chat_handler import ChatHandler, ChatSession
+
+from .utils import app, runner
+
+SYSTEM = {"role": "system", "content": "You are Code Generator\nProvide only code."}
+
+
+def write_chat(session: ChatSession, chat_id: str, turns: int, used: float) -> None:
+    messages = [SYSTEM]
+    for index in range(turns):
+        messages.append({"role": "user", "content": f"question {index}"})
+        messages.append({"role": "assistant", "content": "answer " * 100})
+    session._write(messages, chat_id)
+    path = session.storage_path / chat_id
+    os.utime(path, (used, used))
+    messages = session._load(chat_id)
+    session.index.replace(chat_id, messages, session._info(chat_id))
+
+
+def test_list(tmp_path: Path):
+    session = ChatSession(100, tmp_path / "chats")
+    now = time.time()
+    write_chat(session, "small", 1, now - 60)
+    write_chat(session, "large", 5, now - 120)
+    write_chat(session, "old", 2, now - 3600)
+    (tmp_path / "chats" / "other").write_text('[{"role": "user", "content": "hi"}]')
+
+    chats = session.list()
+    assert [chat["chat_id"] for chat in chats][1:] == ["small", "large", "old"]
+    large = next(chat for chat in chats if chat["chat_id"] == "large")
+    assert large["role"] == "Code Generator"
+    assert large["messages"] == 11
+    assert large["size"] == (tmp_path / "chats" / "large").stat().st_size
+    assert large["tokens"] > 5 * 100
+    assert abs(large["used"] - (now - 120)) < 1
+
+    ids = [chat["chat_id"] for chat in session.list("size")]
+    assert ids[:3] == ["large", "old", "small"]
+    ids = [chat["chat_id"] for chat in session.list("name", limit=2, offset=1)]
+    assert ids == ["old", "other"]
+    ids = [chat["chat_id"] for chat in session.list("name", match="CODE")]
+    assert ids == ["large", "old", "small"]
+    assert session.list(match="%") == []
+
+    # Chats are listed from the index, files are not read.
+    with patch.object(ChatSession, "_load") as load:
+        assert len(session.list()) == 4
+    load.assert_not_called()
+
+
+def test_gc(tmp_path: Path):
+    session = ChatSession(100, tmp_path / "chats")
+    now = time.time()
+    write_chat(session, "new", 1, now - 60)
+    write_chat(session, "large", 20, now - 120)
+    write_chat(session, "small", 1, now - 180)
+    write_chat(session, "old", 1, now - 10 * 24 * 3600)
+    new_size = session.list(match="new")[0]["size"]
+
+    removed = session.gc(7 * 24 * 3600, 0)
+    assert [chat["chat_id"] for chat in removed] == ["old"]
+    assert not (tmp_path / "chats" / "old").exists()
+
+    # Large chat doesn't fit, older but smaller chat is kept.
+    removed = session.gc(0, 3 * new_size)
+    assert [chat["chat_id"] for chat in removed] == ["large"]
+    assert [chat["chat_id"] for chat in session.list()] == ["new", "small"]
+    assert sorted(os.listdir(tmp_path / "chats")) == ["new", "small"]
+
+
+def test_list_chats_options(tmp_path: Path):
+    session = ChatSession(100, tmp_path / "chats")
+    now = time.time()
+    for index in range(5):
+        write_chat(session, f"chat_{index}", index + 1, now - index * 60)
+
+    with patch.object(ChatHandler, "chat_session", session):
+        # Paths only, least recently used first, for scripts.
+        result = runner.invoke(app, ["--list-chats"])
+        assert result.exit_code == 0
+        assert result.stdout.splitlines() == [
+            str(tmp_path / "chats" / f"chat_{index}") for index in range(4, -1, -1)
+        ]
+
+    with patch.object(ChatHandler, "chat_session", session), patch.dict(
+        os.environ, {"PLAIN_OUTPUT": "false"}
+    ):
+        result = runner.invoke(app, ["--list-chats", "--chats-sort", "size"])
+        assert result.exit_code == 0
+        lines = result.stdout.splitlines()
+        assert [Path(line.split()[0]).name for line in lines] == [
+            f"chat_{index}" for index in range(4, -1, -1)
+        ]
+        assert "Code Generator, 11 messages" in lines[0]
+
+        args = [
+            "--chats-limit",
+            "2",
+            "--chats-offset",
+            "1",
+            "-lc",
+            "--chats-sort",
+            "used",
+        ]
+        result = runner.invoke(app, args)
+        lines = result.stdout.splitlines()
+        assert [Path(line.split()[0]).name for line in lines] == ["chat_1", "chat_2"]
+
+        result = runner.invoke(app, ["--list-chats", "--chats-filter", "chat_3"])
+        assert Path(result.stdout.split()[0]).name == "chat_3"
+        assert len(result.stdout.splitlines()) == 1
+
+        # Older than CHAT_GC_MAX_DAYS.
+        write_chat(session, "old", 1, now - 31 * 24 * 3600)
+        size = (tmp_path / "chats" / "old").stat().st_size
+        result = runner.invoke(app, ["--chats-gc"])
+        assert result.exit_code == 0
+        assert result.stdout == f"Removed 1 chats ({size} B).\n"
+        assert len(session.list()) == 5
@@ -0,0 +1,66 @@
+from pathlib import Path
+from unittest.mock import patch
+
+from sgpt.config import cfg
+from sgpt.handlers.chat_handler import ChatSession
+
+from .utils import app, cmd_args, mock_comp, runner
+
+
+def write_chat(session: ChatSession, chat_id: str, *contents: str) -> None:
+    roles = ("user", "assistant")
+    messages = [
+        {"role": roles[index % 2], "content": content}
+        for index, content in enumerate(contents)
+    ]
+    session._write(messages, chat_id)
+
+
+def test_search(tmp_path: Path):
+    session = ChatSession(2, tmp_path / "chats")
+    write_chat(session, "docker", "how to list containers?", "Use docker ps -a")
+    write_chat(session, "python", "list comprehension", "[x for x in items]")
+
+    assert session.search("docker ps", 10) == [
+        ("docker", "assistant", "Use [docker] [ps] -a")
+    ]
+    assert [chat_id for chat_id, *_ in session.search("list", 10)] == [
+        "python",
+        "docker",
+    ]
+    assert session.search("missing", 10) == []
+    # Query characters are not FTS5 syntax.
+    assert session.search('"-a" OR', 10) == []
+
+    # Compaction rewrites the chat, dropped messages are not found.
+    write_chat(session, "docker", "1", "2", "3", "4")
+    assert session.search("docker", 10) == []
+    assert session.search("containers", 10) != []
+    session.invalidate("python")
+    assert session.search("comprehension", 10) == []
+
+
+def test_search_indexes_existing_chats(tmp_path: Path):
+    session = ChatSession(100, tmp_path / "chats")
+    write_chat(session, "indexed", "hello world")
+    # Chat created without index, e.g. by previous version.
+    (tmp_path / "chats" / "legacy").write_text('[{"role": "user", "content": "hi"}]')
+    (tmp_path / "chats" / "indexed").unlink()
+
+    assert session.search("hello", 10) == []
+    assert session.search("hi", 10) == [("legacy", "user", "[hi]")]
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_search_chats_option(completion):
+    chat_name = "_test_search"
+    chat_path = Path(cfg.get("CHAT_CACHE_PATH")) / chat_name
+    chat_path.unlink(missing_ok=True)
+    completion.return_value = mock_comp("Prague")
+    args = {"prompt": "capital of Czechia?", "--chat": chat_name}
+    runner.invoke(app, cmd_args(**args))
+
+    result = runner.invoke(app, ["--search-chats", "Czechia"])
+    assert result.exit_code == 0
+    assert f"{chat_name} user: capital of [Czechia]?" in result.output
+    chat_path.unlink()
@@ -0,0 +1,275 @@
+import json
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from sgpt.compress import decompress, method_of
+from sgpt.config import cfg
+from sgpt.handlers.chat_handler import ChatHandler, ChatSession
+
+from .utils import app, cmd_args, mock_comp, runner
+
+
+def make_completion(session: ChatSession):
+    @session
+    def get_completion(messages):
+        yield f"answer {len(messages)}"
+
+    def completion(prompt):
+        messages = [{"role": "user", "content": prompt}]
+        return "".join(get_completion(messages=messages, chat_id="test"))
+
+    return completion
+
+
+def read_lines(path: Path) -> list[dict]:
+    text = decompress(path.read_bytes())
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def test_append_only(tmp_path: Path):
+    completion = make_completion(ChatSession(100, tmp_path))
+    completion("first")
+    completion("second")
+    assert read_lines(tmp_path / "test") == [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "answer 1"},
+        {"role": "user", "content": "second"},
+        {"role": "assistant", "content": "answer 3"},
+    ]
+
+
+def test_legacy_json_migrated(tmp_path: Path):
+    legacy = [
+        {"role": "system", "content": "You are ShellGPT"},
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "ok"},
+    ]
+    (tmp_path / "test").write_text(json.dumps(legacy))
+    session = ChatSession(100, tmp_path)
+    assert session._read("test") == legacy
+
+    make_completion(session)("second")
+    assert read_lines(tmp_path / "test") == legacy + [
+        {"role": "user", "content": "second"},
+        {"role": "assistant", "content": "answer 4"},
+    ]
+
+
+def test_compressed_chat(tmp_path: Path):
+    plain = make_completion(ChatSession(100, tmp_path))
+    plain("first")
+    # Plain chat is rewritten compressed, next turns are appended as blocks.
+    session = ChatSession(100, tmp_path, "zlib")
+    completion = make_completion(session)
+    completion("second " * 50)
+    completion("third " * 50)
+    data = (tmp_path / "test").read_bytes()
+    assert method_of(data) == "zlib"
+    messages = read_lines(tmp_path / "test")
+    assert [message["content"] for message in messages[::2]] == [
+        "first",
+        "second " * 50,
+        "third " * 50,
+    ]
+    assert len(data) < len(json.dumps(messages)) / 2
+    assert ChatSession(100, tmp_path, "zlib")._read("test") == messages
+
+
+def test_compaction(tmp_path: Path):
+    session = ChatSession(4, tmp_path)
+    completion = make_completion(session)
+    for index in range(10):
+        completion(str(index))
+        # Requests always see system (first) message and last messages only.
+        assert len(session._read("test")) <= 4
+        # File is compacted before it grows over twice the length.
+        assert len(read_lines(tmp_path / "test")) <= 2 * 4 + 1
+
+    messages = session._read("test")
+    assert messages[0] == {"role": "user", "content": "0"}
+    assert messages[-1] == {"role": "assistant", "content": "answer 5"}
+    assert ChatSession(4, tmp_path)._read("test") == messages
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_repl_reads_chat_once(completion, monkeypatch):
+    chat_name = "_test_reads"
+    chat_path = Path(cfg.get("CHAT_CACHE_PATH")) / chat_name
+    chat_path.unlink(missing_ok=True)
+    completion.side_effect = [mock_comp("ok"), mock_comp("8"), mock_comp("10")]
+    runner.invoke(app, cmd_args(prompt="my number is 6", **{"--chat": chat_name}))
+
+    reads = []
+    read_bytes = Path.read_bytes
+
+    def counting_read_bytes(self, *args, **kwargs):
+        if self == chat_path:
+            reads.append(self)
+        return read_bytes(self, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "read_bytes", counting_read_bytes)
+    # Chat is parsed once when REPL starts, turns are served from memory.
+    ChatHandler.chat_session._cache.clear()
+    inputs = ["__sgpt__eof__", "my number + 2?", "my number + 4?", "exit()"]
+    result = runner.invoke(
+        app, cmd_args(**{"--repl": chat_name}), input="\n".join(inputs)
+    )
+    assert result.exit_code == 0
+    assert completion.call_count == 3
+    assert len(reads) == 1
+    assert len(ChatHandler.chat_session._read(chat_name)) == 7
+    chat_path.unlink()
+
+
+def test_token_budget_window(tmp_path: Path, monkeypatch):
+    session = ChatSession(100, tmp_path)
+    system = {"role": "system", "content": "role"}
+    history = [
+        system,
+        {"role": "user", "content": "x" * 400},
+        {"role": "assistant", "content": "old"},
+        {"role": "user", "content": "list files"},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "call"}]},
+        {"role": "tool", "content": "y" * 40, "tool_call_id": "call"},
+        {"role": "assistant", "content": "files"},
+    ]
+    new = [{"role": "user", "content": "next"}]
+
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "0")
+    assert session._window(history, new, "model") == history + new
+
+    # Old turn with a long message doesn't fit, last turn is kept whole.
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "other:10,model:100")
+    assert session._window(history, new, "model") == [system] + history[3:] + new
+
+    # Turn is never split, even if its last messages would fit.
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "30")
+    assert session._window(history, new, "model") == [system] + new
+
+
+def test_token_budget_keeps_history(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "30")
+    sent = []
+
+    @ChatSession(100, tmp_path)
+    def get_completion(model, messages):
+        sent.append(list(messages))
+        yield "answer"
+
+    for prompt in ("a" * 40, "b" * 40, "c"):
+        messages = [{"role": "user", "content": prompt}]
+        "".join(get_completion(model="model", messages=messages, chat_id="test"))
+
+    assert [message["content"] for message in sent[-1]] == ["b" * 40, "answer", "c"]
+    assert len(read_lines(tmp_path / "test")) == 6
+
+
+def test_summary_compaction(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CHAT_SUMMARY_TOKENS", "40")
+    session = ChatSession(100, tmp_path)
+    system = {"role": "system", "content": "role"}
+    turns = [
+        {"role": "user", "content": "a" * 40},
+        {"role": "assistant", "content": "b" * 40},
+        {"role": "user", "content": "c"},
+        {"role": "assistant", "content": "d"},
+    ]
+    session._write([system] + turns, "test")
+    summarized = []
+
+    def summarize(messages):
+        summarized.append(messages)
+        # Compaction started while the chat is summarized is skipped.
+        assert ChatSession(100, tmp_path).compact("test", summarize) is None
+        return "summary"
+
+    before, after = session.compact("test", summarize)
+    assert after < before
+    assert summarized == [turns[:2]]
+    assert list(tmp_path.glob(".*")) == []
+    summary = {
+        "role": "system",
+        "content": "Summary of the earlier part of the conversation:\nsummary",
+    }
+    assert session._read("test") == [system, summary] + turns[2:]
+    # Raw messages are kept.
+    assert read_lines(tmp_path / "test")[:5] == [system] + turns
+    assert ChatSession(100, tmp_path)._read("test") == [system, summary] + turns[2:]
+    # Nothing to compact.
+    assert session.compact("test", summarize) is None
+
+    make_completion(session)("e")
+    assert session._read("test")[-2:] == [
+        {"role": "user", "content": "e"},
+        {"role": "assistant", "content": "answer 5"},
+    ]
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_repl_compaction(completion, monkeypatch):
+    monkeypatch.setenv("CHAT_SUMMARY_TOKENS", "60")
+    chat_name = "_test_compaction"
+    chat_path = Path(cfg.get("CHAT_CACHE_PATH")) / chat_name
+    chat_path.unlink(missing_ok=True)
+
+    def fake_completion(**kwargs):
+        if not kwargs["stream"]:
+            summary = MagicMock()
+            summary.choices[0].message.content = "we talked"
+            return summary
+        return mock_comp("x" * 100)
+
+    completion.side_effect = fake_completion
+    inputs = ["__sgpt__eof__", "first", "second", "third", "exit()"]
+    result = runner.invoke(
+        app, cmd_args(**{"--repl": chat_name}), input="\n".join(inputs)
+    )
+    assert result.exit_code == 0
+
+    requests = [call.kwargs for call in completion.call_args_list]
+    # Each turn is followed by compaction.
+    assert [request["stream"] for request in requests] == [True, False] * 3
+    # Last request gets summary instead of previous turns.
+    assert "we talked" in requests[-2]["messages"][1]["content"]
+    contents = [message["content"] for message in requests[-2]["messages"]]
+    assert "third" in contents
+    assert "first" not in contents
+    records = read_lines(chat_path)
+    assert [record["role"] for record in records].count("summary") == 3
+    chat_path.unlink()
+
+
+@patch("sgpt.handlers.chat_handler.subprocess.Popen")
+@patch("sgpt.handlers.handler.completion")
+def test_chat_compaction_detached(completion, popen, monkeypatch):
+    monkeypatch.setenv("CHAT_SUMMARY_TOKENS", "60")
+    chat_name = "_test_detached_compaction"
+    chat_path = Path(cfg.get("CHAT_CACHE_PATH")) / chat_name
+    chat_path.unlink(missing_ok=True)
+
+    def fake_completion(**kwargs):
+        if not kwargs["stream"]:
+            summary = MagicMock()
+            summary.choices[0].message.content = "we talked"
+            return summary
+        return mock_comp("x" * 100)
+
+    completion.side_effect = fake_completion
+    for prompt in ("first", "second"):
+        args = cmd_args(prompt=prompt, **{"--chat": chat_name, "--model": "gpt-x"})
+        assert runner.invoke(app, args).exit_code == 0
+    # Commands don't wait for the summary, it is requested by a detached process.
+    assert [call.kwargs["stream"] for call in completion.call_args_list] == [True] * 2
+    assert popen.call_count == 2  # Over CHAT_SUMMARY_TOKENS after each turn.
+    assert popen.call_args.args[0][-2:] == ["--compact-chat", chat_name]
+    assert popen.call_args.kwargs["env"]["DEFAULT_MODEL"] == "gpt-x"
+    assert popen.call_args.kwargs["start_new_session"]
+
+    monkeypatch.setenv("DEFAULT_MODEL", "gpt-x")
+    result = runner.invoke(app, ["--compact-chat", chat_name])
+    assert result.exit_code == 0
+    assert completion.call_args.kwargs["stream"] is False
+    assert completion.call_args.kwargs["model"] == "gpt-x"
+    records = read_lines(chat_path)
+    assert [record["role"] for record in records].count("summary") == 1
+    chat_path.unlink()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from unittest.mock import patch
 
@@ -21,6 +22,7 @@ def test_code_generation(completion):
     assert "print('Hello World')" in result.output
 
 
+@patch.dict(os.environ, {"PLAIN_OUTPUT": "false"})
 @patch("sgpt.printer.TextPrinter.live_print")
 @patch("sgpt.printer.MarkdownPrinter.live_print")
 @patch("sgpt.handlers.handler.completion")
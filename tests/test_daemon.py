@@ -0,0 +1,65 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from sgpt.__version__ import __version__
+from sgpt.client import forward
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="Unix sockets only.")
+
+
+@pytest.fixture
+def daemon_socket(tmp_path, monkeypatch):
+    path = tmp_path / "daemon.sock"
+    monkeypatch.setenv("DAEMON_SOCKET_PATH", str(path))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "sgpt", "--daemon"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        if path.exists():
+            break
+        time.sleep(0.1)
+    yield path
+    process.send_signal(signal.SIGINT)
+    process.wait(timeout=10)
+
+
+def test_forward_without_daemon(tmp_path, monkeypatch):
+    monkeypatch.setenv("DAEMON_SOCKET_PATH", str(tmp_path / "daemon.sock"))
+    assert forward(["--version"]) is None
+
+    # Stale socket file of a daemon which is not running.
+    (tmp_path / "daemon.sock").touch()
+    assert forward(["--version"]) is None
+
+
+def test_forward_to_daemon(daemon_socket, capfd):
+    assert forward(["--version"]) == 0
+    assert f"ShellGPT {__version__}" in capfd.readouterr().out
+
+    assert forward(["--role", "_missing_role", "hi"]) == 1
+    assert 'Role "_missing_role" not found.' in capfd.readouterr().err
+
+    # Interactive commands need the terminal of the client.
+    assert forward(["--repl", "temp", "--version"]) is None
+    assert forward(["--editor", "--version"]) is None
+    assert forward(["--shell", "--interaction", "--version"]) is None
+    assert forward(["--shell", "--no-interaction", "--version"]) == 0
+
+
+def test_forward_with_different_config(daemon_socket, monkeypatch):
+    assert oct(daemon_socket.stat().st_mode & 0o777) == "0o600"
+    # Daemon is warmed up with its own config, so the command runs in-process.
+    monkeypatch.setenv("DEFAULT_MODEL", "other-model")
+    assert forward(["--version"]) is None
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://localhost:1234")
+    monkeypatch.delenv("DEFAULT_MODEL")
+    assert forward(["--version"]) is None
+    monkeypatch.delenv("OPENAI_BASE_URL")
+    assert forward(["--version"]) == 0
@@ -1,11 +1,14 @@
+import os
 from pathlib import Path
 from unittest.mock import patch
+from uuid import uuid4
 
 import typer
 from typer.testing import CliRunner
 
 from sgpt import config, main
 from sgpt.__version__ import __version__
+from sgpt.handlers.handler import Handler
 from sgpt.role import DefaultRoles, SystemRole
 
 from .utils import app, assert_usage_error, cmd_args, comp_args, mock_comp, runner
@@ -222,6 +225,7 @@ def test_version(completion):
     assert __version__ in result.output
 
 
+@patch.dict(os.environ, {"PLAIN_OUTPUT": "false"})
 @patch("sgpt.printer.TextPrinter.live_print")
 @patch("sgpt.printer.MarkdownPrinter.live_print")
 @patch("sgpt.handlers.handler.completion")
@@ -235,6 +239,7 @@ def test_markdown(completion, markdown_printer, text_printer):
     text_printer.assert_not_called()
 
 
+@patch.dict(os.environ, {"PLAIN_OUTPUT": "false"})
 @patch("sgpt.printer.TextPrinter.live_print")
 @patch("sgpt.printer.MarkdownPrinter.live_print")
 @patch("sgpt.handlers.handler.completion")
@@ -246,3 +251,40 @@ def test_no_markdown(completion, markdown_printer, text_printer):
     assert result.exit_code == 0
     markdown_printer.assert_not_called()
     text_printer.assert_called()
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_plain_output(completion):
+    completion.return_value = mock_comp("# Prague")
+
+    args = {"prompt": "capital of the Czech Republic?", "--md": True}
+    result = runner.invoke(app, cmd_args(**args))
+
+    # Stdout is not a TTY, Markdown is not rendered.
+    assert result.exit_code == 0
+    assert result.output == "# Prague\n"
+
+
+@patch("sgpt.handlers.handler.subprocess.Popen")
+@patch("sgpt.handlers.handler.completion")
+def test_stale_cache_refresh_detached(completion, popen, monkeypatch):
+    monkeypatch.setenv("CACHE_TTL", "60")
+    monkeypatch.setenv("CACHE_STALE_TTL", "3600")
+    completion.side_effect = lambda **_: mock_comp(f"answer {completion.call_count}")
+    args = [f"capital of the Czech Republic? {uuid4()}", "--cache", "--no-functions"]
+    assert runner.invoke(app, args).output == "answer 1\n"
+
+    # Stale entry is shown, the command doesn't wait for the refresh.
+    with patch.object(Handler.cache, "_age", return_value=120.0):
+        assert runner.invoke(app, args).output == "answer 1\n"
+    assert completion.call_count == 1
+    assert popen.call_args.args[0][-2] == "--refresh-cache"
+    assert popen.call_args.kwargs["start_new_session"]
+    request_path = Path(popen.call_args.args[0][-1])
+    result = runner.invoke(app, ["--refresh-cache", str(request_path)])
+    assert result.exit_code == 0
+    assert result.output == ""
+    assert completion.call_count == 2
+    assert not request_path.exists()
+    assert runner.invoke(app, args).output == "answer 2\n"
+    assert popen.call_count == 1
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+from unittest.mock import patch
+
+from sgpt.llm_functions.common.execute_shell import Function, Output
+
+
+def test_output_head_and_tail():
+    output = Output(head_size=4, tail_size=4)
+    for _ in range(100):
+        output.write(b"0123456789")
+    assert len(output.tail) <= 8
+    assert str(output) == "0123\n[... 992 bytes truncated ...]\n6789"
+
+    output = Output(head_size=4, tail_size=4)
+    output.write(b"012345")
+    assert str(output) == "012345"
+
+
+def test_execute():
+    result = Function.execute("echo hello; exit 3")
+    assert result.startswith("Exit code: 3, Elapsed: ")
+    assert result.endswith("Output:\nhello\n")
+
+
+@patch.dict(
+    os.environ, {"SHELL_OUTPUT_HEAD_BYTES": "5", "SHELL_OUTPUT_TAIL_BYTES": "5"}
+)
+def test_execute_large_output():
+    command = f"{sys.executable} -c \"print('a' * 10 ** 7 + 'end')\""
+    result = Function.execute(command)
+    assert result.startswith("Exit code: 0")
+    assert result.endswith("aaaaa\n[... 9999994 bytes truncated ...]\naend\n")
+
+
+@patch.dict(os.environ, {"SHELL_COMMAND_TIMEOUT": "1"})
+def test_execute_timeout():
+    started = time.monotonic()
+    # Background child keeps output open after the shell exits.
+    result = Function.execute("echo started; sleep 30 & sleep 30")
+    assert time.monotonic() - started < 10
+    assert "(killed after 1s timeout)" in result
+    assert result.endswith("Output:\nstarted\n")
@@ -0,0 +1,310 @@
+import json
+import os
+import signal
+import time
+from datetime import datetime
+from threading import Barrier
+from unittest.mock import patch
+
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice as StreamChoice
+from openai.types.chat.chat_completion_chunk import (
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+    ChoiceDeltaToolCallFunction,
+)
+
+import sgpt.function
+from sgpt.config import cfg
+from sgpt.function import FunctionManifest, FunctionResults
+from sgpt.llm_functions.common.execute_shell import Function as ShellFunction
+
+from .utils import app, mock_comp, runner
+
+
+def mock_tool_calls(*calls: tuple) -> list:
+    """
+    Streams tool calls in parts, like OpenAI does: first chunk of each call
+    has id and name, arguments follow in separate chunks.
+    """
+
+    def chunk(delta: ChoiceDelta, finish_reason=None) -> ChatCompletionChunk:
+        return ChatCompletionChunk(
+            id="foo",
+            model=cfg.get("DEFAULT_MODEL"),
+            object="chat.completion.chunk",
+            choices=[StreamChoice(index=0, finish_reason=finish_reason, delta=delta)],
+            created=int(datetime.now().timestamp()),
+        )
+
+    chunks = []
+    for index, (name, arguments) in enumerate(calls):
+        function = ChoiceDeltaToolCallFunction(name=name, arguments="")
+        tool_call = ChoiceDeltaToolCall(
+            index=index, id=f"call_{index}", function=function, type="function"
+        )
+        chunks.append(chunk(ChoiceDelta(tool_calls=[tool_call])))
+        arguments = json.dumps(arguments)
+        for part in (
+            arguments[: len(arguments) // 2],
+            arguments[len(arguments) // 2 :],
+        ):
+            function = ChoiceDeltaToolCallFunction(arguments=part)
+            tool_call = ChoiceDeltaToolCall(index=index, function=function)
+            chunks.append(chunk(ChoiceDelta(tool_calls=[tool_call])))
+    chunks.append(chunk(ChoiceDelta(), finish_reason="tool_calls"))
+    return chunks
+
+
+SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "execute_shell_command",
+        "parameters": {"type": "object", "properties": {"cmd": {"type": "string"}}},
+    },
+}
+
+
+def run(prompt: str):
+    with patch("sgpt.app.get_openai_schemas", return_value=[SCHEMA]):
+        return runner.invoke(app, [prompt, "--no-cache", "--functions"])
+
+
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_parallel_tool_calls(completion, get_function):
+    # All three calls must run at the same time to pass the barrier.
+    barrier = Barrier(3, timeout=5)
+
+    def execute_shell_command(cmd):
+        barrier.wait()
+        # Finish in reverse order, results are still added in request order.
+        time.sleep(0.03 * (3 - int(cmd[-1])))
+        return f"output of {cmd}"
+
+    get_function.return_value = execute_shell_command
+    calls = [("execute_shell_command", {"cmd": f"ls {i}"}) for i in (1, 2, 3)]
+    completion.side_effect = [mock_tool_calls(*calls), mock_comp("done")]
+
+    result = run("list")
+    assert result.exit_code == 0, result.output
+    assert completion.call_count == 2
+    assert "parallel_tool_calls" not in completion.call_args_list[0].kwargs
+    messages = completion.call_args_list[1].kwargs["messages"]
+    assert [call["id"] for call in messages[-4]["tool_calls"]] == [
+        "call_0",
+        "call_1",
+        "call_2",
+    ]
+    assert messages[-4]["tool_calls"][1]["function"]["arguments"] == '{"cmd": "ls 2"}'
+    assert messages[-3:] == [
+        {
+            "role": "tool",
+            "content": f"output of ls {i}",
+            "tool_call_id": f"call_{i - 1}",
+        }
+        for i in (1, 2, 3)
+    ]
+    assert result.output.index("ls 1") < result.output.index("ls 3")
+    assert "done" in result.output
+
+
+@patch.dict(os.environ, {"FUNCTIONS_MAX_WORKERS": "1"})
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_sequential_tool_calls(completion, get_function):
+    executed = []
+    get_function.return_value = lambda cmd: executed.append(cmd) or cmd
+    calls = [("execute_shell_command", {"cmd": f"ls {i}"}) for i in (1, 2)]
+    completion.side_effect = [mock_tool_calls(*calls), mock_comp("done")]
+
+    result = run("list")
+    assert result.exit_code == 0, result.output
+    assert executed == ["ls 1", "ls 2"]
+
+
+@patch.dict(os.environ, {"FUNCTIONS_MAX_STEPS": "3"})
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_tool_calls_max_steps(completion, get_function):
+    get_function.return_value = lambda cmd: cmd
+    calls = [("execute_shell_command", {"cmd": "ls"})]
+    completion.side_effect = [
+        mock_tool_calls(*calls),
+        mock_tool_calls(*calls),
+        mock_comp("partial answer"),
+    ]
+
+    result = run("list")
+    assert result.exit_code == 0, result.output
+    assert completion.call_count == 3
+    tool_choices = [call.kwargs["tool_choice"] for call in completion.call_args_list]
+    # Last request asks for an answer with results of previous steps.
+    assert tool_choices == ["auto", "auto", "none"]
+    assert get_function.call_count == 2
+    assert "partial answer" in result.output
+
+
+@patch.dict(os.environ, {"FUNCTIONS_TIME_BUDGET": "0"})
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_tool_calls_time_budget(completion, get_function):
+    # Tool calls are ignored once budget is exhausted.
+    completion.side_effect = [mock_tool_calls(("execute_shell_command", {}))]
+
+    result = run("list")
+    assert result.exit_code == 0, result.output
+    assert completion.call_args.kwargs["tool_choice"] == "none"
+    get_function.assert_not_called()
+
+
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_tool_calls_steps_stats(completion, get_function, tmp_path):
+    get_function.return_value = lambda cmd: cmd
+    calls = [("execute_shell_command", {"cmd": "ls"})] * 2
+    completion.side_effect = [mock_tool_calls(*calls), mock_comp("done")]
+    stats_path = tmp_path / "stats.jsonl"
+
+    with patch.dict(os.environ, {"STATS_PATH": str(stats_path)}):
+        result = run("list")
+    assert result.exit_code == 0, result.output
+    stats = json.loads(stats_path.read_text())
+    assert stats["tool_calls"] == 2
+    assert [step["tool_calls"] for step in stats["steps"]] == [2, 0]
+
+
+@patch("sgpt.handlers.handler.get_function")
+@patch("sgpt.handlers.handler.completion")
+def test_interrupted_parallel_tool_calls(completion, get_function):
+    started = []
+
+    def execute_shell_command(cmd):
+        if cmd == "interrupt":
+            # Ctrl+C, once the command runs.
+            while not sgpt.function._processes:
+                time.sleep(0.01)
+            started.extend(sgpt.function._processes)
+            os.kill(os.getpid(), signal.SIGINT)
+            return ""
+        return ShellFunction.execute(cmd)
+
+    get_function.return_value = execute_shell_command
+    calls = [
+        ("execute_shell_command", {"cmd": cmd}) for cmd in ("sleep 30", "interrupt")
+    ]
+    completion.side_effect = [mock_tool_calls(*calls), mock_comp("done")]
+
+    began = time.monotonic()
+    result = run("sleep")
+    # Command runs in own session without Ctrl+C, it is killed, not waited for.
+    assert time.monotonic() - began < 10
+    # Interrupted completion stops without an error, results are not sent.
+    assert result.exit_code == 0
+    assert completion.call_count == 1
+    assert [process.poll() for process in started] == [-9]
+
+
+PLUGIN = """
+from pathlib import Path
+from pydantic import BaseModel
+
+Path(__file__).with_suffix(".imports").open("a").write("imported\\n")
+
+
+class Function(BaseModel):
+    @classmethod
+    def execute(cls):
+        return "{result}"
+
+    @classmethod
+    def openai_schema(cls):
+        return {{"type": "function", "function": {{"name": "{name}"}}}}
+"""
+
+
+def test_function_manifest(tmp_path):
+    plugin = tmp_path / "plugin.py"
+    plugin.write_text(PLUGIN.format(name="plugin", result="first"))
+    imports = tmp_path / "plugin.imports"
+
+    def imported() -> int:
+        return len(imports.read_text().splitlines())
+
+    functions = FunctionManifest(tmp_path).load()
+    assert list(functions) == ["plugin"]
+    assert imported() == 1
+
+    # Schemas are served from manifest, module is imported on execution.
+    functions = FunctionManifest(tmp_path).load()
+    assert functions["plugin"].openai_schema["function"]["name"] == "plugin"
+    assert imported() == 1
+    assert functions["plugin"].execute() == "first"
+    assert imported() == 2
+
+    # Touched file with the same content is not imported.
+    os.utime(plugin, ns=(0, 0))
+    FunctionManifest(tmp_path).load()
+    assert imported() == 2
+
+    plugin.write_text(PLUGIN.format(name="renamed", result="second"))
+    functions = FunctionManifest(tmp_path).load()
+    assert list(functions) == ["renamed"]
+    assert imported() == 3
+
+
+MEMOIZED_PLUGIN = """
+from pathlib import Path
+from typing import ClassVar
+from pydantic import BaseModel
+
+
+class Function(BaseModel):
+    {declaration}
+
+    @classmethod
+    def execute(cls, cmd):
+        calls = Path(__file__).with_suffix(".calls")
+        calls.open("a").write(cmd + "\\n")
+        return f"output of {{cmd}} #{{len(calls.read_text().splitlines())}}"
+
+    @classmethod
+    def openai_schema(cls):
+        return {{"type": "function", "function": {{"name": "{name}"}}}}
+"""
+
+
+def test_function_results(tmp_path):
+    for name, declaration in (
+        ("pure", "pure: ClassVar[bool] = True"),
+        ("ttl", "cache_ttl: ClassVar[float] = 60"),
+        ("plain", "pass"),
+    ):
+        plugin = MEMOIZED_PLUGIN.format(name=name, declaration=declaration)
+        (tmp_path / f"{name}.py").write_text(plugin)
+    results = FunctionResults(2)
+    with patch("sgpt.function.results", results):
+        functions = FunctionManifest(tmp_path).load()
+        pure = functions["pure"].execute
+        assert pure(cmd="uname -a") == "output of uname -a #1"
+        # Marked in the tool message, so LLM knows result is not new.
+        assert pure(cmd="uname -a") == (
+            "[Cached result of the same call 0s ago]\noutput of uname -a #1"
+        )
+        assert pure(cmd="git status") == "output of git status #2"
+
+        # Least recently used result is evicted.
+        assert functions["ttl"].execute(cmd="ls") == "output of ls #1"
+        assert pure(cmd="git status").endswith("#2")
+        assert pure(cmd="uname -a") == "output of uname -a #3"
+
+        ttl = functions["ttl"].execute
+        assert ttl(cmd="ls") == "output of ls #2"
+        with patch("sgpt.function.time.monotonic", return_value=time.monotonic() + 30):
+            assert ttl(cmd="ls").endswith("30s ago]\noutput of ls #2")
+        with patch("sgpt.function.time.monotonic", return_value=time.monotonic() + 61):
+            assert ttl(cmd="ls") == "output of ls #3"
+
+        plain = functions["plain"].execute
+        assert plain(cmd="ls") == "output of ls #1"
+        assert plain(cmd="ls") == "output of ls #2"
@@ -0,0 +1,86 @@
+import io
+import re
+
+import pytest
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+from sgpt.printer import MarkdownPrinter
+
+MARKDOWN = """# Title
+
+Some *paragraph* with `code` and a [link](https://example.com).
+Second line of the paragraph.
+
+1. first
+2. second
+
+   nested paragraph
+
+- bullet
+- another bullet
+---
+Setext heading
+==============
+
+```python
+def main():
+
+    return 1
+```
+
+> quote
+continued
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+Final words.
+"""
+
+REFERENCES = """See the [docs][d] first.
+
+Then read [the guide].
+
+[d]: https://example.com/docs
+[the guide]: https://example.com/guide "The \\"guide\\""
+
+Later [docs][D] again, and an [unknown][x] reference.
+"""
+
+
+def make_console() -> Console:
+    return Console(
+        file=io.StringIO(), width=60, force_terminal=True, force_interactive=False
+    )
+
+
+def output(console: Console) -> str:
+    # Hyperlink ids are random.
+    return re.sub(r"id=\d+;", "", console.file.getvalue())  # type: ignore
+
+
+def assert_live_print(markdown: str, chunk_size: int) -> None:
+    # Previous implementation re-rendered whole completion on every chunk.
+    expected_console = make_console()
+    with Live(console=expected_console, auto_refresh=False) as live:
+        live.update(Markdown(markdown, code_theme="dracula"), refresh=True)
+
+    printer = MarkdownPrinter("dracula", 0, "visible")
+    printer.console = make_console()
+    chunks = (markdown[i : i + chunk_size] for i in range(0, len(markdown), chunk_size))
+    assert printer.live_print(chunks) == markdown
+    assert output(printer.console) == output(expected_console)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 16, len(MARKDOWN)])
+def test_markdown_live_print(chunk_size):
+    assert_live_print(MARKDOWN, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, len(REFERENCES)])
+def test_markdown_live_print_references(chunk_size):
+    # Blocks are not printed before definitions of their reference links.
+    assert_live_print(REFERENCES, chunk_size)
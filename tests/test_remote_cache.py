@@ -0,0 +1,77 @@
+import time
+from pathlib import Path
+from threading import Thread
+
+import pytest
+
+from sgpt.cache import Cache, SqliteCache
+from sgpt.cache_policy import CachePolicy
+from sgpt.cache_server import CacheServer
+from sgpt.remote_cache import RemoteCache
+
+
+@pytest.fixture
+def server(tmp_path: Path):
+    server = CacheServer(("127.0.0.1", 0), SqliteCache(10, tmp_path / "server"), "t")
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+@pytest.mark.parametrize("cache_class", [Cache, SqliteCache])
+def test_remote_cache(tmp_path: Path, server: CacheServer, cache_class):
+    url = f"http://127.0.0.1:{server.server_port}"
+    calls: list[str] = []
+
+    def make_completion(name: str, remote: RemoteCache):
+        cache = cache_class(10, tmp_path / name, remote=remote)
+
+        @cache
+        def get_completion(self, prompt):
+            calls.append(name)
+            yield from prompt.upper()
+
+        def completion(prompt: str):
+            policy = CachePolicy()
+            chunks = get_completion(None, prompt=prompt, caching=True, policy=policy)
+            return "".join(chunks), policy.decision
+
+        return cache, completion
+
+    remote = RemoteCache(url, 1, "t")
+    _, first_completion = make_completion("first", remote)
+    assert first_completion("ls") == ("LS", "miss")
+    # Writes don't keep the process alive, it waits for them up to timeout.
+    assert all(thread.daemon for thread in remote.puts)
+    remote.wait(5)
+
+    # Another machine gets the entry from the server, and keeps it locally.
+    second, second_completion = make_completion("second", RemoteCache(url, 1, "t"))
+    assert second_completion("ls") == ("LS", "remote hit")
+    assert second_completion("ls") == ("LS", "hit")
+    assert second.counters.get()["remote_hits"] == 1
+    assert calls == ["first"]
+
+    # Entries are not shared without the token.
+    _, third_completion = make_completion("third", RemoteCache(url, 1, "wrong"))
+    assert third_completion("ls") == ("LS", "miss")
+    assert calls == ["first", "third"]
+
+    # Unavailable server is a miss after a short timeout.
+    server.shutdown()
+    failure_path = tmp_path / "remote.failed"
+    remote = RemoteCache(url, 0.2, "t", failure_path)
+    _, fourth_completion = make_completion("fourth", remote)
+    started = time.monotonic()
+    assert fourth_completion("pwd") == ("PWD", "miss")
+    assert time.monotonic() - started < 1
+    assert remote.puts == []
+
+    # Then it is not used for a while, by other processes either.
+    remote = RemoteCache(url, 5, "t", failure_path)
+    started = time.monotonic()
+    assert remote.get("0" * 32) is None
+    assert time.monotonic() - started < 1
@@ -1,6 +1,7 @@
 import json
 from pathlib import Path
 from unittest.mock import patch
+from uuid import uuid4
 
 from sgpt.config import cfg
 from sgpt.role import SystemRole
@@ -53,3 +54,30 @@ def test_role(completion):
     generated_json = json.loads(result.output)
     assert "foo" in generated_json
     path.unlink(missing_ok=True)
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_role_cache_policy(completion):
+    completion.side_effect = lambda *args, **kwargs: mock_comp("ls")
+    path = Path(cfg.get("ROLE_STORAGE_PATH")) / "no_cache_test.json"
+    role = {"name": "no_cache_test", "role": "You are no_cache_test"}
+    path.write_text(json.dumps({**role, "cache": {"enabled": False}}))
+    # Cache is kept between test runs.
+    prompt = f"list files {uuid4()}"
+    args = [prompt, "--role", "no_cache_test", "--stats", "--no-functions"]
+    for _ in range(2):
+        result = runner.invoke(app, args)
+        assert result.exit_code == 0
+        assert "cache bypass (role enabled=false)" in result.stderr
+    assert completion.call_count == 2
+
+    path.write_text(json.dumps({**role, "cache": {"ttl": "3600"}}))
+    runner.invoke(app, args)
+    result = runner.invoke(app, args)
+    assert "cache hit (role ttl=3600)" in result.stderr
+    assert completion.call_count == 3
+
+    path.write_text(json.dumps({**role, "cache": {"size": 1}}))
+    result = runner.invoke(app, args)
+    assert 'Unknown role cache setting "size"' in str(result.exception)
+    path.unlink()
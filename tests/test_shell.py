@@ -21,6 +21,7 @@ def test_shell(completion):
     assert "[E]xecute, [M]odify, [D]escribe, [A]bort:" in result.output
 
 
+@patch.dict(os.environ, {"PLAIN_OUTPUT": "false"})
 @patch("sgpt.printer.TextPrinter.live_print")
 @patch("sgpt.printer.MarkdownPrinter.live_print")
 @patch("sgpt.handlers.handler.completion")
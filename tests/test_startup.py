@@ -0,0 +1,63 @@
+import subprocess
+import sys
+
+import pytest
+
+from sgpt.role import DefaultRoles
+
+PROVIDER_MODULES = ("openai", "litellm", "httpx")
+
+# Runs sgpt in a fresh interpreter and reports which of modules got imported.
+SCRIPT = """
+import sys
+from sgpt import cli
+{setup}
+try:
+    cli()
+except SystemExit:
+    pass
+print([name for name in {modules} if name in sys.modules])
+"""
+
+# Replaces provider with completion which streams "ok".
+MOCK_COMPLETION = """
+from types import SimpleNamespace as Obj
+import sgpt.handlers.handler as handler
+delta = Obj(content="ok", tool_calls=None)
+chunk = Obj(choices=[Obj(delta=delta, finish_reason=None)])
+handler.completion = lambda **kwargs: iter([chunk])
+"""
+
+
+def imported_modules(
+    *args: str, modules: tuple[str, ...] = PROVIDER_MODULES, setup: str = ""
+) -> str:
+    script = SCRIPT.format(modules=modules, setup=setup)
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        capture_output=True,
+        text=True,
+        stdin=subprocess.DEVNULL,
+        check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ("--version",),
+        ("--list-chats",),
+        ("--list-roles",),
+        ("--show-role", DefaultRoles.DEFAULT.value),
+        ("--help",),
+    ],
+)
+def test_no_provider_imports(args):
+    assert imported_modules(*args) == "[]"
+
+
+def test_plain_output_without_rich():
+    args = ("hello", "--no-cache", "--no-functions")
+    imported = imported_modules(*args, modules=("rich",), setup=MOCK_COMPLETION)
+    assert imported == "[]"
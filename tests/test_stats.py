@@ -0,0 +1,60 @@
+import json
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+from sgpt.stats import RequestStats, percentile
+
+from .utils import app, cmd_args, mock_comp, runner
+
+
+def test_percentile():
+    values = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 90) == 0.9
+    assert percentile(values, 99) == 1.0
+    assert percentile([], 50) == 0.0
+
+
+def test_request_stats():
+    stats = RequestStats("model")
+    stats.start = 1.0
+    with patch("sgpt.stats.time.perf_counter") as perf_counter:
+        # (before, after) for each next() call, then finish.
+        times = [1.5, 1.6, 2.1, 2.2, 2.2, 2.3, 2.3, 2.3, 3.0]
+        perf_counter.side_effect = times
+        assert list(stats.track(iter(["a", "", "b"]))) == ["a", "", "b"]
+        stats.finish()
+    stats.add_tool_calls(1, 0.25)
+
+    result = stats.to_dict()
+    assert result["ttft"] == 0.6
+    assert result["total"] == 2.0
+    assert result["chunks"] == 2
+    assert result["gap_p50"] == 0.7
+    assert result["tool_calls"] == 1
+    assert result["tool_time"] == 0.25
+    # Time spent outside of next() calls is spent by printer.
+    assert result["render_time"] == 1.7
+
+
+@patch("sgpt.handlers.handler.completion")
+def test_stats_option(completion, tmp_path: Path):
+    completion.return_value = mock_comp("Prague")
+    stats_path = tmp_path / "stats.jsonl"
+
+    with patch.dict(os.environ, {"STATS_PATH": str(stats_path)}):
+        result = runner.invoke(app, cmd_args(prompt="capital?", **{"--stats": True}))
+        assert result.exit_code == 0
+        assert "Prague" in result.stdout
+        assert "ttft" in result.stderr
+
+        # Without --stats metrics are only written to the file.
+        result = runner.invoke(app, cmd_args(prompt="capital?"))
+        assert result.exit_code == 0
+        assert "ttft" not in result.stderr
+
+    records = [json.loads(line) for line in stats_path.read_text().splitlines()]
+    assert len(records) == 2
+    assert records[0]["chunks"] == len("Prague")
+    assert records[0]["tool_calls"] == 0
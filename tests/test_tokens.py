@@ -0,0 +1,22 @@
+from sgpt.tokens import estimate_tokens, messages_tokens, token_budget
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Hello world!") == 3
+    # Non-latin characters are about one token each.
+    assert estimate_tokens("Привет") == 6
+
+
+def test_messages_tokens():
+    messages = [{"role": "user", "content": "abcd"}, {"role": "assistant"}]
+    assert messages_tokens(messages) == 9
+
+
+def test_token_budget(monkeypatch):
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "gpt-4o:1000,ollama/llama3:8b:500,100")
+    assert token_budget("gpt-4o") == 1000
+    assert token_budget("ollama/llama3:8b") == 500
+    assert token_budget("other") == 100
+    monkeypatch.setenv("CHAT_TOKEN_BUDGET", "gpt-4o:1000")
+    assert token_budget("other") == 0